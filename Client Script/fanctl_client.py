@@ -1,13 +1,30 @@
 #!/usr/bin/python3
 
-import pigpio, time, socket, os, subprocess, signal, sys, datetime
-from threading import Thread
-
-# Set up log file
-log_file = "/home/ctl/logs/fanctl.log"
-log = open(log_file,'w')
-sys.stdout = log
-sys.stderr = log
+import pigpio, time, socket, selectors, os, signal, sys
+from threading import Thread, Lock
+
+# Shared fanctl modules live in ../Common (or next to this script)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from fanctl_proto import FrameReader, FrameWriter, Record, ShelfStatus, ShelfTelemetry, DUTY, SHELF_STATUS, SHELF_TELEMETRY, SHELF_STALLED, SHELF_NO_AMBIENT, SHELF_LOCAL
+from fanctl_net import ConnectionManager
+from fanctl_sched import Scheduler
+from fanctl_log import setup_logging, stop_logging, get_logger
+from fanctl_curve import FanCurve
+from fanctl_ramp import Ramp
+from fanctl_rpm import RpmMeter
+from fanctl_w1 import W1Reader, W1_DEVICES
+
+# Where to log, listen, send display updates and find the 1-Wire probes. The defaults are for the shelf controllers;
+# Simulator/bench.py --real-shelves sets these to run the client off-hardware with Simulator/fakes on PYTHONPATH.
+log_file = os.environ.get("FANCTL_CLIENT_LOG", "/home/ctl/logs/fanctl.log")
+listenAddress = os.environ.get("FANCTL_CLIENT_LISTEN")			# "IP:port"; by default our own IP, port 10000
+displayAddress = os.environ.get("FANCTL_CLIENT_DISPLAY", "10.0.10.100:10000")
+w1Devices = os.environ.get("FANCTL_W1_DEVICES", W1_DEVICES)
+
+# Set up log file. Lines are written in the background, the file is rotated when it gets big or old, and repeated
+# errors (like the display being down) are collapsed.
+setup_logging(log_file)
+log = get_logger("fanctl.client")
 
 # PWM output setup
 pi = pigpio.pi()
@@ -16,78 +33,183 @@ pi.set_PWM_frequency(3,25000)
 pi.set_PWM_range(3,100)
 pi.set_PWM_dutycycle(3,100)
 
-# RPM input setup
+# RPM input setup. Every tach edge (two per revolution) is timestamped; RPM comes from the time between them. If the
+# edges stop for a couple of periods, the tach pin's watchdog runs the RPM task right away to handle the stall.
 pi.set_mode(2, pigpio.INPUT)
 pi.set_pull_up_down(2, pigpio.PUD_UP)
-halfRevs = pi.callback(2)
+fanRpm = RpmMeter(pi, 2, pigpio.RISING_EDGE, on_stall=lambda: scheduler.trigger("rpm"))
 
 # Temperature input setup
-os.system("modprobe w1-gpio")
-os.system("modprobe w1-therm")
-sensor_id = subprocess.check_output("ls /sys/bus/w1/devices/ | grep 28-",shell=True).decode("utf-8").replace("\n","")
-temp_sensor = "/sys/bus/w1/devices/" + sensor_id + "/w1_slave"
-
-# Global vars
-global dutyCycle, oldDuty, ramp, cycleUpdate
-dutyCycle = 100
-oldDuty = dutyCycle
-ramp = dutyCycle
-cycleUpdate = False
-
-# Timestamps
-rpm_t1 = time.time()
-rpm_tDutyChange = rpm_t1
-pwm_t1 = rpm_t1
-temp_t1 = rpm_t1
-connect_t1 = rpm_t1
+if w1Devices == W1_DEVICES:
+	os.system("modprobe w1-gpio")
+	os.system("modprobe w1-therm")
 
 # User vars
 rpmFreq = 1
 tempFreq = 10
-rampSpeed = 1
+statsFreq = 3600		# How often (in seconds) to log probe error counts and tach glitches
+headSendTimeout = 5		# Drop the head's connection if telemetry to it makes no progress for this many seconds
+displayRefreshFreq = 60	# Resend our status to the display this often (in seconds) even if it hasn't changed, so the
+						# display doesn't take a shelf that's running steadily for one that's gone (its idle timeout)
+
+# Failsafe: if the head hasn't sent a duty cycle for headTimeout seconds (fanctl sends one every HDD sweep), run the
+# fans off the shelf's own ambient temp with this curve until it's back. With no ambient reading, or a stalled fan,
+# the fans go to 100%.
+headTimeout = 90
+localTempList = [25,28,31,34,37 ]
+localDutyList = [50,60,75,90,100]
+localHysteresis = 1
+localMinDwell = 60
+failsafeFreq = 5		# How often (in seconds) to check on the head, and to update the local curve while it's gone
+rampUpRate = 5			# Duty cycle ramp speed in %/sec going up...
+rampDownRate = 1		# ...and going down (slower, so the fans don't audibly hunt)
+rampMaxTime = 15		# No ramp takes longer than this many seconds; bigger changes ramp faster
+rampJumpAt = 100		# Duty cycles at or above this are applied at once with no ramp
+
+# Global vars. handle() and the tasks below run on different threads; stateLock covers the ramp and PWM output.
+fanRamp = Ramp(100, rampUpRate, rampDownRate, rampMaxTime, rampJumpAt)
+pwmDuty = 100
+stateLock = Lock()
+
+# When the last duty cycle came from the head, and whether we're running the local curve instead
+lastCommand = time.monotonic()
+localControl = False
+localCurve = FanCurve(localTempList, localDutyList, False, localHysteresis, localMinDwell)
 
 # RPM limits
 highLimit = 100
 lowLimit = 0
 
-# Once we get a socket connection, this processes the data it sends.
-def handle(socket):
-	global dutyCycle, oldDuty, ramp, cycleUpdate
+# Connections from the head (fanctl). Our telemetry goes back to it on the same connection it sends duty cycles on.
+# Like fanctl_net, sending never waits on the network: send() just replaces the latest telemetry waiting for that
+# connection and wakes its handle() thread, which writes it out when the socket can take it. A head that stops
+# reading only ever has one frame waiting, and is dropped once that makes no progress for headSendTimeout seconds.
+class HeadConn:
+	def __init__(self, sock):
+		self.sock = sock
+		self.writer = FrameWriter()
+		self.lock = Lock()
+		self.pending = None
+		self.outbuf = b""
+		self.stalledSince = None
+		# Written to by send() so handle() wakes up from its select
+		self.wakeRead, self.wakeWrite = socket.socketpair()
+		self.wakeRead.setblocking(False)
+		self.wakeWrite.setblocking(False)
+
+	def send(self, records):
+		with self.lock:
+			self.pending = records
+		try: self.wakeWrite.send(b"\0")
+		except OSError: pass
+
+	# Frame the latest telemetry once the last frame is out
+	def nextFrame(self):
+		with self.lock:
+			if not self.outbuf and self.pending is not None:
+				self.outbuf = self.writer.frame(self.pending)
+				self.pending = None
+			return self.outbuf
+
+	def close(self):
+		self.sock.close()
+		self.wakeRead.close()
+		self.wakeWrite.close()
+
+heads = set()
+headsLock = Lock()
+
+def send_to_heads(records):
+	with headsLock:
+		for conn in heads: conn.send(records)
+
+# Once we get a socket connection, this processes the data it sends and writes our telemetry back.
+def handle(clientSocket):
+	global lastCommand, localControl
 	MAX_LENGTH = 4096
-	print(datetime.datetime.today().strftime('%m-%d-%Y %H:%M:%S') + " - ", end = "")
-	print("Client connected!",flush=True)
+	reader = FrameReader()
+	log.info("Client connected!")
+
+	conn = HeadConn(clientSocket)
+	clientSocket.setblocking(False)
+	selector = selectors.DefaultSelector()
+	selector.register(clientSocket, selectors.EVENT_READ)
+	selector.register(conn.wakeRead, selectors.EVENT_READ)
+	with headsLock:
+		heads.add(conn)
+	# Let the new head know where we're at right away
+	with stateLock:
+		if headTelemetry is not None: conn.send([Record(SHELF_TELEMETRY, headTelemetry)])
 
 	# Continually loop while we have a connection
-	while 1:
-		# Process received data. This blocks further execution, so nothing below will run until we get new data here.
-		rcvBuffer = socket.recv(MAX_LENGTH).decode("utf-8")
-
-		# If we got new data, but it's NULL, the client disconnected. Exit function.
-		if rcvBuffer == '':
-			print(datetime.datetime.today().strftime('%m-%d-%Y %H:%M:%S') + " - ", end = "")
-			print("Client closed connection!",flush=True)
-			return
-		try:
-			# rcvBuffer should contain a number, 0 to 100, that indicates the desired duty cycle. Correct for out of bounds values.
-			rcvBuffer = int(rcvBuffer)
-			if rcvBuffer > highLimit: rcvBuffer = highLimit
-			if rcvBuffer < lowLimit: rcvBuffer = lowLimit
-		except:
-			# Correct for any corrupt (non-numerical, etc) values received
-			rcvBuffer = dutyCycle
-			pass
-
-		# If we're in the middle of a duty cycle ramp, the current ramp value becomes the old duty cycle
-		if cycleUpdate == True:
-			oldDuty = ramp
-		else:
-			# If not, start a duty cycle ramp by storing the original duty cycle
-			oldDuty = dutyCycle
-			ramp = dutyCycle
-
-		# Set the desired duty cycle value and mark that we need to update our duty cycle output
-		dutyCycle = int(rcvBuffer)
-		cycleUpdate = True
+	try:
+		while 1:
+			# Wait for data from the head, new telemetry to send, or room to send what's waiting
+			writing = bool(conn.nextFrame())
+			selector.modify(clientSocket, selectors.EVENT_READ | (selectors.EVENT_WRITE if writing else 0))
+			events = selector.select(1.0)
+			now = time.monotonic()
+			rcvBuffer = None
+			for key, mask in events:
+				if key.fileobj is conn.wakeRead:
+					try: conn.wakeRead.recv(MAX_LENGTH)
+					except OSError: pass
+					continue
+				if mask & selectors.EVENT_WRITE:
+					try: sent = clientSocket.send(conn.outbuf)
+					except (BlockingIOError, InterruptedError): sent = 0
+					except OSError: sent = -1
+					if sent < 0: rcvBuffer = b''
+					elif sent:
+						with conn.lock: conn.outbuf = conn.outbuf[sent:]
+						conn.stalledSince = None
+				if mask & selectors.EVENT_READ and rcvBuffer is None:
+					try: rcvBuffer = clientSocket.recv(MAX_LENGTH)
+					except (BlockingIOError, InterruptedError): pass
+					except OSError: rcvBuffer = b''
+
+			# Drop a head that hasn't taken any of our telemetry for headSendTimeout seconds
+			if conn.outbuf:
+				if conn.stalledSince is None: conn.stalledSince = now
+				elif now - conn.stalledSince > headSendTimeout:
+					log.error("Could not send telemetry to the head", reason="no progress for " + str(headSendTimeout) + " sec")
+					return
+			else: conn.stalledSince = None
+			if rcvBuffer is None: continue
+
+			# If we got new data, but it's NULL, the client disconnected. Exit function.
+			if rcvBuffer == b'':
+				log.info("Client closed connection!")
+				return
+
+			# Pull the duty cycle records out of whatever frames arrived; if several came at once, the last one wins
+			newDuty = None
+			for seq, records in reader.feed(rcvBuffer):
+				for record in records:
+					if record.type == DUTY: newDuty = record.value
+			if newDuty is None: continue
+
+			# The duty cycle should be 0 to 100. Correct for out of bounds values.
+			if newDuty > highLimit: newDuty = highLimit
+			if newDuty < lowLimit: newDuty = lowLimit
+
+			# fanctl resends the same duty cycle on every HDD sweep. Only start a ramp when it actually changes. If we're
+			# in the middle of a ramp, the new one starts from where that one is. Hearing from the head ends local
+			# control; its duty cycle is ramped to from wherever the local curve left off.
+			with stateLock:
+				lastCommand = time.monotonic()
+				handback = localControl
+				localControl = False
+				changed = fanRamp.set_target(int(newDuty),lastCommand)
+			if handback: log.info("Head is back, handing fan control back", duty=int(newDuty))
+			if changed:
+				# Update the PWM right away instead of waiting for the next ramp step
+				scheduler.trigger("ramp")
+	finally:
+		with headsLock:
+			heads.discard(conn)
+		selector.close()
+		conn.close()
 
 # This function listens for incoming socket connections. Once it gets a connection, it spins off a new thread to handle the communication
 # and goes back to listening for new connections.
@@ -96,15 +218,21 @@ def listen():
 	# way for me to tell which controller is which; their addresses are statically assigned, so I can look at their IP to see if they're in
 	# the head unit, shelf 1, etc. This lets me use the same exact script on both devices without having to change some global variable at
 	# the top to switch "modes" between the head unit, shelf 1, etc etc.
-	temp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-	temp_sock.connect(("8.8.8.8", 80))
-	client_ip = temp_sock.getsockname()[0]
-	temp_sock.close()
-
-	# Listen on the internal IP we detected above at port 10000
+	# (FANCTL_CLIENT_LISTEN skips all that.)
+	if listenAddress:
+		HOST, PORT = listenAddress.rsplit(":",1)
+		PORT = int(PORT)
+	else:
+		temp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		temp_sock.connect(("8.8.8.8", 80))
+		HOST = temp_sock.getsockname()[0]
+		temp_sock.close()
+		PORT = 10000
+
+	# Listen on the internal IP we detected above at port 10000. The port can be reused straight away, so a restart
+	# doesn't have to wait out connections from the last run.
 	serversocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-	PORT = 10000
-	HOST = client_ip
+	serversocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 	serversocket.bind((HOST, PORT))
 	serversocket.listen(10)
 
@@ -115,120 +243,164 @@ def listen():
 		ct = Thread(target=handle, args=(clientSocket,))
 		ct.start()
 
-# Read the temperature data from the attached thermal probe
-def read_temp():
-	# The temperature sensor is a file in /sys/bus/w1/devices/. Read that file and close it.
-	probe = open(temp_sensor, 'r')
-	lines = probe.readlines()
-	probe.close
-
-	# Check if the output is valid. If not, attempt to read the file again.
-	while lines[0].strip()[-3:] != 'YES':
-		time.sleep(0.2)
-		probe = open(temp_sensor, 'r')
-		lines = probe.readlines()
-		probe.close
-
-	# Locate the actual temperature data from the output
-	temp_output = lines[1].find('t=')
-
-	# If the output is sane, convert it to F and return the value as a string
-	if temp_output != -1:
-		temp_string = lines[1].strip()[temp_output+2:]
-		temp = float(temp_string) / 1000.0 * 9.0 / 5.0 + 32.0
-		return str(int(temp))
-	else:
-		return 0
-
 # Stuff to run when the script stops from SIGTERM
 def close_client(signum, frame):
-	callback.cancel()
-	GPIO.cleanup()
+	scheduler.stop()
+	net.stop()
+	fanRpm.cancel()
+	probes.stop()
 	pi.stop()
+	log.info("Client terminating.")
+	stop_logging()
+	os._exit(0)
+
+### Tasks
+# Each of these runs on a timer from the scheduler below, so the script sleeps between them instead of spinning on
+# time.time() checks: the main thread just waits for the scheduler to stop.
+
+# While a duty cycle ramp is going, set the PWM to wherever the ramp is now, then sleep until it's due to move by
+# another percent. Runs right away when a new duty cycle arrives, and stops rescheduling itself once the ramp is done.
+def ramp_step():
+	global pwmDuty
+	with stateLock:
+		now = time.monotonic()
+		duty = fanRamp.value(now)
+		if duty != pwmDuty:
+			pi.set_PWM_dutycycle(3,duty)
+			pwmDuty = duty
+		if fanRamp.ramping(now):
+			scheduler.trigger("ramp",fanRamp.next_change(now))
+	publish_status()
+
+# Every rpmFreq seconds (1 by default), take the median fan RPM over the last few revolutions and log when the fan
+# stalls or starts again. Also runs as soon as the tach watchdog sees no edge for a couple of periods (about 40 ms at
+# 1500 RPM), so a stall doesn't wait for the next poll. A stalled fan goes straight to 100% (the most it can be given
+# to get going again); the head sees the stall in our telemetry and keeps it there until it's running.
+def measure_rpm():
+	global rpms, fanStalled
+	rpms = fanRpm.median_rpm()
+	stalled = fanRpm.stalled() and pwmDuty > 0
+	# Keep the watchdog in step with the fan's speed (a fan that's meant to be stopped has nothing to watch for)
+	fanRpm.arm_watchdog(pwmDuty > 0)
+	if stalled != fanStalled:
+		fanStalled = stalled
+		if stalled:
+			log.error("Fan stalled", duty=pwmDuty, glitches=fanRpm.glitches)
+			with stateLock:
+				changed = fanRamp.emergency(time.monotonic())
+			if changed: scheduler.trigger("ramp")
+		else: log.info("Fan running again", rpm=rpms)
+	publish_status()
+
+# Every tempFreq seconds (10 by default), pick up the ambient temperature the probe reader last got. If no probe has
+# a recent reading, keep the last one.
+def measure_temp():
+	global ambTemp, ambFresh
+	temp = probes.ambient()
+	ambFresh = temp is not None
+	if ambFresh: ambTemp = temp
+	publish_status()
+
+# Every failsafeFreq seconds, check when the head last sent a duty cycle. Once it's been quiet for headTimeout seconds,
+# set the fans from the local curve instead, until handle() gets a duty cycle again.
+def failsafe_check():
+	global localControl
+	if time.monotonic() - lastCommand < headTimeout: return
+	temp = probes.ambient()
+	with stateLock:
+		# Check again in case a duty cycle just came in
+		now = time.monotonic()
+		silent = now - lastCommand
+		if silent < headTimeout: return
+		takeover = not localControl
+		localControl = True
+		if temp is None or fanStalled:
+			duty = 100
+			changed = fanRamp.emergency(now)
+		else:
+			duty = localCurve.update(temp, now)
+			changed = fanRamp.set_target(duty, now)
+	if takeover: log.error("No duty cycle from the head, running the local fan curve", silent_for=int(silent))
+	if changed:
+		log.info("Local fan curve setting fans to " + str(duty) + "%", ambient=temp)
+		scheduler.trigger("ramp")
+
+# Every statsFreq seconds, log each probe's last reading and error counts, and how many tach glitches were dropped
+def log_stats():
+	for line in probes.summary():
+		log.info("Probe " + line)
+	log.info("Fan tach: " + str(fanRpm.edges) + " edges, " + str(fanRpm.glitches) + " glitches", rpm=fanRpm.rpm(), median_rpm=fanRpm.median_rpm())
+
+# Sends updated data to the display, including fan duty cycle, ramp state, RPM, and ambient temp, and the same
+# (plus stall and probe flags) back to the head
+def publish_status():
+	global displayStatus, headTelemetry
+	with stateLock:
+		displayStatus_old = displayStatus
+		headTelemetry_old = headTelemetry
+		ramping = fanRamp.ramping(time.monotonic())
+		if ramping:
+			# If we're in the middle of a ramp, send the old duty cycle, the new duty cycle, the current ramp value, and temperature
+			displayStatus = ShelfStatus(pwmDuty, fanRamp.target, fanRamp.start, 1, rpms, ambTemp)
+		else:
+			# If we're not in a ramp, just send current duty cycle, rpm, and temperature
+			displayStatus = ShelfStatus(pwmDuty, pwmDuty, pwmDuty, 0, rpms, ambTemp)
+		flags = (SHELF_STALLED if fanStalled else 0) | (0 if ambFresh else SHELF_NO_AMBIENT) | (SHELF_LOCAL if localControl else 0)
+		headTelemetry = ShelfTelemetry(pwmDuty, fanRamp.target, 1 if ramping else 0, rpms, ambTemp, flags)
+		# Queue the data for the display and head if it changed. Queueing never blocks (if the display or head is
+		# slow or down, the newest status replaces the one still waiting), so it's done under the lock: the tasks
+		# calling this run on different lanes, and this way the last status queued is always the newest one.
+		if displayStatus_old != displayStatus:
+			net.send("display","status",[Record(SHELF_STATUS, displayStatus)])
+		if headTelemetry_old != headTelemetry:
+			send_to_heads([Record(SHELF_TELEMETRY, headTelemetry)])
+
+# Every displayRefreshFreq seconds, send the display our status again. publish_status() only sends changes, and a
+# shelf holding one duty cycle at a steady temp can go a long time without any.
+def refresh_display():
+	with stateLock:
+		if displayStatus is not None: net.send("display","status",[Record(SHELF_STATUS, displayStatus)])
 
 signal.signal(signal.SIGTERM,close_client)
 
+# The ramp and RPM tasks share a lane since the stall check looks at the PWM output. The temp task only picks up the
+# probe reader's last reading (the 1-Wire conversions happen on W1Reader's own thread), but keeps a lane of its own.
+scheduler = Scheduler()
+scheduler.add("ramp",None,ramp_step,lane="fan")
+scheduler.add("rpm",rpmFreq,measure_rpm,lane="fan",delay=rpmFreq)
+scheduler.add("temp",tempFreq,measure_temp,delay=tempFreq)
+scheduler.add("failsafe",failsafeFreq,failsafe_check,lane="fan",delay=failsafeFreq)
+scheduler.add("stats",statsFreq,log_stats,delay=statsFreq)
+scheduler.add("refresh",displayRefreshFreq,refresh_display,delay=displayRefreshFreq)
+
+# Start reading the ambient temp probes in the background, and give them one conversion to get a first reading
+probes = W1Reader(tempFreq, w1Devices)
+probes.start()
+probes.ready.wait(2)
+ambTemp = probes.ambient()
+ambFresh = ambTemp is not None
+if not ambFresh: ambTemp = 0.0
+
+# Set starting status for the display and head
+displayStatus = None
+headTelemetry = None
+rpms = 0
+fanStalled = False
+
 # Start the socket listening function in a new thread
 sock = Thread(target=listen)
 sock.start()
 
-# Read the ambient temp for the first time
-ambTemp = read_temp()
-
-# Set starting text for the display
-displayText = "Fans @ 100%;0"
-rpms = "0"
-
-# Set up pre-connection stuff for socket connection w/ display
-connectedToDisplay = False
-sock_display = socket.socket()
-
-# Loop continually
-while 1:
-	# If we aren't connected to the display (as we won't be when this first runs), attempt to connect
-	if connectedToDisplay == False:
-		connect_t2 = time.time()
-		if connect_t2 - connect_t1 > 5:
-			try:
-				sock_display.connect(("10.0.10.100", 10000))
-				print(datetime.datetime.today().strftime('%m-%d-%Y %H:%M:%S') + " - ", end = "")
-				print("Connected to display at " + sock_display.getpeername()[0],flush=True)
-				connectedToDisplay = True
-			except:
-				print(datetime.datetime.today().strftime('%m-%d-%Y %H:%M:%S') + " - ", end = "")
-				print("Connection error with display, trying again in 5 sec",flush=True)
-				connect_t1 = connect_t2
-				pass
-
-	# Detect if the duty cycle ramp is finished. If it is, stop the ramp and reset the RPM tick tally
-	if cycleUpdate == True and (ramp == dutyCycle or oldDuty == dutyCycle):
-		cycleUpdate = False
-		rpm_tDutyChange = rpm_t2
-		halfRevs.reset_tally()
-
-	# This stuff was ported directly from the arduino code that didn't support threading, so it's implemented
-	# in kind of a dumb way currently. As the thing is looping, it checks the timestamp over and over and if 
-	# enough time has elapsed, it does whatever action is inside the if statement. This first one runs every
-	# tempFreq seconds (10 by default) and reads the ambient temperature.
-	temp_t2 = time.time()
-	if temp_t2 - temp_t1 >= tempFreq:
-		ambTemp = read_temp()
-		temp_t1 = temp_t2
-
-	# This one runs every rpmFreq seconds (1 by default) and calculates the fan RPMs. It runs a rolling average
-	# that keeps going until the next duty cycle update (otherwise the value tends to bounce around a lot)
-	rpm_t2 = time.time()
-	if rpm_t2 - rpm_t1 >= rpmFreq:
-		ticks = halfRevs.tally()
-		rpms = str(int(ticks / (rpm_t2 - rpm_tDutyChange) / 2 * 60))
-		rpm_t1 = rpm_t2
-
-	# This runs every rampSpeed seconds (1 by default) and bumps the duty cycle up or down one tick if we're in
-	# the middle of a duty cycle ramp. If we're not in a duty cycle ramp, this gets skipped.
-	pwm_t2 = time.time()
-	if cycleUpdate == True and pwm_t2 - pwm_t1 >= rampSpeed:
-		if oldDuty < dutyCycle: ramp += 1
-		if oldDuty > dutyCycle: ramp -= 1
-		pi.set_PWM_dutycycle(3,ramp)
-		pwm_t1 = pwm_t2
-
-	# Sends updated data to the display, including fan duty cycle, RPM, and ambient temp
-	displayText_old = displayText
-	if cycleUpdate == True:
-		# If we're in the middle of a ramp, show the old duty cycle, the new duty cycle, the current ramp value, and temperature
-		displayText = "Fans " + str(ramp) + "% (" + str(oldDuty) + "% -> " + str(dutyCycle) + "%);" + ambTemp
-	else:
-		# If we're not in a ramp, just show current duty cycle, rpm, and temperature
-		displayText = "Fans " + str(dutyCycle) + "% @ " + rpms + " RPM;" + ambTemp
-	# Attempt to send the data to the display. If we can't, set the "connectedToDisplay" value to False so we attempt to reconnect next loop.
-	# We don't want our PWM updates to stop because we can't connect to the display, so this is set up to not block.
-	if displayText_old != displayText:
-		try:
-			sock_display.send(displayText.encode("utf-8"))
-		except:
-			print(datetime.datetime.today().strftime('%m-%d-%Y %H:%M:%S') + " - ", end = "")
-			print("Not connected to display web socket!",flush=True)
-			connectedToDisplay = False
-			sock_display.close()
-			sock_display = socket.socket()
-			pass
\ No newline at end of file
+# The connection to the display is kept up in the background, so a missing display never holds up the PWM loop.
+# Only the latest status is kept while it's unreachable.
+def display_connected(peer):
+	# The display has nothing from us yet; send the current status even if it hasn't changed
+	if displayStatus is not None: net.send("display","status",[Record(SHELF_STATUS, displayStatus)])
+
+net = ConnectionManager()
+displayHost, displayPort = displayAddress.rsplit(":",1)
+net.add("display",(displayHost, int(displayPort)),on_connect=display_connected)
+net.start()
+
+# Run the tasks until SIGTERM
+scheduler.run()
@@ -0,0 +1,64 @@
+###
+# PWM ramp for the fanctl shelf client
+###
+
+# Moves the fan duty cycle toward a target along a straight line in time instead of one tick per fixed interval.
+# Going up and going down have their own rates (in % per second), and no ramp takes longer than max_duration seconds:
+# a big change just ramps faster. Targets at or above jump_at are applied at once with no ramp, so fans get to full
+# speed immediately when the head asks for it; emergency() does the same from the client side.
+#
+# value(now) is where the ramp is at any moment, so the caller can update the PWM as often as it likes;
+# next_change(now) says how long until the value moves by another whole percent, so it only has to wake up then.
+
+class Ramp:
+	def __init__(self, duty, up_rate=5.0, down_rate=1.0, max_duration=15.0, jump_at=100):
+		self.up_rate = up_rate
+		self.down_rate = down_rate
+		self.max_duration = max_duration
+		self.jump_at = jump_at
+		self.start = duty
+		self.target = duty
+		self.rate = 0.0
+		self.t0 = 0.0
+		self.t1 = 0.0
+
+	# Start ramping from wherever the ramp is now toward target. Returns False if that's already the target.
+	def set_target(self, target, now):
+		if target == self.target: return False
+		current = self.value(now)
+		self.start = current
+		self.target = target
+		self.t0 = now
+		delta = abs(target - current)
+		if target >= self.jump_at or delta == 0:
+			self.rate = 0.0
+			self.t1 = now
+			return True
+		self.rate = self.up_rate if target > current else self.down_rate
+		if self.max_duration and delta / self.rate > self.max_duration: self.rate = delta / self.max_duration
+		self.t1 = now + delta / self.rate
+		return True
+
+	# Go straight to 100% whatever jump_at is (e.g., a stalled fan, or a lost head and no ambient reading). Returns
+	# False if the fans were already there.
+	def emergency(self, now):
+		if self.target == 100 and not self.ramping(now): return False
+		self.start = self.target = 100
+		self.rate = 0.0
+		self.t0 = self.t1 = now
+		return True
+
+	def ramping(self, now):
+		return now < self.t1
+
+	# Duty cycle (whole percent) at time now
+	def value(self, now):
+		if now >= self.t1: return self.target
+		moved = int(self.rate * (now - self.t0))
+		return self.start + moved if self.target > self.start else self.start - moved
+
+	# Seconds until value() next changes, or None once the ramp is done
+	def next_change(self, now):
+		if now >= self.t1: return None
+		steps = int(self.rate * (now - self.t0)) + 1
+		return max(0.0, min(self.t1, self.t0 + steps / self.rate) - now)
@@ -0,0 +1,102 @@
+###
+# Fan RPM measurement for the fanctl shelf client
+###
+
+# Instead of dividing a pulse tally by the time since the last duty change (an average that lags further behind the
+# longer it runs), RpmMeter timestamps every tach edge and works out RPM from the time between edges. The pigpio
+# callback only writes the edge's tick into a fixed ring buffer; all the math happens when someone asks for a reading.
+#
+# rpm() is the speed over the last edge-to-edge period; median_rpm() is the median over the last window periods,
+# which rides out the odd missed or doubled pulse. Edges closer together than a fan spinning at max_rpm could make are
+# counted as glitches and dropped (pigpio's own glitch filter catches the shortest ones before they get to us).
+# stalled() is true once no edge has come in for stall_periods times the recent median period, or for as long as a
+# fan at min_rpm would take, whichever is sooner. So that a stall is noticed that quickly without polling every few
+# ms, arm_watchdog() sets pigpio's watchdog on the tach pin to the same limit, and on_stall is called (from pigpio's
+# callback thread) when it fires.
+
+### Libraries:
+# array for the tick ring buffer
+from array import array
+
+TICK_MASK = 0xffffffff		# pigpio ticks are microseconds, wrapping at 32 bits
+TIMEOUT = 2					# level pigpio passes to callbacks when a watchdog fires
+MAX_WATCHDOG = 60000		# longest watchdog pigpio takes, in ms
+
+class RpmMeter:
+	def __init__(self, pi, gpio, edge, pulses_per_rev=2, size=64, window=16, max_rpm=6000, min_rpm=100, stall_periods=2,
+			on_stall=None):
+		self.pi = pi
+		self.gpio = gpio
+		self.on_stall = on_stall
+		self.pulses_per_rev = pulses_per_rev
+		self.window = min(window, size - 1)
+		self.stall_periods = stall_periods
+		# Shortest and longest believable time between edges, in microseconds
+		self.min_period = int(60000000 / (max_rpm * pulses_per_rev))
+		self.max_period = int(60000000 / (min_rpm * pulses_per_rev))
+		self.size = size
+		self.ticks = array("L", [0] * size)
+		self.edges = 0
+		self.glitches = 0
+		self.last = 0
+		self.watchdog = 0
+		pi.set_glitch_filter(gpio, self.min_period // 4)
+		self._cb = pi.callback(gpio, edge, self._edge)
+
+	# pigpio callback: record the tick, nothing else (or pass a watchdog timeout on)
+	def _edge(self, gpio, level, tick):
+		if level == TIMEOUT:
+			if self.on_stall is not None: self.on_stall()
+			return
+		if self.edges and (tick - self.last) & TICK_MASK < self.min_period:
+			self.glitches += 1
+			return
+		self.ticks[self.edges % self.size] = tick
+		self.last = tick
+		self.edges += 1
+
+	# Up to n of the most recent edge-to-edge periods, newest first
+	def _periods(self, n):
+		edges = self.edges
+		n = min(n, edges - 1, self.size - 1)
+		ticks = self.ticks
+		size = self.size
+		return [(ticks[(edges - 1 - i) % size] - ticks[(edges - 2 - i) % size]) & TICK_MASK for i in range(max(n, 0))]
+
+	def _rpm(self, period):
+		return int(60000000 / (period * self.pulses_per_rev)) if period else 0
+
+	def median_period(self):
+		periods = sorted(self._periods(self.window))
+		return periods[len(periods) // 2] if periods else 0
+
+	# Microseconds without an edge before the fan counts as stalled
+	def stall_limit(self):
+		expected = self.median_period()
+		return min(self.stall_periods * expected, self.max_period) if expected else self.max_period
+
+	def stalled(self):
+		if self.edges == 0: return True
+		return (self.pi.get_current_tick() - self.last) & TICK_MASK > self.stall_limit()
+
+	# Set the watchdog to fire once the fan has gone stall_limit() without an edge (rounded up to the next ms). Call
+	# it again as the speed changes. It's off while the fan is stalled, or when enabled is False (e.g., at 0% duty),
+	# since it would keep firing every few ms; whoever polls stalled() sees the fan start again.
+	def arm_watchdog(self, enabled=True):
+		timeout = min(MAX_WATCHDOG, self.stall_limit() // 1000 + 1) if enabled and not self.stalled() else 0
+		if timeout != self.watchdog:
+			self.pi.set_watchdog(self.gpio, timeout)
+			self.watchdog = timeout
+
+	def rpm(self):
+		if self.stalled(): return 0
+		periods = self._periods(1)
+		return self._rpm(periods[0]) if periods else 0
+
+	def median_rpm(self):
+		if self.stalled(): return 0
+		return self._rpm(self.median_period())
+
+	def cancel(self):
+		if self.watchdog: self.pi.set_watchdog(self.gpio, 0)
+		self._cb.cancel()
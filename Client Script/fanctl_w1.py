@@ -0,0 +1,129 @@
+###
+# 1-Wire temperature probes for the fanctl shelf client
+###
+
+# Reads every DS18B20 (28-*) probe on the 1-Wire bus from a background thread, so nothing else ever waits out the
+# ~750ms conversion. Where the kernel supports it (w1_therm's therm_bulk_read), one write starts a conversion on all
+# probes at once and each probe is then read without converting again; otherwise the probes are converted and read
+# one at a time. Probes are looked for again every cycle, so one that's plugged in later (or drops off) is picked up.
+#
+# The latest reading from each probe is cached with the time it was taken. A reading that fails its CRC, or that's
+# the 85C a DS18B20 reports before its first conversion, is counted and skipped; the probe keeps its last good value
+# until the next cycle instead of being retried in a loop.
+
+### Libraries:
+# os and glob to find the probes and bus masters
+# threading for the reader thread
+# time for reading timestamps
+# fanctl_log to log probes that come and go or fail
+import os, glob, threading, time
+from fanctl_log import get_logger
+
+log = get_logger("fanctl.w1")
+
+W1_DEVICES = "/sys/bus/w1/devices"
+POWER_ON_TEMP = 85.0
+
+class W1Reader(threading.Thread):
+	def __init__(self, interval=10, base=W1_DEVICES, conversion_time=0.75):
+		threading.Thread.__init__(self, name="w1", daemon=True)
+		self.interval = interval
+		self.base = base
+		self.conversion_time = conversion_time
+		self.lock = threading.Lock()
+		# probe id -> (temp in C, time.time() it was read)
+		self.readings = {}
+		self.crc_errors = {}
+		self.errors = {}
+		self.cycles = 0
+		self.ready = threading.Event()
+		self._stopping = threading.Event()
+
+	def probes(self):
+		return sorted(os.path.basename(path) for path in glob.glob(os.path.join(self.base, "28-*")))
+
+	# Start a conversion on every probe on every bus master that supports it, and wait for it to finish. Returns False
+	# if there's no bulk conversion, so each probe converts when it's read.
+	def _bulk_convert(self):
+		masters = glob.glob(os.path.join(self.base, "w1_bus_master*", "therm_bulk_read"))
+		if not masters: return False
+		try:
+			for path in masters:
+				with open(path, "w") as f: f.write("trigger\n")
+			deadline = time.monotonic() + self.conversion_time * 2
+			self._stopping.wait(self.conversion_time)
+			for path in masters:
+				# -1 while a conversion is still going
+				while time.monotonic() < deadline:
+					with open(path) as f:
+						if f.read().strip() != "-1": break
+					self._stopping.wait(0.05)
+		except OSError as e:
+			log.warning("1-Wire bulk conversion failed", reason=str(e))
+			return False
+		return True
+
+	# Temp from one probe's w1_slave, or None
+	def _read_probe(self, probe):
+		try:
+			with open(os.path.join(self.base, probe, "w1_slave")) as f: lines = f.readlines()
+		except OSError as e:
+			self.errors[probe] = self.errors.get(probe, 0) + 1
+			log.warning("Could not read 1-Wire probe", probe=probe, reason=str(e))
+			return None
+		if len(lines) < 2 or not lines[0].strip().endswith("YES"):
+			self.crc_errors[probe] = self.crc_errors.get(probe, 0) + 1
+			log.warning("1-Wire CRC error", probe=probe)
+			return None
+		pos = lines[1].find("t=")
+		if pos == -1:
+			self.errors[probe] = self.errors.get(probe, 0) + 1
+			return None
+		temp = int(lines[1][pos + 2:].strip()) / 1000.0
+		if temp == POWER_ON_TEMP:
+			self.errors[probe] = self.errors.get(probe, 0) + 1
+			return None
+		return temp
+
+	def read_all(self):
+		probes = self.probes()
+		with self.lock:
+			gone = [probe for probe in self.readings if probe not in probes]
+			for probe in gone: del self.readings[probe]
+		for probe in gone: log.warning("1-Wire probe is gone", probe=probe)
+		self._bulk_convert()
+		for probe in probes:
+			temp = self._read_probe(probe)
+			if temp is None: continue
+			with self.lock:
+				if probe not in self.readings: log.info("Found 1-Wire probe", probe=probe, temp=temp)
+				self.readings[probe] = (temp, time.time())
+		self.cycles += 1
+
+	def run(self):
+		while not self._stopping.is_set():
+			start = time.monotonic()
+			try: self.read_all()
+			except Exception:
+				log.exception("1-Wire read failed")
+			self.ready.set()
+			self._stopping.wait(max(0.0, self.interval - (time.monotonic() - start)))
+
+	def stop(self):
+		self._stopping.set()
+
+	# Hottest fresh reading over all probes (readings older than max_age seconds don't count), or None
+	def ambient(self, max_age=None):
+		cutoff = time.time() - (max_age if max_age is not None else self.interval * 3)
+		with self.lock:
+			temps = [temp for temp, when in self.readings.values() if when >= cutoff]
+		return max(temps) if temps else None
+
+	# One line per probe with its last reading and error counts
+	def summary(self):
+		with self.lock:
+			readings = dict(self.readings)
+		now = time.time()
+		return [probe + ": " + (str(readings[probe][0]) + "C " + str(int(now - readings[probe][1])) + " sec ago" if probe in readings else "no reading") +
+			", " + str(self.crc_errors.get(probe, 0)) + " CRC errors, " + str(self.errors.get(probe, 0)) + " other errors"
+			for probe in sorted(set(readings) | set(self.crc_errors) | set(self.errors))]
@@ -0,0 +1,72 @@
+###
+# Fan curves shared by fanctl and fanctl_client
+###
+
+# Turns a temp list and duty list (like cpu_temp_list/cpu_duty_list) into a lookup table with one entry per degree,
+# so picking a duty cycle is a single index instead of a scan. Temps at or below a list entry get that entry's duty
+# cycle, same as the old scan; below the first entry you get the first duty, above the last you get the last.
+# With interpolate, duties between list entries are linear instead of stepped.
+#
+# update() adds hysteresis and a minimum dwell time on top. The duty goes up as soon as the curve says so, but only
+# comes down once the temp has dropped hysteresis degrees below the step and the last change is at least min_dwell
+# seconds old. A temp bouncing across a step boundary then doesn't turn into a stream of BMC writes or shelf ramp
+# restarts. avoided counts how many duty changes the plain curve would have made that this one didn't.
+
+### Libraries:
+# array for the lookup table
+from array import array
+
+class FanCurve:
+	def __init__(self, temps, duties, interpolate=False, hysteresis=0, min_dwell=0):
+		self.hysteresis = hysteresis
+		self.min_dwell = min_dwell
+		self.base = temps[0]
+		self.table = array("B")
+		step = 0
+		for temp in range(temps[0], temps[-1] + 1):
+			while temps[step] < temp: step += 1
+			if interpolate and step > 0 and temps[step] != temp:
+				t0, t1 = temps[step - 1], temps[step]
+				d0, d1 = duties[step - 1], duties[step]
+				self.table.append(int(round(d0 + (d1 - d0) * (temp - t0) / (t1 - t0))))
+			else:
+				self.table.append(duties[step])
+		# Output state
+		self.duty = None
+		self.last_change = None
+		self._raw = None
+		self.changes = 0
+		self.raw_changes = 0
+
+	# Duty cycle for a temp straight off the curve
+	def lookup(self, temp):
+		index = int(temp) - self.base
+		if index < 0: index = 0
+		elif index >= len(self.table): index = len(self.table) - 1
+		return self.table[index]
+
+	# Duty cycle for a temp with hysteresis and dwell applied. now is any monotonic clock in seconds.
+	def update(self, temp, now):
+		raw = self.lookup(temp)
+		if self._raw is not None and raw != self._raw: self.raw_changes += 1
+		self._raw = raw
+
+		if self.duty is None:
+			new = raw
+		elif raw > self.duty:
+			# Always speed up right away
+			new = raw
+		else:
+			# Only slow down once we're clear of the step by the hysteresis margin, and not too soon after a change
+			new = self.lookup(temp + self.hysteresis)
+			if new > self.duty or now - self.last_change < self.min_dwell: new = self.duty
+		if new != self.duty:
+			if self.duty is not None: self.changes += 1
+			self.duty = new
+			self.last_change = now
+		return self.duty
+
+	# Duty changes the plain curve would have made that hysteresis/dwell saved us
+	@property
+	def avoided(self):
+		return max(0, self.raw_changes - self.changes)
@@ -0,0 +1,263 @@
+###
+# Logging shared by the fanctl scripts
+###
+
+# Log calls only put the record on a queue; a background thread does the formatting and the file writes, so logging
+# never costs the control loops any I/O. The log file is appended to (never truncated on restart), written through a
+# buffer that's flushed every flush_interval seconds, and rotated when it gets bigger than max_bytes or older than
+# max_age seconds, keeping backups old files.
+#
+# Warnings and errors that repeat are collapsed: the first one is written, identical ones in the next repeat_window
+# seconds are only counted, and then a single "(repeated N times in the last M sec)" line is written. A peer that stays
+# down for hours then costs a line a minute instead of a line per retry.
+#
+# Loggers take structured fields as keyword arguments, written as key=value after the message:
+#
+#	log = get_logger("fanctl.net")
+#	log.error("Lost connection", peer="shelf 1", reason="timed out")
+#	-> 10-18-2026 14:34:43 - ERROR: Lost connection peer="shelf 1" reason="timed out"
+#
+# Until setup_logging() is called, warnings and errors go to stderr and everything else is dropped.
+
+### Libraries:
+# logging and logging.handlers for the queue and rotating file handlers
+# queue for the record queue
+# threading for the writer thread
+# time to timestamp lines and time rotation/flushes
+# sys and atexit to catch stray output and flush on exit
+# os to find out when an existing log file was started
+import logging, logging.handlers, queue, threading, time, sys, atexit, os
+
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+ERROR = logging.ERROR
+
+DATE_FORMAT = '%m-%d-%Y %H:%M:%S'
+
+def _value(value):
+	text = str(value)
+	if text == "" or any(c in text for c in ' ="'): return '"' + text.replace('"', '\\"') + '"'
+	return text
+
+# Same layout as the old print() logging: "<date> - [ERROR: ]message key=value ..."
+class _Formatter(logging.Formatter):
+	def __init__(self):
+		logging.Formatter.__init__(self)
+		self._second = None
+		self._stamp = ""
+
+	def format(self, record):
+		second = int(record.created)
+		if second != self._second:
+			self._second = second
+			self._stamp = time.strftime(DATE_FORMAT, time.localtime(second))
+		text = record.getMessage()
+		if record.levelno >= ERROR: text = "ERROR: " + text
+		elif record.levelno >= WARNING: text = "WARNING: " + text
+		fields = getattr(record, "fields", None)
+		if fields: text += " " + " ".join([key + "=" + _value(value) for key, value in fields.items()])
+		line = self._stamp + " - " + text
+		if record.exc_text: line += "\n" + record.exc_text
+		return line
+
+# Only does what can't wait on the caller's thread: merging the message arguments, and turning a traceback into text
+# while its frames still exist. Formatting happens on the writer thread.
+class _QueueHandler(logging.handlers.QueueHandler):
+	def prepare(self, record):
+		record.msg = record.getMessage()
+		record.args = None
+		if record.exc_info:
+			record.exc_text = logging.Formatter().formatException(record.exc_info)
+			record.exc_info = None
+		return record
+
+# When an existing log file was started: its creation time where the filesystem keeps one, otherwise the date on its
+# first line (mtime and ctime move with every write, so they'd never let it get old)
+def _started(path):
+	try: info = os.stat(path)
+	except OSError: return time.time()
+	if getattr(info, "st_birthtime", 0): return info.st_birthtime
+	try:
+		with open(path, "r", errors="replace") as f: first = f.readline()
+		return time.mktime(time.strptime(first[:19], DATE_FORMAT))
+	except (OSError, ValueError, OverflowError):
+		return info.st_mtime
+
+# Rotates on size like RotatingFileHandler, and also once the current file is max_age seconds old (counting from when
+# the file was started, not when this process opened it, so restarts don't keep it from ever rotating). Lines are
+# buffered and only flushed by sync().
+class _RotatingFile(logging.handlers.RotatingFileHandler):
+	def __init__(self, path, max_bytes, backups, max_age):
+		logging.handlers.RotatingFileHandler.__init__(self, path, mode="a", maxBytes=max_bytes, backupCount=backups)
+		self.max_age = max_age
+		self._opened = _started(path)
+
+	def shouldRollover(self, record):
+		if self.max_age and record.created - self._opened >= self.max_age: return 1
+		if self.maxBytes > 0 and self.stream is not None and self.stream.tell() >= self.maxBytes: return 1
+		return 0
+
+	def doRollover(self):
+		logging.handlers.RotatingFileHandler.doRollover(self)
+		self._opened = time.time()
+
+	def flush(self):
+		pass
+
+	def sync(self):
+		self.acquire()
+		try:
+			if self.stream is not None: self.stream.flush()
+		finally:
+			self.release()
+
+# Collapses repeated warnings and errors before they reach the file
+class _RepeatFilter:
+	def __init__(self, target, window):
+		self.target = target
+		self.window = window
+		# (logger, level, message, fields) -> [first seen, times suppressed, last record]
+		self._seen = {}
+
+	def handle(self, record):
+		self.expire(record.created)
+		if record.levelno >= WARNING and self.window > 0:
+			fields = getattr(record, "fields", None)
+			# Same message with a different traceback is a different error
+			key = (record.name, record.levelno, record.getMessage(), tuple(sorted(fields.items())) if fields else (), record.exc_text)
+			entry = self._seen.get(key)
+			if entry is not None:
+				entry[1] += 1
+				entry[2] = record
+				return
+			self._seen[key] = [record.created, 0, record]
+		self.target.handle(record)
+
+	# Write a summary for anything that's been repeating for a whole window, and forget it
+	def expire(self, now):
+		for key, (first, count, record) in list(self._seen.items()):
+			if now - first < self.window: continue
+			del self._seen[key]
+			if count:
+				# Timed to the last repeat (now is infinity for the final flush at shutdown)
+				record.msg = record.getMessage() + " (repeated " + str(count) + " times in the last " + str(int(record.created - first)) + " sec)"
+				record.args = None
+				record.exc_text = None
+				self.target.handle(record)
+
+# File-like object that turns writes (stray print()s, library warnings) into log records. A traceback (e.g., from an
+# exception that killed a thread) is collected until its last line and logged as one record, so it stays in one piece
+# and isn't collapsed with lines from a different one.
+class _LogStream:
+	def __init__(self, logger, level):
+		self.logger = logger
+		self.level = level
+		self._buf = ""
+		self._traceback = None
+
+	def write(self, text):
+		self._buf += text
+		while "\n" in self._buf:
+			line, self._buf = self._buf.split("\n", 1)
+			self._line(line)
+		return len(text)
+
+	def _line(self, line):
+		if self._traceback is not None:
+			self._traceback.append(line)
+			# Frames and source lines are indented; the first line that isn't is the exception itself (each traceback of
+			# a chained exception is logged on its own)
+			if not line.strip() or line[0].isspace(): return
+			self.logger.log(self.level, "\n".join(self._traceback))
+			self._traceback = None
+		elif line.startswith("Traceback "):
+			self._traceback = [line]
+		elif line.strip():
+			self.logger.log(self.level, line)
+
+	def flush(self):
+		pass
+
+class _Writer(threading.Thread):
+	def __init__(self, records, handler, repeat_window, flush_interval):
+		threading.Thread.__init__(self, name="log", daemon=True)
+		self.records = records
+		self.handler = handler
+		self.filter = _RepeatFilter(handler, repeat_window)
+		self.flush_interval = flush_interval
+
+	def run(self):
+		last_sync = time.monotonic()
+		while True:
+			try: record = self.records.get(timeout=1)
+			except queue.Empty: record = False
+			if record is None: break
+			if record: self.filter.handle(record)
+			else: self.filter.expire(time.time())
+			if time.monotonic() - last_sync >= self.flush_interval:
+				self.handler.sync()
+				last_sync = time.monotonic()
+		self.filter.expire(float("inf"))
+		self.handler.sync()
+		self.handler.close()
+
+class FieldLogger:
+	def __init__(self, logger):
+		self.logger = logger
+
+	def _log(self, level, message, fields, exc_info=False):
+		if self.logger.isEnabledFor(level):
+			self.logger.log(level, message, exc_info=exc_info, extra={"fields": fields})
+
+	def debug(self, message, **fields):
+		self._log(DEBUG, message, fields)
+
+	def info(self, message, **fields):
+		self._log(INFO, message, fields)
+
+	def warning(self, message, **fields):
+		self._log(WARNING, message, fields)
+
+	def error(self, message, **fields):
+		self._log(ERROR, message, fields)
+
+	# Error with the current exception's traceback
+	def exception(self, message, **fields):
+		self._log(ERROR, message, fields, exc_info=True)
+
+def get_logger(name):
+	return FieldLogger(logging.getLogger(name))
+
+_writer = None
+
+# Send all logging (the fanctl loggers at level, everything else from WARNING up) to path through the background
+# writer. With capture_output, anything printed to stdout/stderr ends up in the log too.
+def setup_logging(path, level=INFO, max_bytes=10 * 1024 * 1024, max_age=7 * 86400, backups=4, repeat_window=60,
+		flush_interval=5, capture_output=True):
+	global _writer
+	handler = _RotatingFile(path, max_bytes, backups, max_age)
+	handler.setFormatter(_Formatter())
+	records = queue.Queue()
+	_writer = _Writer(records, handler, repeat_window, flush_interval)
+	_writer.start()
+
+	root = logging.getLogger()
+	for old in list(root.handlers): root.removeHandler(old)
+	root.addHandler(_QueueHandler(records))
+	root.setLevel(WARNING)
+	logging.getLogger("fanctl").setLevel(level)
+	logging.captureWarnings(True)
+	if capture_output:
+		sys.stdout = _LogStream(logging.getLogger("fanctl.stdout"), INFO)
+		sys.stderr = _LogStream(logging.getLogger("fanctl.stderr"), ERROR)
+	atexit.register(stop_logging)
+
+# Write out everything still queued and close the file
+def stop_logging():
+	global _writer
+	writer = _writer
+	if writer is None: return
+	_writer = None
+	writer.records.put(None)
+	writer.join(5)
@@ -0,0 +1,177 @@
+###
+# Metrics for the fanctl scripts
+###
+
+# Counters and latency histograms for the hot paths (smartctl and ipmitool calls, sensor reads, socket sends, task
+# runs), each labelled by things like disk or command so a single slow disk or a slow BMC stands out. Recording a
+# sample is a dict lookup and a few integer adds under a lock, cheap enough for every call.
+#
+# Histograms use fixed buckets from 1 ms to 60 s, like a Prometheus histogram; p50/p99 are estimated from the buckets.
+# The numbers can be scraped in Prometheus text format from a small HTTP server (serve()), or logged with summary().
+
+### Libraries:
+# threading to share metrics between tasks and for the HTTP server thread
+# time for the timer context manager
+# bisect to find a histogram bucket
+# http.server for the metrics endpoint
+import threading, time, bisect
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class Histogram:
+	def __init__(self):
+		self.counts = [0] * (len(BUCKETS) + 1)
+		self.count = 0
+		self.sum = 0.0
+		self.max = 0.0
+
+	def observe(self, value):
+		self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+		self.count += 1
+		self.sum += value
+		if value > self.max: self.max = value
+
+	# Estimate a quantile by interpolating inside the bucket it falls in
+	def quantile(self, q):
+		if self.count == 0: return 0.0
+		rank = q * self.count
+		seen = 0
+		for i, n in enumerate(self.counts):
+			if n and seen + n >= rank:
+				lower = BUCKETS[i - 1] if i > 0 else 0.0
+				upper = BUCKETS[i] if i < len(BUCKETS) else self.max
+				return min(self.max, lower + (upper - lower) * (rank - seen) / n)
+			seen += n
+		return self.max
+
+def _labels(labels):
+	return tuple(sorted(labels.items()))
+
+def _format_labels(labels, extra=()):
+	pairs = list(labels) + list(extra)
+	if not pairs: return ""
+	return "{" + ",".join([k + '="' + str(v).replace("\\", "\\\\").replace('"', '\\"') + '"' for k, v in pairs]) + "}"
+
+class _Timer:
+	__slots__ = ("metrics", "name", "labels", "start")
+
+	def __init__(self, metrics, name, labels):
+		self.metrics = metrics
+		self.name = name
+		self.labels = labels
+
+	def __enter__(self):
+		self.start = time.monotonic()
+		return self
+
+	def __exit__(self, *exc):
+		self.metrics._observe(self.name, self.labels, time.monotonic() - self.start)
+		return False
+
+class Metrics:
+	def __init__(self):
+		self._lock = threading.Lock()
+		# (name, labels) -> value / Histogram
+		self.counters = {}
+		self.gauges = {}
+		self.histograms = {}
+		self._server = None
+
+	def inc(self, name, value=1, **labels):
+		key = (name, _labels(labels))
+		with self._lock:
+			self.counters[key] = self.counters.get(key, 0) + value
+
+	def set(self, name, value, **labels):
+		with self._lock:
+			self.gauges[(name, _labels(labels))] = value
+
+	def observe(self, name, seconds, **labels):
+		self._observe(name, _labels(labels), seconds)
+
+	def _observe(self, name, labels, seconds):
+		key = (name, labels)
+		with self._lock:
+			histogram = self.histograms.get(key)
+			if histogram is None: histogram = self.histograms[key] = Histogram()
+			histogram.observe(seconds)
+
+	# with metrics.time("name", label=value): ... records how long the block took
+	def time(self, name, **labels):
+		return _Timer(self, name, _labels(labels))
+
+	### Output
+	# Everything in Prometheus text exposition format
+	def render(self):
+		lines = []
+		with self._lock:
+			for kind, values in (("counter", self.counters), ("gauge", self.gauges)):
+				last = None
+				for (name, labels), value in sorted(values.items()):
+					if name != last: lines.append("# TYPE " + name + " " + kind)
+					last = name
+					lines.append(name + _format_labels(labels) + " " + repr(value))
+			last = None
+			for (name, labels), histogram in sorted(self.histograms.items()):
+				if name != last: lines.append("# TYPE " + name + " histogram")
+				last = name
+				total = 0
+				for bound, n in zip(BUCKETS, histogram.counts):
+					total += n
+					lines.append(name + "_bucket" + _format_labels(labels, (("le", repr(float(bound))),)) + " " + str(total))
+				lines.append(name + "_bucket" + _format_labels(labels, (("le", "+Inf"),)) + " " + str(histogram.count))
+				lines.append(name + "_sum" + _format_labels(labels) + " " + repr(histogram.sum))
+				lines.append(name + "_count" + _format_labels(labels) + " " + str(histogram.count))
+		return "\n".join(lines) + "\n"
+
+	# One line per histogram with count, p50, p99 and max (in ms), slowest p99 first, then the counters
+	def summary(self):
+		with self._lock:
+			histograms = [(name + _format_labels(labels), h.count, h.quantile(0.5), h.quantile(0.99), h.max)
+				for (name, labels), h in self.histograms.items() if h.count]
+			counters = [(name + _format_labels(labels), value) for (name, labels), value in sorted(self.counters.items())]
+		histograms.sort(key=lambda h: h[3], reverse=True)
+		lines = [name + ": " + str(count) + " calls, p50 " + str(round(p50 * 1000, 1)) + "ms p99 " + str(round(p99 * 1000, 1)) +
+			"ms max " + str(round(worst * 1000, 1)) + "ms" for name, count, p50, p99, worst in histograms]
+		lines += [name + ": " + str(value) for name, value in counters]
+		return lines
+
+	# Counter values and histogram (count, p50, p99, max) by (name, labels), e.g. for a report that compares two
+	# points in time
+	def snapshot(self):
+		with self._lock:
+			counters = dict(self.counters)
+			histograms = {key: (h.count, h.quantile(0.5), h.quantile(0.99), h.max) for key, h in self.histograms.items()}
+		return counters, histograms
+
+	# Serve render() at http://<host>:<port>/metrics from a background thread
+	def serve(self, port, host=""):
+		metrics = self
+
+		class Handler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				if self.path.split("?")[0] != "/metrics":
+					self.send_error(404)
+					return
+				body = metrics.render().encode("utf-8")
+				self.send_response(200)
+				self.send_header("Content-Type", "text/plain; version=0.0.4")
+				self.send_header("Content-Length", str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			# Keep scrapes out of the log
+			def log_message(self, format, *args):
+				pass
+
+		class Server(ThreadingMixIn, HTTPServer):
+			daemon_threads = True
+
+		self._server = Server((host, port), Handler)
+		threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True).start()
+
+	def stop(self):
+		if self._server is not None: self._server.shutdown()
@@ -0,0 +1,267 @@
+###
+# Connection manager shared by the fanctl scripts
+###
+
+# Owns the outgoing TCP connections to the shelf controllers and the display. Everything happens on one background
+# thread with non-blocking sockets, so a peer that is down, slow or unreachable never holds up the caller: send()
+# just drops the records in the peer's queue and returns. Connecting is retried with exponential backoff, sockets use
+# TCP keepalive so a peer that vanished without closing the connection is noticed, and a send that makes no progress
+# for send_timeout seconds drops the connection.
+#
+# Each peer's queue holds the latest value per key (e.g., "duty" or "cpu"); sending a new value under a key that is
+# still waiting replaces the old one, so a peer that can't keep up gets the newest data instead of a growing backlog.
+# Whatever is queued when the socket is ready goes out together in one frame. Queued values are kept across
+# reconnects, so a peer gets the latest state as soon as it's back. With a fanctl_metrics.Metrics, send() call times,
+# bytes sent, replaced values and dropped connections are recorded per peer.
+
+### Libraries:
+# socket, selectors, errno and os for the non-blocking connections
+# threading for the background thread
+# time for the monotonic clock
+# collections for the send queues
+# fanctl_proto for framing
+# fanctl_log to log connects, drops and callback errors
+import socket, selectors, errno, os, threading, time, collections
+from fanctl_proto import FrameWriter, FrameReader, ProtocolError, MAX_RECORDS
+from fanctl_log import get_logger
+
+log = get_logger("fanctl.net")
+
+class Peer:
+	def __init__(self, name, address, on_frames, on_connect):
+		self.name = name
+		self.address = address
+		self.on_frames = on_frames
+		self.on_connect = on_connect
+		self.sock = None
+		self.connected = False
+		self.writer = FrameWriter()
+		self.reader = FrameReader()
+		# key -> records, oldest key first
+		self.queue = collections.OrderedDict()
+		self.outbuf = b""
+		self.stalled_since = None
+		self.connect_deadline = 0
+		self.next_attempt = 0
+		self.backoff = 0
+		self.attempts = 0
+		# Stats
+		self.frames_sent = 0
+		self.replaced = 0
+		self.drops = 0
+
+	def summary(self):
+		return (self.name + ": " + ("connected" if self.connected else "disconnected") + ", " + str(self.frames_sent) +
+			" frames sent, " + str(self.replaced) + " stale values replaced, " + str(self.drops) + " dropped connections, " +
+			str(self.reader.lost) + " frames lost")
+
+class ConnectionManager:
+	def __init__(self, min_backoff=1, max_backoff=60, connect_timeout=5, send_timeout=10, keepalive_idle=10, metrics=None):
+		self.metrics = metrics
+		self.min_backoff = min_backoff
+		self.max_backoff = max_backoff
+		self.connect_timeout = connect_timeout
+		self.send_timeout = send_timeout
+		self.keepalive_idle = keepalive_idle
+		self.peers = {}
+		self._lock = threading.Lock()
+		self._selector = selectors.DefaultSelector()
+		# Writing a byte to _wake interrupts select() when there's something new to send
+		self._wake_r, self._wake = socket.socketpair()
+		self._wake_r.setblocking(False)
+		self._wake.setblocking(False)
+		self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+		self._running = False
+		self._thread = None
+
+	# Add a peer to keep connected to. on_frames(peer, frames) is called (on the manager thread) with frames the peer
+	# sends back, as returned by FrameReader.feed(); on_connect(peer) is called each time the connection comes up.
+	def add(self, name, address, on_frames=None, on_connect=None):
+		peer = Peer(name, address, on_frames, on_connect)
+		with self._lock:
+			self.peers[name] = peer
+		self._poke()
+		return peer
+
+	# Queue records for a peer under key, replacing anything still waiting under the same key. Never blocks.
+	def send(self, name, key, records):
+		peer = self.peers[name]
+		with self._lock:
+			if key in peer.queue:
+				peer.replaced += 1
+				del peer.queue[key]
+				if self.metrics is not None: self.metrics.inc("fanctl_net_replaced_total", peer=name)
+			peer.queue[key] = records
+		self._poke()
+
+	def _poke(self):
+		try: self._wake.send(b"\0")
+		except (BlockingIOError, OSError): pass
+
+	def start(self):
+		self._running = True
+		self._thread = threading.Thread(target=self._run, name="net", daemon=True)
+		self._thread.start()
+
+	def stop(self):
+		self._running = False
+		self._poke()
+		if self._thread: self._thread.join(2)
+		for peer in self.peers.values():
+			if peer.sock: peer.sock.close()
+
+	# One line per peer with connection and queue stats
+	def summary(self):
+		return [peer.summary() for peer in self.peers.values()]
+
+	### Manager thread
+	def _run(self):
+		while self._running:
+			now = time.monotonic()
+			timeout = self.max_backoff
+			with self._lock:
+				peers = list(self.peers.values())
+			for peer in peers:
+				if peer.sock is None:
+					if now >= peer.next_attempt: self._connect(peer, now)
+					else: timeout = min(timeout, peer.next_attempt - now)
+				elif not peer.connected:
+					if now >= peer.connect_deadline: self._fail(peer, "connection timed out", now)
+					else: timeout = min(timeout, peer.connect_deadline - now)
+				else:
+					if peer.queue or peer.outbuf:
+						# Something to send; give up on the connection if the socket takes none of it for too long
+						if peer.stalled_since is None: peer.stalled_since = now
+						elif now - peer.stalled_since > self.send_timeout:
+							self._fail(peer, "send stalled for " + str(self.send_timeout) + " seconds", now)
+							continue
+						self._update(peer, selectors.EVENT_READ | selectors.EVENT_WRITE)
+						timeout = min(timeout, 1)
+					else:
+						peer.stalled_since = None
+						self._update(peer, selectors.EVENT_READ)
+
+			for key, events in self._selector.select(max(0, timeout)):
+				peer = key.data
+				if peer is None:
+					try:
+						while self._wake_r.recv(4096): pass
+					except (BlockingIOError, OSError): pass
+					continue
+				if peer.sock is not key.fileobj: continue
+				if not peer.connected:
+					self._finish_connect(peer)
+					continue
+				if events & selectors.EVENT_READ: self._read(peer)
+				if peer.connected and events & selectors.EVENT_WRITE: self._write(peer)
+
+	def _update(self, peer, events):
+		try: self._selector.modify(peer.sock, events, peer)
+		except (KeyError, ValueError): self._selector.register(peer.sock, events, peer)
+
+	def _connect(self, peer, now):
+		peer.attempts += 1
+		sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		sock.setblocking(False)
+		self._keepalive(sock)
+		peer.sock = sock
+		peer.connect_deadline = now + self.connect_timeout
+		error = sock.connect_ex(peer.address)
+		if error not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+			# Connection refused/unreachable straight away
+			self._fail(peer, os.strerror(error), now)
+			return
+		self._selector.register(sock, selectors.EVENT_WRITE, peer)
+
+	def _keepalive(self, sock):
+		sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+		sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		# Not every platform has the knobs to make keepalive notice a dead peer in seconds instead of hours
+		for option, value in (("TCP_KEEPIDLE", self.keepalive_idle), ("TCP_KEEPINTVL", self.keepalive_idle), ("TCP_KEEPCNT", 3)):
+			if hasattr(socket, option):
+				try: sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+				except OSError: pass
+
+	def _finish_connect(self, peer):
+		now = time.monotonic()
+		error = peer.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+		if error != 0:
+			self._fail(peer, os.strerror(error), now)
+			return
+		peer.connected = True
+		peer.attempts = 0
+		peer.backoff = 0
+		peer.writer.reset()
+		peer.reader = FrameReader()
+		peer.outbuf = b""
+		peer.stalled_since = None
+		log.info("Connected", peer=peer.name, address=peer.address[0])
+		self._callback(peer.on_connect, peer)
+		self._update(peer, selectors.EVENT_READ | selectors.EVENT_WRITE)
+
+	# Drop the connection and schedule the next attempt with exponential backoff
+	def _fail(self, peer, reason, now):
+		if peer.sock is not None:
+			try: self._selector.unregister(peer.sock)
+			except (KeyError, ValueError): pass
+			peer.sock.close()
+		was_connected = peer.connected
+		if was_connected:
+			peer.drops += 1
+			if self.metrics is not None: self.metrics.inc("fanctl_net_dropped_connections_total", peer=peer.name)
+		peer.sock = None
+		peer.connected = False
+		peer.outbuf = b""
+		peer.stalled_since = None
+		peer.backoff = self.min_backoff if was_connected or peer.backoff == 0 else min(self.max_backoff, peer.backoff * 2)
+		peer.next_attempt = now + peer.backoff
+		if was_connected:
+			log.error("Lost connection", peer=peer.name, reason=reason, retry_in=peer.backoff)
+		else:
+			# No attempt number here, so once the backoff tops out the repeats collapse into one line a minute
+			log.error("Could not connect", peer=peer.name, address=peer.address[0], reason=reason, retry_in=peer.backoff)
+
+	def _read(self, peer):
+		try: data = peer.sock.recv(4096)
+		except (BlockingIOError, InterruptedError): return
+		except OSError as e:
+			self._fail(peer, str(e), time.monotonic())
+			return
+		if data == b"":
+			self._fail(peer, "closed by peer", time.monotonic())
+			return
+		frames = peer.reader.feed(data)
+		if frames: self._callback(peer.on_frames, peer, frames)
+
+	def _write(self, peer):
+		if not peer.outbuf:
+			# Take whole keys off the front of the queue until the frame is full
+			records = []
+			with self._lock:
+				while peer.queue:
+					key = next(iter(peer.queue))
+					if records and len(records) + len(peer.queue[key]) > MAX_RECORDS: break
+					records += peer.queue.pop(key)
+			if not records: return
+			try: peer.outbuf = peer.writer.frame(records)
+			except ProtocolError as e:
+				log.error("Dropped frame", peer=peer.name, reason=str(e))
+				return
+			peer.frames_sent += 1
+		start = time.monotonic()
+		try: sent = peer.sock.send(peer.outbuf)
+		except (BlockingIOError, InterruptedError): sent = 0
+		except OSError as e:
+			self._fail(peer, str(e), time.monotonic())
+			return
+		if self.metrics is not None:
+			self.metrics.observe("fanctl_net_send_seconds", time.monotonic() - start, peer=peer.name)
+			self.metrics.inc("fanctl_net_sent_bytes_total", sent, peer=peer.name)
+		peer.outbuf = peer.outbuf[sent:]
+		if sent: peer.stalled_since = None
+
+	def _callback(self, func, *args):
+		if func is None: return
+		try: func(*args)
+		except Exception:
+			log.exception(getattr(func, "__name__", "callback") + " raised an exception", peer=args[0].name)
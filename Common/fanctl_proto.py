@@ -0,0 +1,255 @@
+###
+# Wire protocol shared by fanctl, fanctl_client and fanctl_display
+###
+
+# TCP is a byte stream, so messages are sent as length-prefixed frames. Each frame carries one or more typed
+# records, letting a sender batch everything it has for a peer into a single send(). Frame layout (network byte order):
+#
+#	magic "FC" (2) | version (1) | record count (1) | sequence number (4) | payload length (4) | records...
+#
+# and each record is:
+#
+#	type (1) | body length (2) | body
+#
+# Sequence numbers go up by one per frame on each connection so the receiver can spot lost frames. A receiver that
+# hits garbage skips ahead to the next "FC" and keeps going. Unknown record types are skipped, so new types can be
+# added without breaking older peers; anything that changes the framing itself needs a new version number.
+#
+# Disk temps can also be sent as deltas: HddDeltaEncoder sends a full HDD_KEYFRAME now and then, and otherwise an
+# HDD_DELTA holding only the (slot, temp) pairs that changed since the last snapshot the receiver acknowledged with
+# HDD_ACK. Deltas are always against an acknowledged snapshot, so a lost or dropped delta never breaks the chain. A
+# receiver that gets a delta against a snapshot it doesn't have acks 0, which makes the sender send a keyframe.
+
+### Libraries:
+# struct to pack/unpack frames
+# collections for the record value tuples and snapshot history
+# array for packed temperature lists
+import struct, collections
+from array import array
+
+MAGIC = b"FC"
+VERSION = 1
+HEADER = struct.Struct("!2sBBII")
+RECORD_HEADER = struct.Struct("!BH")
+MAX_PAYLOAD = 1 << 20
+MAX_RECORDS = 255
+
+### Record types
+CPU_TEMPS = 1			# list of per-core temps (C)
+CPU_FANS = 2			# CpuFans
+HDD_TEMPS = 3			# list of per-slot disk temps (C), -1 for empty/unreadable slots
+DUTY = 4				# fan duty cycle (%) for a shelf
+SHELF_STATUS = 5		# ShelfStatus
+HDD_KEYFRAME = 6		# HddKeyframe; full disk temp list with a snapshot id
+HDD_DELTA = 7			# HddDelta; changed (slot, temp) pairs against an acknowledged snapshot
+HDD_ACK = 8				# snapshot id the receiver now has (0 = please send a keyframe)
+SHELF_TELEMETRY = 9		# ShelfTelemetry; sent back to fanctl by each shelf controller
+
+### ShelfTelemetry flags
+SHELF_STALLED = 1		# the shelf's fan isn't turning although it's being driven
+SHELF_NO_AMBIENT = 2	# no ambient probe has a recent reading; ambient is the last one there was
+SHELF_LOCAL = 4			# the shelf hasn't heard from fanctl in a while and is running its own fan curve
+
+CpuFans = collections.namedtuple("CpuFans", "duty rpm load")
+ShelfStatus = collections.namedtuple("ShelfStatus", "duty target old ramping rpm ambient")
+ShelfTelemetry = collections.namedtuple("ShelfTelemetry", "duty target ramping rpm ambient flags")
+HddKeyframe = collections.namedtuple("HddKeyframe", "snapshot temps")
+HddDelta = collections.namedtuple("HddDelta", "snapshot base changes")
+
+Record = collections.namedtuple("Record", "type value")
+
+_cpu_fans = struct.Struct("!Bif")
+_duty = struct.Struct("!B")
+_shelf_status = struct.Struct("!BBBBif")
+_shelf_telemetry = struct.Struct("!BBBifB")
+_u32 = struct.Struct("!I")
+_snapshots = struct.Struct("!II")
+_change = struct.Struct("!Hb")
+
+# Temps are packed as signed bytes
+def _pack_temps(temps):
+	return array("b", [max(-128, min(127, int(t))) for t in temps]).tobytes()
+
+def _unpack_temps(body):
+	return array("b", body).tolist()
+
+def _pack_keyframe(v):
+	return _u32.pack(v.snapshot) + _pack_temps(v.temps)
+
+def _unpack_keyframe(body):
+	return HddKeyframe(_u32.unpack_from(body)[0], _unpack_temps(body[_u32.size:]))
+
+def _pack_delta(v):
+	return _snapshots.pack(v.snapshot, v.base) + b"".join([_change.pack(slot, temp) for slot, temp in v.changes])
+
+def _unpack_delta(body):
+	snapshot, base = _snapshots.unpack_from(body)
+	changes = [_change.unpack_from(body, offset) for offset in range(_snapshots.size, len(body), _change.size)]
+	return HddDelta(snapshot, base, changes)
+
+# type -> (encode value to bytes, decode bytes to value)
+CODECS = {
+	CPU_TEMPS: (_pack_temps, _unpack_temps),
+	CPU_FANS: (lambda v: _cpu_fans.pack(*v), lambda b: CpuFans(*_cpu_fans.unpack(b))),
+	HDD_TEMPS: (_pack_temps, _unpack_temps),
+	DUTY: (lambda v: _duty.pack(v), lambda b: _duty.unpack(b)[0]),
+	SHELF_STATUS: (lambda v: _shelf_status.pack(*v), lambda b: ShelfStatus(*_shelf_status.unpack(b))),
+	HDD_KEYFRAME: (_pack_keyframe, _unpack_keyframe),
+	HDD_DELTA: (_pack_delta, _unpack_delta),
+	HDD_ACK: (lambda v: _u32.pack(v), lambda b: _u32.unpack(b)[0]),
+	SHELF_TELEMETRY: (lambda v: _shelf_telemetry.pack(*v), lambda b: ShelfTelemetry(*_shelf_telemetry.unpack(b))),
+}
+
+class ProtocolError(Exception):
+	pass
+
+### Sending
+# Pack a list of records into one frame
+def encode_frame(seq, records):
+	payload = b"".join([_encode_record(record) for record in records])
+	if len(records) > MAX_RECORDS or len(payload) > MAX_PAYLOAD:
+		raise ProtocolError("frame too large")
+	return HEADER.pack(MAGIC, VERSION, len(records), seq & 0xffffffff, len(payload)) + payload
+
+def _encode_record(record):
+	body = CODECS[record.type][0](record.value)
+	return RECORD_HEADER.pack(record.type, len(body)) + body
+
+# Keeps the sequence number for one connection. Call reset() when the connection is re-established.
+class FrameWriter:
+	def __init__(self):
+		self.seq = 0
+
+	def frame(self, records):
+		self.seq += 1
+		return encode_frame(self.seq, records)
+
+	def reset(self):
+		self.seq = 0
+
+### Receiving
+# Buffers bytes from one connection and hands back complete frames as (seq, [records]). Counts frames lost (gaps in
+# the sequence) and bytes skipped while resyncing.
+class FrameReader:
+	def __init__(self):
+		self._buf = b""
+		self.last_seq = None
+		self.lost = 0
+		self.errors = 0
+
+	def feed(self, data):
+		self._buf += data
+		frames = []
+		while True:
+			frame = self._next_frame()
+			if frame is None: return frames
+			frames.append(frame)
+
+	def _next_frame(self):
+		while True:
+			buf = self._buf
+			if len(buf) < HEADER.size: return None
+			magic, version, count, seq, length = HEADER.unpack_from(buf)
+			if magic != MAGIC or length > MAX_PAYLOAD:
+				# Lost our place in the stream; skip to the next thing that looks like a frame
+				start = buf.find(MAGIC, 1)
+				self.errors += 1
+				self._buf = buf[start:] if start >= 0 else buf[-1:]
+				continue
+			if len(buf) < HEADER.size + length: return None
+			payload = buf[HEADER.size:HEADER.size + length]
+			self._buf = buf[HEADER.size + length:]
+			if version != VERSION:
+				self.errors += 1
+				continue
+			if self.last_seq is not None and seq > self.last_seq + 1:
+				self.lost += seq - self.last_seq - 1
+			self.last_seq = seq
+			try: return seq, self._decode_records(payload, count)
+			except (struct.error, ValueError, IndexError):
+				self.errors += 1
+
+	@staticmethod
+	def _decode_records(payload, count):
+		records = []
+		offset = 0
+		for x in range(count):
+			rtype, length = RECORD_HEADER.unpack_from(payload, offset)
+			offset += RECORD_HEADER.size
+			body = payload[offset:offset + length]
+			offset += length
+			codec = CODECS.get(rtype)
+			if codec is not None:
+				records.append(Record(rtype, codec[1](body)))
+		return records
+
+### Delta-encoded disk temps
+# Sender side. encode() returns the record to send for a new set of temps (or None if nothing changed since the last
+# one sent); ack() takes the snapshot ids coming back from the receiver.
+class HddDeltaEncoder:
+	def __init__(self, keyframe_interval, history=16):
+		self.keyframe_interval = keyframe_interval
+		self.history = history
+		self._snapshots = collections.OrderedDict()
+		self._next_id = 1
+		self._acked = None
+		self._last_sent = None
+		self._last_keyframe = None
+
+	def encode(self, temps, now):
+		temps = tuple(temps)
+		keyframe_due = self._last_keyframe is None or now - self._last_keyframe >= self.keyframe_interval
+		if temps == self._last_sent and not keyframe_due: return None
+		base = self._snapshots.get(self._acked)
+		changes = None
+		if base is not None and len(base) == len(temps) and not keyframe_due:
+			changes = [(slot, temp) for slot, (old, temp) in enumerate(zip(base, temps)) if old != temp]
+			# A delta with most of the disks in it is no smaller than a keyframe
+			if len(changes) * _change.size >= len(temps): changes = None
+
+		snapshot = self._next_id
+		self._next_id = self._next_id % 0xffffffff + 1
+		self._snapshots[snapshot] = temps
+		while len(self._snapshots) > self.history:
+			self._snapshots.popitem(last=False)
+		self._last_sent = temps
+		if changes is None:
+			self._last_keyframe = now
+			return Record(HDD_KEYFRAME, HddKeyframe(snapshot, list(temps)))
+		return Record(HDD_DELTA, HddDelta(snapshot, self._acked, changes))
+
+	def ack(self, snapshot):
+		if snapshot == 0:
+			# Receiver lost track; next encode() sends a keyframe
+			self._acked = None
+			self._last_keyframe = None
+		elif snapshot in self._snapshots:
+			self._acked = snapshot
+
+	# Call when the connection is re-established; the new receiver has no snapshots
+	def reset(self):
+		self._acked = None
+		self._last_sent = None
+		self._last_keyframe = None
+
+# Receiver side. apply() takes an HDD_KEYFRAME or HDD_DELTA record and returns (temps, ack): temps is the full list
+# (None if the delta couldn't be applied) and ack is the snapshot id to send back in an HDD_ACK.
+class HddDeltaDecoder:
+	def __init__(self, history=16):
+		self.history = history
+		self._snapshots = collections.OrderedDict()
+
+	def apply(self, record):
+		value = record.value
+		if record.type == HDD_KEYFRAME:
+			temps = list(value.temps)
+		else:
+			base = self._snapshots.get(value.base)
+			if base is None: return None, 0
+			temps = list(base)
+			for slot, temp in value.changes:
+				if slot < len(temps): temps[slot] = temp
+		self._snapshots[value.snapshot] = temps
+		while len(self._snapshots) > self.history:
+			self._snapshots.popitem(last=False)
+		return temps, value.snapshot
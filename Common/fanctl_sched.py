@@ -0,0 +1,189 @@
+###
+# Task scheduler shared by the fanctl scripts
+###
+
+# Runs periodic tasks off a timer heap instead of a fixed sleep() loop. Each task has its own period and is run on a
+# "lane": a worker thread that can be shared by tasks that must not run at the same time (e.g., everything that talks
+# to the BMC). A slow task only holds up its own lane, so the CPU control period stays fixed however long an HDD sweep
+# takes. Deadlines advance by whole periods so tasks keep their phase; if a task is still running (or still queued)
+# when it comes due again, that run is dropped and counted as an overrun. Jitter is how late a task actually started
+# compared to its deadline. trigger() makes a task due right away, for things like a new duty cycle arriving. A task
+# with no period that's triggered while it's running runs again as soon as it finishes, so no trigger is lost.
+# With a fanctl_metrics.Metrics, every run's jitter and duration also go into per-task histograms.
+
+### Libraries:
+# threading for the dispatcher and lane threads
+# heapq for the timer heap
+# time for the monotonic clock
+# collections for the lane queues
+# fanctl_log to log task exceptions
+import threading, heapq, time, collections
+from fanctl_log import get_logger
+
+log = get_logger("fanctl.sched")
+
+class Task:
+	def __init__(self, name, period, func, lane):
+		self.name = name
+		self.period = period
+		self.func = func
+		self.lane = lane
+		self.deadline = 0
+		self.busy = False
+		self.rerun = False
+		self._entry = None
+		# Stats
+		self.runs = 0
+		self.overruns = 0
+		self.jitter_last = 0.0
+		self.jitter_max = 0.0
+		self.jitter_total = 0.0
+		self.duration_last = 0.0
+		self.duration_max = 0.0
+
+	def summary(self):
+		if self.runs == 0: return self.name + ": never run"
+		return (self.name + ": " + str(self.runs) + " runs, " + str(self.overruns) + " overruns, jitter avg " +
+			str(round(self.jitter_total / self.runs * 1000, 1)) + "ms max " + str(round(self.jitter_max * 1000, 1)) +
+			"ms, duration last " + str(round(self.duration_last * 1000, 1)) + "ms max " + str(round(self.duration_max * 1000, 1)) + "ms")
+
+class _Lane(threading.Thread):
+	def __init__(self, name, on_error, metrics, sched_cond):
+		threading.Thread.__init__(self, name="lane-" + name, daemon=True)
+		self.queue = collections.deque()
+		self.cond = threading.Condition()
+		self.sched_cond = sched_cond
+		self.on_error = on_error
+		self.metrics = metrics
+		self.running = True
+
+	def post(self, task, deadline):
+		with self.cond:
+			self.queue.append((task, deadline))
+			self.cond.notify()
+
+	def run(self):
+		while self.running:
+			with self.cond:
+				while not self.queue and self.running:
+					self.cond.wait()
+				if not self.running: return
+				task, deadline = self.queue.popleft()
+			start = time.monotonic()
+			jitter = start - deadline
+			task.jitter_last = jitter
+			task.jitter_total += jitter
+			if jitter > task.jitter_max: task.jitter_max = jitter
+			try: task.func()
+			except Exception as e: self.on_error(task, e)
+			finally:
+				duration = time.monotonic() - start
+				task.duration_last = duration
+				if duration > task.duration_max: task.duration_max = duration
+				task.runs += 1
+				with self.sched_cond:
+					if task.rerun:
+						task.rerun = False
+						self.post(task, time.monotonic())
+					else:
+						task.busy = False
+				if self.metrics is not None:
+					self.metrics.observe("fanctl_task_jitter_seconds", max(0.0, jitter), task=task.name)
+					self.metrics.observe("fanctl_task_duration_seconds", duration, task=task.name)
+
+class Scheduler:
+	def __init__(self, on_error=None, metrics=None):
+		self.metrics = metrics
+		self.tasks = {}
+		self._lanes = {}
+		self._heap = []
+		self._seq = 0
+		self._cond = threading.Condition()
+		self._running = False
+		self._thread = None
+		self.on_error = on_error or self._log_error
+
+	@staticmethod
+	def _log_error(task, e):
+		log.exception("Task raised an exception", task=task.name)
+
+	# Add a task that runs every period seconds, first run delay seconds from now. A period of None means the task
+	# only runs when triggered. Tasks on the same lane never run at the same time; by default each task gets its
+	# own lane.
+	def add(self, name, period, func, lane=None, delay=0):
+		lane = lane or name
+		if lane not in self._lanes:
+			self._lanes[lane] = _Lane(lane, self.on_error, self.metrics, self._cond)
+			if self._running: self._lanes[lane].start()
+		task = Task(name, period, func, self._lanes[lane])
+		self.tasks[name] = task
+		if period is not None:
+			with self._cond:
+				self._push(task, time.monotonic() + delay)
+		return task
+
+	def _push(self, task, deadline):
+		# Entries are [deadline, seq, task]; rescheduling a task just orphans its old entry
+		task.deadline = deadline
+		self._seq += 1
+		task._entry = [deadline, self._seq, task]
+		heapq.heappush(self._heap, task._entry)
+		self._cond.notify()
+
+	# Make a task due now (or delay seconds from now) instead of at its next deadline, unless it's already due sooner
+	def trigger(self, name, delay=0):
+		with self._cond:
+			task = self.tasks[name]
+			deadline = time.monotonic() + delay
+			if task._entry is not None and task._entry[0] <= deadline: return
+			self._push(task, deadline)
+
+	def _dispatch(self):
+		with self._cond:
+			while self._running:
+				now = time.monotonic()
+				while self._heap and (self._heap[0][2]._entry is not self._heap[0] or self._heap[0][0] <= now):
+					deadline, seq, task = heapq.heappop(self._heap)
+					if task._entry is None or task._entry[1] != seq: continue
+					if task.busy and task.period is None:
+						task.rerun = True
+					elif task.busy:
+						task.overruns += 1
+						if self.metrics is not None: self.metrics.inc("fanctl_task_overruns_total", task=task.name)
+					else:
+						task.busy = True
+						task.lane.post(task, deadline)
+					# Move to the next deadline in phase with the old one, skipping any periods we've already missed
+					if task.period:
+						missed = int((now - deadline) // task.period) + 1
+						self._push(task, deadline + missed * task.period)
+					else:
+						task._entry = None
+				timeout = self._heap[0][0] - now if self._heap else None
+				self._cond.wait(timeout)
+
+	def start(self):
+		self._running = True
+		for lane in self._lanes.values():
+			if not lane.is_alive(): lane.start()
+		self._thread = threading.Thread(target=self._dispatch, name="scheduler", daemon=True)
+		self._thread.start()
+
+	# Run the scheduler in the calling thread until stop() is called
+	def run(self):
+		self.start()
+		while self._thread.is_alive():
+			self._thread.join(1)
+
+	def stop(self):
+		with self._cond:
+			self._running = False
+			self._cond.notify()
+		for lane in self._lanes.values():
+			with lane.cond:
+				lane.running = False
+				lane.cond.notify()
+
+	# One line per task with run, overrun, jitter and duration stats
+	def summary(self):
+		return [task.summary() for task in self.tasks.values()]
@@ -0,0 +1,91 @@
+###
+# System topology shared by fanctl, fanctl_client and fanctl_display
+###
+
+# Describes the chassis in the system (head unit first, then each shelf): how the drive bays are laid out, which disk
+# serial sits in which bay, and the address of each chassis' fan controller. It's loaded from fanctl_topology.json
+# (next to this module by default), so adding a shelf is one edit in one file.
+#
+# Disk slots are numbered across the whole system, head unit first. Within a chassis, bays start in the top left and
+# continue along the top row like so:
+#
+#	[ 01 | 02 | 03 | 04 ]
+#	[ 05 | 06 | 07 | 08 ]
+#	[    ... etc ...    ]
+#
+# Each chassis owns a contiguous run of slots (start to end), so anything kept per slot (device nodes, temps) is a flat
+# list and one chassis' share of it is a single slice. A chassis that only monitors some of its bays lists just those
+# serials; the remaining cells show up empty on the display.
+#
+# Setting FANCTL_TOPOLOGY in the environment points every script at a different topology file (e.g., for the simulator).
+
+### Libraries:
+# json to read the topology file
+# os to find it
+# collections for the chassis tuple
+# array for the slot -> chassis map
+import json, os, collections
+from array import array
+
+DEFAULT_PATH = os.environ.get("FANCTL_TOPOLOGY", os.path.join(os.path.dirname(os.path.abspath(__file__)), "fanctl_topology.json"))
+
+# start and end are the chassis' slot range in the system-wide slot numbering
+Chassis = collections.namedtuple("Chassis", "name controller rows cols start end")
+
+class TopologyError(Exception):
+	pass
+
+class Topology:
+	def __init__(self, data):
+		try:
+			self.head = data["head"]
+			self.display = data["display"]
+			self.port = data.get("port", 10000)
+			self.chassis = []
+			self.serials = []
+			for entry in data["chassis"]:
+				rows, cols = entry["rows"], entry["cols"]
+				serials = entry.get("serials", [""] * (rows * cols))
+				if len(serials) > rows * cols:
+					raise TopologyError(entry["name"] + " lists " + str(len(serials)) + " serials for " + str(rows * cols) + " bays")
+				start = len(self.serials)
+				self.serials += serials
+				self.chassis.append(Chassis(entry["name"], entry["controller"], rows, cols, start, len(self.serials)))
+		except (KeyError, TypeError) as e:
+			raise TopologyError("bad topology: " + repr(e))
+		if not self.chassis: raise TopologyError("topology has no chassis")
+		self.num_chassis = len(self.chassis)
+		self.num_disks = len(self.serials)
+		# slot -> chassis number
+		self.slot_chassis = array("B")
+		for shelf, chassis in enumerate(self.chassis):
+			self.slot_chassis.extend([shelf] * (chassis.end - chassis.start))
+
+	# (chassis number, bay number counting from 1) for a slot
+	def locate(self, slot):
+		shelf = self.slot_chassis[slot]
+		return shelf, slot - self.chassis[shelf].start + 1
+
+	# Hottest temp in each chassis (0 if nothing in it has a reading), from a per-slot temp list
+	def chassis_max(self, temps):
+		return [max(0, max(temps[c.start:c.end], default=0)) for c in self.chassis]
+
+	# Slots holding the hottest disk in their chassis, ties included
+	def hot_slots(self, temps, maxes=None):
+		if maxes is None: maxes = self.chassis_max(temps)
+		hot = []
+		for chassis, top in zip(self.chassis, maxes):
+			if top <= 0: continue
+			hot += [chassis.start + i for i, temp in enumerate(temps[chassis.start:chassis.end]) if temp == top]
+		return hot
+
+	# Layout for the display page (no serials or addresses)
+	def layout(self):
+		return {"chassis": [{"name": c.name, "rows": c.rows, "cols": c.cols, "start": c.start, "end": c.end} for c in self.chassis]}
+
+def load_topology(path=DEFAULT_PATH):
+	try:
+		with open(path) as f: data = json.load(f)
+	except (OSError, ValueError) as e:
+		raise TopologyError("could not read " + path + ": " + str(e))
+	return Topology(data)
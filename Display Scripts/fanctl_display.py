@@ -1,127 +1,211 @@
 #!/usr/bin/python3
 
-import socket, redis, time, logging
-from flask import Flask, render_template
+import redis, json, time, sys, os, signal
+from flask import Flask, render_template, request, abort, jsonify, Response
 from flask_socketio import SocketIO, emit
 from threading import Thread, Event
 
-numShelves = 2					# Number of total shelves in server (incl. head)
-updateFreq = 0.01				# Page update frequency in seconds
-listenHost = "10.0.10.100"		# IP address of fanctl_disp
-listenPort = 10000				# TCP port to listen on
-head = "10.0.1.2"				# IP address of server system
-
-# IP addresses of per-shelf fan controllers set automatically as 10.0.10.X where X is the shelf number
-shelfIP = [""] * numShelves
-for i in range(numShelves):
-	shelfIP[i] = "10.0.10." + str(i)
-
-# Set up flask and redis
-logging.basicConfig(level=logging.WARNING)
+# Shared fanctl modules live in ../Common (or next to this script)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from fanctl_proto import HddDeltaDecoder, Record, CPU_TEMPS, CPU_FANS, HDD_TEMPS, SHELF_STATUS, HDD_KEYFRAME, HDD_DELTA, HDD_ACK
+from fanctl_topology import load_topology
+from fanctl_history import HistoryStore
+from fanctl_push import ChangeFeed, Broadcaster
+from fanctl_ingest import IngestServer
+from fanctl_log import setup_logging, get_logger
+
+# Chassis layout, shelf controller addresses and the head/display addresses come from the same topology file fanctl uses
+topology = load_topology()
+
+numShelves = topology.num_chassis	# Number of total shelves in server (incl. head)
+updateWindow = 0.1				# Changes are collected for this long (seconds) and pushed to pages as one update
+listenHost = topology.display	# IP address of fanctl_disp
+listenPort = topology.port		# TCP port to listen on
+head = topology.head			# IP address of server system
+historyFile = "/var/lib/fanctl/history.bin"	# Where temp/fan history is saved between restarts
+historySaveFreq = 3600			# How often (in seconds) to save history
+historyRawSamples = 3600		# Raw samples kept per series (older data is still in the 1-minute and 1-hour rollups)
+historyMinuteSamples = 10080	# 1-minute rollups kept per series (1 week)
+historyHourSamples = 8760		# 1-hour rollups kept per series (1 year)
+logFile = "/home/ctl/logs/fanctl_display.log"	# Log file (rotated; repeated errors are collapsed)
+idleTimeout = 600				# Close a head/shelf connection that sends nothing for this long (seconds). Keep it well
+								# above how often they send when nothing changes: every second for the head's CPU data,
+								# every minute for a shelf's status (displayRefreshFreq in fanctl_client).
+maxReplyBuffer = 65536			# Stop reading from a peer with more than this many bytes of acks it hasn't taken
+
+# IP addresses of per-shelf fan controllers
+shelfIP = [chassis.controller for chassis in topology.chassis]
+
+# Set up logging (our own messages, plus warnings and errors from flask and everything else), flask and redis
+setup_logging(logFile)
+log = get_logger("fanctl.display")
 app = Flask(__name__)
 app.config['DEBUG'] = False
 socketio = SocketIO(app, message_queue="redis://")
 displayData = redis.Redis(host="localhost", port=6379, db=0)
 
-# Set starting values for display info
-displayData.set("hdd_temps","0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0")
-displayData.set("cpu_temps","0 0 0 0 0 0 0 0")
-displayData.set("cpu_fans","Fans 100% @ 1500 RPM;0")
-for i in range(numShelves):
-	displayData.set("shelf" + str(i),"Fans 100% @ 3000 RPM;00")
+# Keys written by the ingest side are marked here so only changes get pushed to the pages
+changes = ChangeFeed()
 
-# Receive data from either server system or fan control systems in each shelf via socket connection
-def getNewData(socket, displayData):
-	MAX_LENGTH = 4096
-	# Loop until connection is closed
-	while 1:
-		# Block at socket.recv until data is received; decode message as utf-8
-		rcvBuffer = socket.recv(MAX_LENGTH).decode("utf-8")
-		# Get peer IP to determine data source
-		peerIP = socket.getpeername()[0]
-
-		# If receive buffer is null, reset display data and return
-		if rcvBuffer == '':
-			if peerIP == head:
-				displayData.set("hdd_temps","0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0")
-			for i in range(numShelves):
-				if peerIP == shelfIP[i]: displayData.set("shelf" + str(i),"DISCONNECTED!;0")
-			return
-		
-		# If data is sent from head unit, determine the type of data based on leading tag (separated from data by ;)
-		if peerIP == head:
-			dataType = rcvBuffer.split(";",1)[0]
-			data = rcvBuffer.split(";",1)[1]
-			if dataType == "hdd":
-				displayData.set("hdd_temps",data)
-			elif dataType == "cpu":
-				displayData.set("cpu_temps",data)
-			elif dataType == "cpu_fans":
-				displayData.set("cpu_fans",data)
-
-		# If data is from shelf, update appropriate shelf data entry in redis DB
-		for i in range(numShelves):
-			if peerIP == shelfIP[i]: displayData.set("shelf" + str(i),rcvBuffer)
-
-# Bind to display system IP/Port and listen for connections
-def listen(displayData):
-	serverSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-
-	# Attempt to bind to IP/port; keep retrying until it binds
-	connected = False
-	while connected == False:
-		try:
-			serverSocket.bind((listenHost, listenPort))
-			serverSocket.listen(10)
-			connected = True
-		except:
-			sleep(5)
-			pass
-
-	# Once bound, listen for incoming connections
-	while 1:
-		# Blocks at serverSocket.accept()
-		(clientSocket, address) = serverSocket.accept()
-		# Once connection is established, start a new thread to receive data and go back to listening for new connections
-		getData = Thread(target=getNewData, args=(clientSocket,displayData,))
-		getData.start()
+# Display values received since the last flush. They're written to Redis (as JSON) together in one pipeline, and only
+# the last value of a key that changed more than once in between is written. The page formats them itself:
+#	hdd_temps, cpu_temps	list of temps in C, -1 for an empty/unreadable slot
+#	cpu_fans				[duty %, RPM (-1 if unknown), CPU load %]
+#	shelfN					[duty %, target %, ramp start %, ramping (0/1), RPM, ambient temp in C], or null if disconnected
+pendingData = {}
 
+def store(key, value):
+	pendingData[key] = value
 
-# Send data from redis DB to jquery on web page via socket.io
-def sendNewData(displayData):
-	# Initialize all display data variables
-	shelf = [""] * numShelves
-	hdd_temps = ""
-	cpu_temps = ""
+def flushData():
+	if not pendingData: return
+	pipe = displayData.pipeline(transaction=False)
+	for key, value in pendingData.items(): pipe.set(key,json.dumps(value))
+	pipe.execute()
+	changes.mark(*pendingData)
+	pendingData.clear()
 
-	# Send data to web page every updateFreq seconds
-	while 1:
-		time.sleep(updateFreq)
+# History of everything received, for graphing. Series are "hdd", "cpu", "cpu_fans" and "shelfN".
+history = HistoryStore(historyRawSamples, historyMinuteSamples, historyHourSamples)
+history.load(historyFile)
 
-		cpu_temps = displayData.get("cpu_temps").decode("utf-8")
-		socketio.emit("cpuTempUpdate", {"cpu_temps": cpu_temps})
+# Set starting values for display info
+noTemps = [0] * topology.num_disks
+store("hdd_temps",noTemps)
+store("cpu_temps",[0] * 8)
+store("cpu_fans",[100,1500,0])
+for i in range(numShelves):
+	store("shelf" + str(i),[100,100,100,0,3000,0])
+flushData()
 
-		cpu_fans = displayData.get("cpu_fans").decode("utf-8")
-		socketio.emit("cpuFans", {"cpu_fans": cpu_fans})
+# Who's who, worked out once per connection: the head, or the Redis key of the shelf a controller belongs to
+sources = {}
+for i in range(numShelves):
+	sources.setdefault(shelfIP[i], "shelf" + str(i))
+sources[head] = "head"
+# Open connections per source, so a stale connection closing after its peer has reconnected doesn't blank the page
+liveConns = {}
+
+# Disk temps from the head may come as deltas; acks for them go back on the same connection
+def peerConnected(conn):
+	liveConns[conn.source] = liveConns.get(conn.source, 0) + 1
+	conn.hddDecoder = HddDeltaDecoder()
+	conn.hddTemps = None
+
+# Reset display data when the last connection from a peer goes away
+def peerClosed(conn):
+	liveConns[conn.source] -= 1
+	if liveConns[conn.source] > 0: return
+	if conn.source == "head": store("hdd_temps",noTemps)
+	else: store(conn.source,None)
+
+# Receive data from either server system or fan control systems in each shelf
+def getNewData(conn, frames):
+	now = time.time()
+	for seq, records in frames:
+		for record in records:
+			# Data sent from head unit
+			if conn.source == "head":
+				if record.type in (HDD_KEYFRAME, HDD_DELTA):
+					# Rebuild the full list from the delta and ack it; only store it if something actually changed
+					temps, ack = conn.hddDecoder.apply(record)
+					conn.send([Record(HDD_ACK,ack)])
+					if temps is not None and temps != conn.hddTemps:
+						conn.hddTemps = temps
+						store("hdd_temps",list(temps))
+						history.add("hdd",now,temps)
+				elif record.type == HDD_TEMPS:
+					store("hdd_temps",list(record.value))
+					history.add("hdd",now,record.value)
+				elif record.type == CPU_TEMPS:
+					store("cpu_temps",list(record.value))
+					history.add("cpu",now,record.value)
+				elif record.type == CPU_FANS:
+					fans = record.value
+					history.add("cpu_fans",now,fans)
+					store("cpu_fans",[fans.duty,fans.rpm,round(fans.load,1)])
+
+			# If data is from shelf, update appropriate shelf data entry in redis DB
+			elif record.type == SHELF_STATUS:
+				status = record.value
+				store(conn.source,[status.duty,status.target,status.old,status.ramping,status.rpm,round(status.ambient,1)])
+				history.add(conn.source,now,(status.ambient,status.duty,status.rpm))
+
+# One thread takes all head and shelf connections; everything received in a pass goes to Redis in one pipeline
+ingest = IngestServer(listenHost, listenPort, sources, getNewData, on_connect=peerConnected, on_close=peerClosed,
+	on_batch=flushData, idle_timeout=idleTimeout, max_outbuf=maxReplyBuffer)
+
+# Send changed data from redis DB to jquery on web page via socket.io: one "update" event per page holding only the
+# keys that changed since that page's last update, all read with one MGET
+def readData(keys):
+	return [json.loads(value.decode("utf-8")) for value in displayData.mget(keys)]
+
+def sendUpdate(payload, sid):
+	socketio.emit("update", payload, room=sid)
+
+broadcaster = Broadcaster(changes, readData, sendUpdate, updateWindow)
+
+# A new page gets every key in its first update
+@socketio.on("connect")
+def pageConnected():
+	broadcaster.add_page(request.sid)
+
+@socketio.on("disconnect")
+def pageDisconnected():
+	broadcaster.remove_page(request.sid)
+
+# A page can ask for fewer updates: {"interval": seconds}
+@socketio.on("throttle")
+def pageThrottle(message):
+	try: broadcaster.throttle(request.sid, float(message["interval"]))
+	except (KeyError, TypeError, ValueError): pass
+
+# Save history every historySaveFreq seconds
+def saveHistory():
+	while 1:
+		time.sleep(historySaveFreq)
+		try: history.save(historyFile)
+		except OSError as e: log.warning("Could not save history", file=historyFile, reason=str(e))
 
-		hdd_temps = displayData.get("hdd_temps").decode("utf-8")
-		socketio.emit("hddTempUpdate", {"hdd_temps": hdd_temps})
+# Save history on the way out too
+def close_display(signum, frame):
+	try: history.save(historyFile)
+	except OSError: pass
+	sys.exit(0)
 
-		for i in range(numShelves):
-			shelf[i] = displayData.get("shelf" + str(i)).decode("utf-8")
-			socketio.emit("shelf", {"shelfData": str(i) + ";" + shelf[i]})
+signal.signal(signal.SIGTERM,close_display)
 
 # Start thread to listen for new connections
-sock = Thread(target=listen, args=(displayData,))
-sock.start()
+ingest.start()
 
 # Start thread to send updated data to web page
-updateDisplay = Thread(target=sendNewData, args=(displayData,))
-updateDisplay.start()
+broadcaster.start()
+
+# Start thread to save history
+historySaver = Thread(target=saveHistory, daemon=True)
+historySaver.start()
 
 # Start flask/socket.io app
 @app.route('/')
 def index():
-	return render_template('index.html')
+	return render_template('index.html', topology=topology.layout())
+
+# Series available for graphing and their channel counts
+@app.route('/history')
+def historySeries():
+	return jsonify(history.names())
+
+# History for one series between start and end (unix time, default the last hour), as packed arrays: see
+# fanctl_history.QUERY_HEADER for the layout. tier=raw/minute/hour picks the resolution; by default it's the finest
+# one that covers the range without returning too many points.
+@app.route('/history/<series>')
+def historyRange(series):
+	end = request.args.get("end", time.time(), type=float)
+	start = request.args.get("start", end - 3600, type=float)
+	tier = request.args.get("tier")
+	if tier not in (None, "raw", "minute", "hour"): abort(400)
+	data = history.query(series, start, end, tier)
+	if data is None: abort(404)
+	return Response(data, mimetype="application/octet-stream")
 if __name__ == '__main__':
 	socketio.run(app, host='0.0.0.0', debug=False)
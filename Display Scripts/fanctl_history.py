@@ -0,0 +1,264 @@
+###
+# Time-series history for fanctl_display
+###
+
+# Keeps recent history for each data series the display receives (disk temps, CPU temps, fan speeds, shelf status) so
+# it can be graphed. A series is a fixed number of channels (e.g., one per disk slot) sampled whenever new data comes
+# in. Each series keeps three fixed-size ring buffers:
+#	raw		the last raw_samples samples as they arrived
+#	minute	1-minute min/max/avg rollups
+#	hour	1-hour min/max/avg rollups
+# Rollups are built as samples arrive, so a query never has to scan raw samples; a week of disk temps comes straight
+# out of the hourly ring. Negative values (empty bays, unreadable sensors) are stored as NaN and left out of rollups;
+# a rollup with no good samples in it is NaN.
+#
+# Everything is stored in flat arrays (float64 timestamps, float32 values, channel-major within each sample) and
+# range queries hand back those arrays packed as bytes, ready to go straight into a typed array on the page. The
+# rings can be saved to and loaded from a single binary file so history survives a restart.
+
+### Libraries:
+# struct to pack query results and the save file
+# array for the ring buffers
+# threading to share the store between the ingest and web threads
+# math for NaN
+# os to save the file atomically
+import struct, threading, math, os
+from array import array
+
+RAW = 0
+MINUTE = 1
+HOUR = 2
+TIER_NAMES = {"raw": RAW, "minute": MINUTE, "hour": HOUR}
+TIER_STEPS = {RAW: 0, MINUTE: 60, HOUR: 3600}
+
+# Query result header (little endian, so the arrays after it can be used as-is by typed arrays in the browser):
+#	magic "FH" | version | tier | step (s) | sample count | channel count | padding to 8 bytes
+# followed by count float64 timestamps, then count * channels float32 values each for avg, min and max.
+QUERY_HEADER = struct.Struct("<2sBBIIH2x")
+QUERY_VERSION = 1
+
+# Save file: magic, series count, then per series its name, channel count and each ring
+FILE_MAGIC = b"FHS1"
+_series_header = struct.Struct("<HH")
+_ring_header = struct.Struct("<III")
+
+NAN = float("nan")
+
+class _Ring:
+	def __init__(self, capacity, width):
+		self.capacity = capacity
+		self.width = width
+		self.times = array("d", bytes(8 * capacity))
+		self.avg = array("f", bytes(4 * capacity * width))
+		self.min = array("f", bytes(4 * capacity * width))
+		self.max = array("f", bytes(4 * capacity * width))
+		self.head = 0
+		self.count = 0
+
+	def append(self, t, avg, mn, mx):
+		i = self.head
+		self.times[i] = t
+		offset = i * self.width
+		self.avg[offset:offset + self.width] = avg
+		self.min[offset:offset + self.width] = mn
+		self.max[offset:offset + self.width] = mx
+		self.head = (i + 1) % self.capacity
+		if self.count < self.capacity: self.count += 1
+
+	def oldest(self):
+		return self.times[(self.head - self.count) % self.capacity] if self.count else None
+
+	# Slot of the nth oldest sample
+	def _slot(self, n):
+		return (self.head - self.count + n) % self.capacity
+
+	# First sample (counting from the oldest) at or after t
+	def _search(self, t):
+		lo, hi = 0, self.count
+		while lo < hi:
+			mid = (lo + hi) // 2
+			if self.times[self._slot(mid)] < t: lo = mid + 1
+			else: hi = mid
+		return lo
+
+	# Samples from start up to (not including) end, oldest first, as (times, avg, min, max)
+	def range(self, start, end):
+		lo, hi = self._search(start), self._search(end)
+		times, avg, mn, mx = array("d"), array("f"), array("f"), array("f")
+		# At most two contiguous runs, either side of the wrap point
+		while lo < hi:
+			first = self._slot(lo)
+			run = min(hi - lo, self.capacity - first)
+			times.extend(self.times[first:first + run])
+			avg.extend(self.avg[first * self.width:(first + run) * self.width])
+			mn.extend(self.min[first * self.width:(first + run) * self.width])
+			mx.extend(self.max[first * self.width:(first + run) * self.width])
+			lo += run
+		return times, avg, mn, mx
+
+	def count_between(self, start, end):
+		return self._search(end) - self._search(start)
+
+	def dump(self):
+		return (_ring_header.pack(self.capacity, self.head, self.count) + self.times.tobytes() + self.avg.tobytes() +
+			self.min.tobytes() + self.max.tobytes())
+
+	# Restore from a dump(); returns the offset just past it. A dump of a different size is skipped, leaving the
+	# ring empty.
+	def load(self, data, offset):
+		capacity, head, count = _ring_header.unpack_from(data, offset)
+		offset += _ring_header.size
+		if capacity != self.capacity:
+			return offset + (8 + 12 * self.width) * capacity
+		if len(data) < offset + (8 + 12 * self.width) * capacity: raise ValueError("truncated")
+		for name, size in (("times", 8 * capacity), ("avg", 4 * capacity * self.width), ("min", 4 * capacity * self.width),
+				("max", 4 * capacity * self.width)):
+			values = getattr(self, name)
+			values[:] = array(values.typecode, data[offset:offset + size])
+			offset += size
+		self.head, self.count = head, count
+		return offset
+
+# Running min/max/sum/count per channel for the rollup currently being filled
+class _Bucket:
+	def __init__(self, width):
+		self.width = width
+		self.start = None
+		self.reset(None)
+
+	def reset(self, start):
+		self.start = start
+		self.min = [math.inf] * self.width
+		self.max = [-math.inf] * self.width
+		self.sum = [0.0] * self.width
+		self.count = [0] * self.width
+
+	# Add one reading per channel; total/count let a finished rollup be added as a weighted average
+	def add(self, mn, mx, total, count):
+		for i in range(self.width):
+			if count[i] == 0: continue
+			if mn[i] < self.min[i]: self.min[i] = mn[i]
+			if mx[i] > self.max[i]: self.max[i] = mx[i]
+			self.sum[i] += total[i]
+			self.count[i] += count[i]
+
+	def result(self):
+		avg = array("f", [self.sum[i] / self.count[i] if self.count[i] else NAN for i in range(self.width)])
+		mn = array("f", [self.min[i] if self.count[i] else NAN for i in range(self.width)])
+		mx = array("f", [self.max[i] if self.count[i] else NAN for i in range(self.width)])
+		return avg, mn, mx
+
+class Series:
+	def __init__(self, name, width, raw_samples, minute_samples, hour_samples):
+		self.name = name
+		self.width = width
+		self.rings = {RAW: _Ring(raw_samples, width), MINUTE: _Ring(minute_samples, width), HOUR: _Ring(hour_samples, width)}
+		self._minute = _Bucket(width)
+		self._hour = _Bucket(width)
+
+	def add(self, t, values):
+		values = array("f", [float(v) if v >= 0 else NAN for v in values])
+		self.rings[RAW].append(t, values, values, values)
+		good = [1 if v == v else 0 for v in values]
+		total = [v if ok else 0.0 for v, ok in zip(values, good)]
+		self._roll(self._minute, MINUTE, t, values, values, total, good)
+
+	# Add to the bucket for tier, closing it out into its ring (and the next tier up) when t moves past it
+	def _roll(self, bucket, tier, t, mn, mx, total, count):
+		step = TIER_STEPS[tier]
+		start = t - t % step
+		if bucket.start is not None and bucket.start != start:
+			self._close(bucket, tier)
+		if bucket.start != start: bucket.reset(start)
+		bucket.add(mn, mx, total, count)
+
+	def _close(self, bucket, tier):
+		avg, mn, mx = bucket.result()
+		self.rings[tier].append(bucket.start, avg, mn, mx)
+		if tier == MINUTE:
+			total = [bucket.sum[i] for i in range(self.width)]
+			self._roll(self._hour, HOUR, bucket.start, mn, mx, total, bucket.count)
+
+class HistoryStore:
+	def __init__(self, raw_samples=3600, minute_samples=10080, hour_samples=8760, max_points=2000):
+		self.raw_samples = raw_samples
+		self.minute_samples = minute_samples
+		self.hour_samples = hour_samples
+		self.max_points = max_points
+		self.series = {}
+		self._lock = threading.Lock()
+
+	# Record a sample for a series. A series is created on its first sample; if the number of channels changes
+	# (e.g., disks were added to the topology), its history starts over.
+	def add(self, name, t, values):
+		with self._lock:
+			series = self.series.get(name)
+			if series is None or series.width != len(values):
+				series = self.series[name] = Series(name, len(values), self.raw_samples, self.minute_samples, self.hour_samples)
+			series.add(t, values)
+
+	def names(self):
+		with self._lock:
+			return {name: series.width for name, series in self.series.items()}
+
+	# Pick the finest tier that reaches back to start without returning more than max_points samples
+	def _pick_tier(self, series, start, end):
+		for tier in (RAW, MINUTE):
+			ring = series.rings[tier]
+			oldest = ring.oldest()
+			if oldest is not None and oldest <= start and ring.count_between(start, end) <= self.max_points:
+				return tier
+		return HOUR
+
+	# Samples for a series between start and end (unix time) packed as described at QUERY_HEADER. tier is "raw",
+	# "minute", "hour" or None to pick one automatically. Returns None for an unknown series.
+	def query(self, name, start, end, tier=None):
+		with self._lock:
+			series = self.series.get(name)
+			if series is None: return None
+			tier = TIER_NAMES[tier] if tier is not None else self._pick_tier(series, start, end)
+			times, avg, mn, mx = series.rings[tier].range(start, end)
+			width = series.width
+		return (QUERY_HEADER.pack(b"FH", QUERY_VERSION, tier, TIER_STEPS[tier], len(times), width) + times.tobytes() +
+			avg.tobytes() + mn.tobytes() + mx.tobytes())
+
+	### Persistence
+	def save(self, path):
+		with self._lock:
+			parts = [FILE_MAGIC, struct.pack("<H", len(self.series))]
+			for name, series in self.series.items():
+				encoded = name.encode("utf-8")
+				parts.append(_series_header.pack(len(encoded), series.width) + encoded)
+				for tier in (RAW, MINUTE, HOUR):
+					parts.append(series.rings[tier].dump())
+		tmp = path + ".tmp"
+		with open(tmp, "wb") as f:
+			for part in parts: f.write(part)
+		os.replace(tmp, path)
+
+	# Load a saved file. Rings whose size doesn't match the current settings start out empty. Returns the number of
+	# series loaded.
+	def load(self, path):
+		try:
+			with open(path, "rb") as f: data = f.read()
+		except OSError: return 0
+		if data[:4] != FILE_MAGIC: return 0
+		offset = 4
+		loaded = {}
+		try:
+			(count,) = struct.unpack_from("<H", data, offset)
+			offset += 2
+			for x in range(count):
+				length, width = _series_header.unpack_from(data, offset)
+				offset += _series_header.size
+				name = data[offset:offset + length].decode("utf-8")
+				offset += length
+				series = Series(name, width, self.raw_samples, self.minute_samples, self.hour_samples)
+				for tier in (RAW, MINUTE, HOUR):
+					offset = series.rings[tier].load(data, offset)
+				loaded[name] = series
+		except (struct.error, ValueError, UnicodeDecodeError):
+			pass
+		with self._lock:
+			self.series.update(loaded)
+		return len(loaded)
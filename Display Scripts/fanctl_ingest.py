@@ -0,0 +1,199 @@
+###
+# Ingest server for fanctl_display
+###
+
+# Takes every connection from the head and the shelf controllers on one background thread with non-blocking sockets,
+# instead of a thread per peer. A peer's address is looked up once when it connects, in the sources dict handed to the
+# server (IP -> name, e.g., "head" or "shelf3"), and the name stays on the connection; peers that aren't in it are
+# logged and closed. Complete frames go to on_frames(conn, frames) as they come in, and on_batch() is called once per
+# pass over the ready sockets, so the caller can write everything that pass produced in one go (e.g., one Redis
+# pipeline) instead of once per message.
+#
+# Replies (disk temp acks) are queued with conn.send() and written when the socket can take them. Once a peer that
+# stops reading them has more than max_outbuf bytes waiting (give or take the replies to one read), we stop reading
+# from it until it catches up. A connection that sends nothing for idle_timeout seconds (including one that stayed
+# paused that long) is closed; peers resend their state now and then even when nothing changes, so one that's quiet
+# for that long is stuck. TCP keepalive notices a peer that vanished without closing the connection well before that.
+
+### Libraries:
+# socket and selectors for the non-blocking server
+# threading for the background thread
+# time for the monotonic clock and the bind retry
+# fanctl_proto for framing
+# fanctl_log to log connects, drops and callback errors
+import socket, selectors, threading, time
+from fanctl_proto import FrameWriter, FrameReader, ProtocolError
+from fanctl_log import get_logger
+
+log = get_logger("fanctl.ingest")
+
+RECV_SIZE = 65536
+
+class Conn:
+	def __init__(self, sock, address, source):
+		self.sock = sock
+		self.address = address
+		self.source = source
+		self.reader = FrameReader()
+		self.writer = FrameWriter()
+		self.outbuf = b""
+		self.paused = False
+		self.events = selectors.EVENT_READ
+		self.last = time.monotonic()
+
+	# Queue a reply frame; it goes out when the socket can take it
+	def send(self, records):
+		try: self.outbuf += self.writer.frame(records)
+		except ProtocolError as e: log.error("Dropped frame", peer=self.source, reason=str(e))
+
+class IngestServer(threading.Thread):
+	def __init__(self, host, port, sources, on_frames, on_connect=None, on_close=None, on_batch=None, idle_timeout=600,
+			max_outbuf=65536, keepalive_idle=10, retry=5):
+		threading.Thread.__init__(self, name="ingest", daemon=True)
+		self.address = (host, port)
+		self.sources = sources
+		self.on_frames = on_frames
+		self.on_connect = on_connect
+		self.on_close = on_close
+		self.on_batch = on_batch
+		self.idle_timeout = idle_timeout
+		self.max_outbuf = max_outbuf
+		self.keepalive_idle = keepalive_idle
+		self.retry = retry
+		self.conns = set()
+		self.running = True
+		self._selector = selectors.DefaultSelector()
+		self._server = None
+		self._next_expire = 0
+		# Stats
+		self.frames = 0
+		self.rejected = 0
+		self.timeouts = 0
+
+	# Bind to the display IP/port; keep retrying until it binds
+	def _bind(self):
+		while self.running:
+			sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+			sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+			try:
+				sock.bind(self.address)
+				sock.listen(128)
+			except OSError as e:
+				sock.close()
+				log.warning("Could not listen", address=self.address[0] + ":" + str(self.address[1]), reason=str(e), retry_in=self.retry)
+				time.sleep(self.retry)
+				continue
+			sock.setblocking(False)
+			self._selector.register(sock, selectors.EVENT_READ, None)
+			self._server = sock
+			return
+
+	def _keepalive(self, sock):
+		sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+		sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		# Not every platform has the knobs to make keepalive notice a dead peer in seconds instead of hours
+		for option, value in (("TCP_KEEPIDLE", self.keepalive_idle), ("TCP_KEEPINTVL", self.keepalive_idle), ("TCP_KEEPCNT", 3)):
+			if hasattr(socket, option):
+				try: sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+				except OSError: pass
+
+	def _accept(self):
+		try: sock, address = self._server.accept()
+		except (BlockingIOError, InterruptedError): return
+		except OSError as e:
+			log.error("Accept failed", reason=str(e))
+			return
+		source = self.sources.get(address[0])
+		if source is None:
+			self.rejected += 1
+			log.warning("Connection from unknown address", address=address[0])
+			sock.close()
+			return
+		sock.setblocking(False)
+		self._keepalive(sock)
+		conn = Conn(sock, address, source)
+		self.conns.add(conn)
+		self._selector.register(sock, selectors.EVENT_READ, conn)
+		log.info("Connected", peer=source, address=address[0])
+		self._callback(self.on_connect, conn)
+
+	def _close(self, conn, reason):
+		if conn.sock is None: return
+		try: self._selector.unregister(conn.sock)
+		except (KeyError, ValueError): pass
+		conn.sock.close()
+		conn.sock = None
+		self.conns.discard(conn)
+		log.info("Disconnected", peer=conn.source, reason=reason)
+		self._callback(self.on_close, conn)
+
+	# Read and write interest: stop reading from a peer that isn't taking its replies
+	def _update(self, conn):
+		if conn.sock is None: return
+		conn.paused = len(conn.outbuf) > self.max_outbuf
+		# A paused peer always has replies waiting, so there's always something to wait for
+		events = (0 if conn.paused else selectors.EVENT_READ) | (selectors.EVENT_WRITE if conn.outbuf else 0)
+		if events != conn.events:
+			self._selector.modify(conn.sock, events, conn)
+			conn.events = events
+
+	def _read(self, conn):
+		try: data = conn.sock.recv(RECV_SIZE)
+		except (BlockingIOError, InterruptedError): return
+		except OSError as e:
+			self._close(conn, str(e))
+			return
+		if not data:
+			self._close(conn, "closed by peer")
+			return
+		conn.last = time.monotonic()
+		frames = conn.reader.feed(data)
+		if frames:
+			self.frames += len(frames)
+			self._callback(self.on_frames, conn, frames)
+
+	def _write(self, conn):
+		if conn.sock is None or not conn.outbuf: return
+		try: sent = conn.sock.send(conn.outbuf)
+		except (BlockingIOError, InterruptedError): sent = 0
+		except OSError as e:
+			self._close(conn, str(e))
+			return
+		conn.outbuf = conn.outbuf[sent:]
+
+	def _expire(self, now):
+		if now < self._next_expire: return
+		self._next_expire = now + 1
+		for conn in [conn for conn in self.conns if now - conn.last > self.idle_timeout]:
+			self.timeouts += 1
+			self._close(conn, "idle for " + str(self.idle_timeout) + " sec")
+
+	def _callback(self, func, *args):
+		if func is None: return
+		try: func(*args)
+		except Exception:
+			log.exception(getattr(func, "__name__", "callback") + " raised an exception", peer=args[0].source if args else None)
+
+	def run(self):
+		self._bind()
+		while self.running:
+			events = self._selector.select(1.0)
+			for key, mask in events:
+				conn = key.data
+				if conn is None:
+					self._accept()
+					continue
+				if mask & selectors.EVENT_READ: self._read(conn)
+				# Send whatever the frames just read queued up (or what was waiting for the socket)
+				self._write(conn)
+				if conn.sock is not None:
+					was_paused = conn.paused
+					self._update(conn)
+					if conn.paused and not was_paused: log.warning("Peer isn't reading replies; pausing", peer=conn.source)
+			self._expire(time.monotonic())
+			self._callback(self.on_batch)
+		for conn in list(self.conns): self._close(conn, "shutting down")
+		if self._server is not None: self._server.close()
+
+	def stop(self):
+		self.running = False
@@ -0,0 +1,118 @@
+###
+# Change-driven page updates for fanctl_display
+###
+
+# Instead of reading every key out of Redis and emitting it to the pages 100 times a second whether it changed or not,
+# the ingest side calls ChangeFeed.mark() with the keys it just wrote. Each mark bumps a version counter and stamps
+# the keys with it, so "what changed since version N" is a scan of a handful of counters.
+#
+# Broadcaster sleeps until something changes, waits out a short window so a burst of changes (a disk temp frame, a
+# CPU frame and a shelf status arriving together) goes out as one update, then reads the changed keys with a single
+# MGET and emits one "update" event per page holding just those keys. Each page has its own minimum interval (a
+# wall-mounted display can ask for fewer updates with a "throttle" event); changes a throttled page hasn't been sent
+# yet pile up as keys, not as events, so it gets one update with the latest values when its interval is up. A page
+# that just connected is sent every key.
+
+### Libraries:
+# threading for the change condition and the broadcaster thread
+# time for the update window and per-page intervals
+import threading, time
+
+class ChangeFeed:
+	def __init__(self):
+		self.cond = threading.Condition()
+		self.version = 0
+		# key -> version it last changed at
+		self.versions = {}
+
+	def mark(self, *keys):
+		with self.cond:
+			self.version += 1
+			for key in keys: self.versions[key] = self.version
+			self.cond.notify_all()
+
+	# Wait up to timeout seconds for the version to go past since; returns the current version
+	def wait(self, since, timeout):
+		with self.cond:
+			if self.version <= since: self.cond.wait(timeout)
+			return self.version
+
+	# Keys changed after version since
+	def changed(self, since):
+		with self.cond:
+			return [key for key, version in self.versions.items() if version > since]
+
+class _Page:
+	def __init__(self, interval):
+		self.interval = interval
+		self.seen = 0
+		self.last = 0.0
+
+class Broadcaster(threading.Thread):
+	# read(keys) returns the values for keys (e.g., one Redis MGET); emit(payload, sid) sends one page its update
+	def __init__(self, feed, read, emit, window=0.1):
+		threading.Thread.__init__(self, name="broadcast", daemon=True)
+		self.feed = feed
+		self.read = read
+		self.emit = emit
+		self.window = window
+		self.lock = threading.Lock()
+		self.pages = {}
+		self.updates = 0
+		self.running = True
+		self.wake = threading.Event()
+
+	def add_page(self, sid):
+		with self.lock:
+			self.pages[sid] = _Page(self.window)
+		# Wake up so the new page gets everything right away
+		self.wake.set()
+		self.feed.mark()
+
+	def remove_page(self, sid):
+		with self.lock:
+			self.pages.pop(sid, None)
+
+	# A page asks for no more than one update every interval seconds (never faster than the window)
+	def throttle(self, sid, interval):
+		with self.lock:
+			page = self.pages.get(sid)
+			if page is not None: page.interval = max(self.window, interval)
+
+	def run(self):
+		while self.running:
+			version = self.feed.version
+			with self.lock:
+				waiting = [page for page in self.pages.values() if page.seen < version]
+			# Every page is up to date: sleep until something changes
+			if not waiting:
+				self.feed.wait(version, 1.0)
+				continue
+			# Let the rest of a burst of changes come in, or wait for the first throttled page to be due
+			self.wake.clear()
+			self.wake.wait(max(self.window, min([page.last + page.interval for page in waiting]) - time.monotonic()))
+			self.push()
+
+	def push(self):
+		now = time.monotonic()
+		version = self.feed.version
+		with self.lock:
+			due = [(sid, page) for sid, page in self.pages.items() if page.seen < version and now - page.last >= page.interval]
+		if not due: return
+		# One read for every key any due page needs
+		wanted = {}
+		for sid, page in due:
+			wanted[sid] = self.feed.changed(page.seen)
+		keys = sorted(set(key for page_keys in wanted.values() for key in page_keys))
+		values = dict(zip(keys, self.read(keys))) if keys else {}
+		for sid, page in due:
+			page.seen = version
+			page.last = now
+			if wanted[sid]:
+				self.emit({key: values[key] for key in wanted[sid]}, sid)
+				self.updates += 1
+
+	def stop(self):
+		self.running = False
+		self.wake.set()
+		self.feed.mark()
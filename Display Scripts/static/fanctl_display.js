@@ -1,105 +1,129 @@
 $(document).ready(function(){
-	var num_chassis = 2;	// Total number of chassis
-	var num_drives = 40;	// Total number of drives in all chassis
+	// Chassis layout comes from the topology the page was rendered with
+	var chassis = topology.chassis;
+	var num_chassis = chassis.length;							// Total number of chassis
+	var num_drives = chassis[num_chassis - 1].end;				// Total number of drives in all chassis
 	var num_threads = 8;	// Number of logical CPU threads
 
-	// Connect to socket.io running in the Python script
-	var socket = io.connect('http://' + document.domain + ':' + location.port);
+	// Look up every cell once. Each one remembers what it shows, so an update only touches cells that changed.
+	function cell(id) {
+		return {el: document.getElementById(id), text: null, hot: null, nextText: null, nextHot: null, dirty: false};
+	}
+	var cpuCells = [];
+	for (var i = 0; i < num_threads; i++) { cpuCells.push(cell('cpu' + (i+1))); }
+	var diskCells = [];
+	for (var i = 0; i < num_drives; i++) { diskCells.push(cell('disk' + (i+1))); }
+	var fanCells = [];
+	var ambCells = [];
+	for (var c = 0; c < num_chassis; c++) {
+		fanCells.push(cell('fanSpeed' + c));
+		ambCells.push(cell('ambTemp' + c));
+	}
+	var cpuFanCell = cell('cpuFanSpeed');
+	var cpuPercentCell = cell('cpuPercent');
 
-	// jQuery function for updating the CPU temperature values
-	socket.on('cpuTempUpdate', function(msg) {
-		// Set up variables for processing data
-		var temps = new Array(num_threads);
-		var top_temp = 0;
-		var hot_threads = new Array(num_threads);
-
-		// Data will come in as as space delineated list, split this into array and find the highest temp
-		for (var i = 0; i < num_threads; i++) {
-			temps[i] = msg.cpu_temps.split(" ")[i];
-			temp = parseInt(temps[i]);
-			if (temp > top_temp) { top_temp = temp; }
-		}
+	// Cells with changes waiting; they're written to the page together on the next animation frame
+	var dirty = [];
+	var frameRequested = false;
 
-		// Go back through array and find if multiple cores are the same (top) temp
-		for (var i = 0; i < num_threads; i++) {
-			if (parseInt(temps[i]) == top_temp) {
-				hot_threads.push(i)
+	function setCell(cell, text, hot) {
+		cell.nextText = text;
+		cell.nextHot = hot;
+		if (!cell.dirty && (text !== cell.text || hot !== cell.hot)) {
+			cell.dirty = true;
+			dirty.push(cell);
+			if (!frameRequested) {
+				frameRequested = true;
+				window.requestAnimationFrame(render);
 			}
 		}
+	}
 
-		// Set the cell values to the temp values and add html class data to hottest cores to color them red
-		for (var i = 0; i < temps.length; i++){
-			$('#cpu' + (i+1).toString()).html(temps[i] + "°C");
-			if (hot_threads.indexOf(i) != -1) {
-				$('#cpu' + (i+1).toString()).addClass("hot");
-			} else {
-				$('#cpu' + (i+1).toString()).removeClass("hot");
+	function render() {
+		frameRequested = false;
+		for (var i = 0; i < dirty.length; i++) {
+			var cell = dirty[i];
+			cell.dirty = false;
+			if (cell.el === null) { continue; }
+			if (cell.nextText !== cell.text) {
+				cell.el.textContent = cell.nextText;
+				cell.text = cell.nextText;
+			}
+			if (cell.nextHot !== cell.hot) {
+				if (cell.nextHot) { cell.el.classList.add("hot"); } else { cell.el.classList.remove("hot"); }
+				cell.hot = cell.nextHot;
 			}
 		}
-	});
+		dirty = [];
+	}
 
-	// jQuery function for updating the CPU fan speed values
-	socket.on('cpuFans', function(msg) {
-		// Parse the data from the incoming message (separated by ;)
-		var cpuFanSpeed = msg.cpu_fans.split(";")[0]
-		var cpuPercent = msg.cpu_fans.split(";")[1]
+	// Temps come in as numbers; empty/unreadable slots are -1
+	function formatTemp(temp) {
+		return (temp >= 0 ? temp : "--") + "°C";
+	}
 
-		// Send the data to the html doc
-		$('#cpuFanSpeed').html(cpuFanSpeed);
-		$('#cpuPercent').html("CPU @ " + cpuPercent + "%");
-	});
+	// Update the CPU temperature values, coloring the hottest cores red (several if they're tied)
+	function cpuTempUpdate(temps) {
+		var n = Math.min(temps.length, num_threads);
+		var top_temp = 0;
+		for (var i = 0; i < n; i++) {
+			if (temps[i] > top_temp) { top_temp = temps[i]; }
+		}
+		for (var i = 0; i < n; i++) {
+			setCell(cpuCells[i], formatTemp(temps[i]), temps[i] == top_temp);
+		}
+	}
 
-	// jQuery function for updating the HDD temp values
-	socket.on('hddTempUpdate', function(msg) {
-		// Set up variables for processing data
-		var temps = new Array(num_drives);
-		var top_temp = [0,0];
-		var hot_disks = new Array(num_drives);
+	// Update the CPU fan speed and load: [duty, rpm, load]
+	function cpuFans(fans) {
+		setCell(cpuFanCell, "Fans " + fans[0] + "% @ " + (fans[1] >= 0 ? fans[1] : "--") + " RPM", false);
+		setCell(cpuPercentCell, "CPU @ " + fans[2].toFixed(1) + "%", false);
+	}
 
-		// Find hottest disk per shelf
-		for (var i = 0; i < num_drives; i++) {
-			temps[i] = msg.hdd_temps.split(" ")[i];
-			temp = parseInt(temps[i]);
-			if (i < 24) {
-				if (temp > top_temp[0]) { top_temp[0] = temp; }
-			} else {
-				if (temp > top_temp[1]) { top_temp[1] = temp; }
+	// Update the HDD temp values, coloring the hottest disks in each shelf red (each shelf is a run of slots from
+	// start to end)
+	function hddTempUpdate(temps) {
+		var n = Math.min(temps.length, num_drives);
+		for (var c = 0; c < num_chassis; c++) {
+			var end = Math.min(chassis[c].end, n);
+			var top_temp = 0;
+			for (var i = chassis[c].start; i < end; i++) {
+				if (temps[i] > top_temp) { top_temp = temps[i]; }
 			}
-		}
-
-		// Find if multiple disks per shelf are the same hottest temp
-		for (var i = 0; i < num_drives; i++) {
-			if (i < 24) {
-				if (parseInt(temps[i]) == top_temp[0]) {
-					hot_disks.push(i);
-				}
-			} else {
-				if (parseInt(temps[i]) == top_temp[1]) {
-					hot_disks.push(i);
-				}
+			for (var i = chassis[c].start; i < end; i++) {
+				setCell(diskCells[i], formatTemp(temps[i]), top_temp > 0 && temps[i] == top_temp);
 			}
 		}
+	}
 
-		// Send all temp data to the table, color cells with hottest drives red by adding html class to the cell
-		for (var i = 0; i < temps.length; i++){
-			$('#disk' + (i+1).toString()).html(temps[i] + "°C");
-			if (hot_disks.indexOf(i) != -1) {
-				$('#disk' + (i+1).toString()).addClass("hot");
-			} else {
-				$('#disk' + (i+1).toString()).removeClass("hot");
-			}
+	// Update one shelf's fan and ambient temp: [duty, target, ramp start, ramping, rpm, ambient in C], or null if the
+	// shelf controller is disconnected
+	function shelf(num, status) {
+		if (status === null) {
+			setCell(fanCells[num], "DISCONNECTED!", false);
+			setCell(ambCells[num], "Amb. 0°F", false);
+			return;
 		}
-	});
+		if (status[3]) {
+			// If we're in the middle of a ramp, show the current duty cycle, the old duty cycle and the new duty cycle
+			setCell(fanCells[num], "Fans " + status[0] + "% (" + status[2] + "% -> " + status[1] + "%)", false);
+		} else {
+			// If not, just show current duty cycle and rpm
+			setCell(fanCells[num], "Fans " + status[0] + "% @ " + status[4] + " RPM", false);
+		}
+		setCell(ambCells[num], "Amb. " + Math.floor(status[5] * 9 / 5 + 32) + "°F", false);
+	}
 
-	// jQuery function for updating the HDD fan and ambient temp values
-	socket.on('shelf', function(msg) {
-		// Split the data out per shelf
-		var shelfNum = msg.shelfData.split(";")[0]
-		var fanSpeed = msg.shelfData.split(";")[1]
-		var ambTemp = msg.shelfData.split(";")[2]
+	// Connect to socket.io running in the Python script
+	var socket = io.connect('http://' + document.domain + ':' + location.port);
 
-		// Send to html doc for display
-		$('#fanSpeed' + shelfNum).html(fanSpeed);
-		$('#ambTemp' + shelfNum).html("Amb. " + ambTemp + "°F");
+	// Each update only holds the keys that changed since the last one
+	socket.on('update', function(msg) {
+		if ('cpu_temps' in msg) { cpuTempUpdate(msg.cpu_temps); }
+		if ('cpu_fans' in msg) { cpuFans(msg.cpu_fans); }
+		if ('hdd_temps' in msg) { hddTempUpdate(msg.hdd_temps); }
+		for (var c = 0; c < num_chassis; c++) {
+			if (('shelf' + c) in msg) { shelf(c, msg['shelf' + c]); }
+		}
 	});
-});
\ No newline at end of file
+});
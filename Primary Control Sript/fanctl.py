@@ -8,8 +8,6 @@
 
 ### TODO:
 # eventlet on fanctl_disp
-# split CPU and HDD code into threads in fanctl
-# split rpm, temp, comms code into threads in fanctl_client
 # zpool status info on fanctl_disp
 # SMART data on fanctl_disp
 # fanctl_client device stats (cpu, temp) on fanctl_disp
@@ -18,14 +16,39 @@
 
 ### Libraries:
 # time to get current seconds
-# datetime to timestamp log file messages
-# subprocess for executing shell commands
-# re for regex processing
-# sys for logging file access
+# sys for the module path and exit codes
 # signal to close log file on script termination (SIGTERM)
-# socket to connect to controllers and display
 # psutil to get cpu load info
-import time, datetime, subprocess, re, sys, signal, socket, psutil
+# os to find the shared modules in ../Common
+# threading to share the disk temp encoder between tasks
+# fanctl_smart to poll disk temps in the background
+# fanctl_ipmi to talk to the BMC over a persistent ipmitool session
+# fanctl_sensors to read CPU temps without spawning a shell pipeline
+# fanctl_disks to find which device node each disk is on
+# fanctl_sched to run the control tasks on their own timers
+# fanctl_proto for the framed message protocol used with the shelves and display
+# fanctl_net to keep the shelf and display connections up in the background
+# fanctl_curve to map temps to duty cycles
+# fanctl_topology for the chassis/disk layout and controller addresses
+# fanctl_metrics to time the hot paths and serve the numbers to Prometheus
+# fanctl_trace to record sensor readings and control decisions, and replay them
+# fanctl_log for the buffered, rotated log file
+# array for the per-slot disk temps
+import time, sys, signal, psutil, os, threading
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from fanctl_smart import SmartPoller, PollSchedule
+from fanctl_ipmi import IpmiBackend, IpmiError
+from fanctl_sensors import open_cpu_temp_backend
+from fanctl_disks import DiskInventory
+from fanctl_sched import Scheduler
+from fanctl_net import ConnectionManager
+from fanctl_proto import HddDeltaEncoder, Record, CpuFans, CPU_TEMPS, CPU_FANS, HDD_TEMPS, DUTY, HDD_ACK, SHELF_TELEMETRY, SHELF_STALLED, SHELF_NO_AMBIENT
+from fanctl_curve import FanCurve
+from fanctl_topology import load_topology, DEFAULT_PATH as TOPOLOGY_PATH
+from fanctl_metrics import Metrics
+from fanctl_trace import TraceWriter, read_trace, replay, EVENT_NAMES, FAN_MODE_SET, BMC_RESET, BAD_FAN_READING, FAN_UNREADABLE, IPMI_ERROR
+from fanctl_log import setup_logging, stop_logging, get_logger
+from array import array
 
 ### User-editable variables
 # CPU and HDD temps (in C) map to duty cycles below
@@ -33,109 +56,93 @@ cpu_temp_list = [30,31,32,33,34,35,36,37,38,39,40,41,42,43,44,45,46,47,48,49,50,
 cpu_duty_list = [50,52,54,56,58,60,62,64,66,68,70,72,74,76,78,80,82,84,86,88,90,92,94,96,98,100]
 hd_temp_list  = [36,37,38,39,40,41 ]
 hd_duty_list  = [25,30,40,50,75,100]
-
-# Path to log file
+interpolate_curves = False		# Interpolate duty cycles between the temps above instead of stepping
+
+# Air temp inside each shelf (in C, reported by its controller's probes) maps to a minimum duty cycle for that shelf
+shelf_ambient_temp_list = [30,35,40 ]
+shelf_ambient_duty_list = [25,50,100]
+
+# Fans speed up as soon as temps call for it, but only slow down once temps have dropped this many degrees below the
+# step and the duty cycle has held for the dwell time (in seconds). Keeps temps bouncing across a step from turning
+# into a constant stream of fan changes.
+cpu_hysteresis = 2
+cpu_min_dwell = 10
+hd_hysteresis = 1
+hd_min_dwell = 300
+
+# Path to log file. It's appended to and rotated (keeping log_backups old files) once it's bigger than log_max_size bytes
+# or older than log_max_age seconds. Warnings and errors repeated within log_repeat_window seconds are collapsed
+# into one line.
 log_file = "/mnt/tank/usr/jfr/logs/fanctl.log"
+log_max_size = 10 * 1024 * 1024
+log_max_age = 7 * 86400
+log_backups = 4
+log_repeat_window = 60
+
+# Path to smartctl
+smartctl = "/usr/local/sbin/smartctl"
+
+# Path to ipmitool and the SDR cache it uses to look up single sensors without walking the whole repository
+ipmitool = "/usr/local/bin/ipmitool"
+ipmi_sdr_cache = "/var/tmp/fanctl.sdr"
+
+# How to read CPU core temps: "sysctl" (FreeBSD, in-process), "hwmon" (Linux sysfs), "pipeline" (sysctl | egrep | awk
+# shell pipeline), or "auto" to use the first one that works
+cpu_temp_backend = "auto"
+
+# Chassis, drive bays, disk serials and controller addresses; shared with the display. See Common/fanctl_topology.json.
+topology_file = TOPOLOGY_PATH
 
 # Misc. variables
 cpu_override_temp = 70			# CPU temp at which HD fans should spin up to help with cooling
 cpu_max_fan_speed = 1800		# Max RPM of CPU fan, used to check BMC is functioning
 cpu_fan_header = "FAN1"			# Header to which CPU fan(s) are connected, used to check fan speed
-num_chassis = 2					# Number of chassis on system (head unit + # of shelves)
-num_disks = 40
-hd_polling_interval = 60		# How often (in seconds) to check HD temps
+cpu_control_period = 1			# How often (in seconds) to check CPU temps and set CPU fan duty
+fan_check_period = 1			# How often (in seconds) to check the CPU fan speed reading
+telemetry_period = 1			# How often (in seconds) to send CPU data to the display
+stats_interval = 600			# How often (in seconds) to log task timing, IPMI latency and p50/p99 call stats
+metrics_port = 9105				# Port to serve Prometheus metrics on at /metrics; 0 to turn it off
+trace_file = ""					# Append every sensor reading and fan decision here for "fanctl.py --replay"; "" to turn it off
+hd_polling_interval = 60		# How often (in seconds) to check HD temps normally, and to log them
+hd_poll_min_interval = 15		# Fastest a disk gets checked (when close to the next duty step or heating up quickly)
+hd_poll_max_interval = 300		# Slowest a disk gets checked (when cool and stable)
+hd_standby_interval = 60		# How often to check whether a spun-down disk is back up (checking doesn't wake it)
+hd_poll_workers = 8				# Number of disks to query with smartctl at the same time
+hd_poll_timeout = 10			# Seconds to wait on a single disk before giving up on it for this sweep
+hd_sweep_budget = 30			# Max seconds an HD sweep may take; disks not done by then keep their last temp
+disk_rescan_interval = 300		# How often (in seconds) to look for hot-plugged or replaced disks
+disk_cache_file = "/var/tmp/fanctl_disks.json"	# Disk inventory saved between runs so restarts don't re-probe every disk
+hd_delta_telemetry = True		# Send the display only the disk temps that changed (plus a full list now and then)
+hd_keyframe_interval = 600		# How often (in seconds) to send the display the full disk temp list when sending deltas
+reconnect_max_backoff = 60		# Longest wait (in seconds) between attempts to reach a shelf controller or display that is down
+shelf_confirm_time = 30			# Resend a shelf's duty cycle if it still isn't running it this many seconds after it was sent
+shelf_telemetry_timeout = 30	# Stop using a shelf's ambient temp if it hasn't reported for this many seconds
 bmc_fail_threshold = 5			# If CPU fan speed is wrong this many times in a row, reset BMC
 bmc_reboot_grace_time = 240		# If BMC has to reset, how long to wait in seconds for it to reboot
 debug = True 					# Print debug messages to log
 cpu_debug = False 				# Print CPU temps to log
 
-### Disk identification info
-# Used to map device nodes to physical disk location for arduino display. Starts with disk
-# in top left slot of chassis continuing along top row like so:
-#
-#	[ 01 | 02 | 03 | 04 ]
-#	[ 05 | 06 | 07 | 08 ]
-#	[    ... etc ...    ]
-#
-# Identification algorithm relies on disk serial number; enter them in list below
-# Shelf 00 disks:
-disk_01 = {"serial": "", "shelf": 0, "position": 1,  "node": "", "temp": 0}
-disk_02 = {"serial": "", "shelf": 0, "position": 2,  "node": "", "temp": 0}
-disk_03 = {"serial": "", "shelf": 0, "position": 3,  "node": "", "temp": 0}
-disk_04 = {"serial": "", "shelf": 0, "position": 4,  "node": "", "temp": 0}
-disk_05 = {"serial": "", "shelf": 0, "position": 5,  "node": "", "temp": 0}
-disk_06 = {"serial": "", "shelf": 0, "position": 6,  "node": "", "temp": 0}
-disk_07 = {"serial": "", "shelf": 0, "position": 7,  "node": "", "temp": 0}
-disk_08 = {"serial": "", "shelf": 0, "position": 8,  "node": "", "temp": 0}
-disk_09 = {"serial": "", "shelf": 0, "position": 9,  "node": "", "temp": 0}
-disk_10 = {"serial": "", "shelf": 0, "position": 10, "node": "", "temp": 0}
-disk_11 = {"serial": "", "shelf": 0, "position": 11, "node": "", "temp": 0}
-disk_12 = {"serial": "", "shelf": 0, "position": 12, "node": "", "temp": 0}
-disk_13 = {"serial": "", "shelf": 0, "position": 13, "node": "", "temp": 0}
-disk_14 = {"serial": "", "shelf": 0, "position": 14, "node": "", "temp": 0}
-disk_15 = {"serial": "", "shelf": 0, "position": 15, "node": "", "temp": 0}
-disk_16 = {"serial": "", "shelf": 0, "position": 16, "node": "", "temp": 0}
-disk_17 = {"serial": "", "shelf": 0, "position": 17, "node": "", "temp": 0}
-disk_18 = {"serial": "", "shelf": 0, "position": 18, "node": "", "temp": 0}
-disk_19 = {"serial": "", "shelf": 0, "position": 19, "node": "", "temp": 0}
-disk_20 = {"serial": "", "shelf": 0, "position": 20, "node": "", "temp": 0}
-disk_21 = {"serial": "", "shelf": 0, "position": 21, "node": "", "temp": 0}
-disk_22 = {"serial": "", "shelf": 0, "position": 22, "node": "", "temp": 0}
-disk_23 = {"serial": "", "shelf": 0, "position": 23, "node": "", "temp": 0}
-disk_24 = {"serial": "", "shelf": 0, "position": 24, "node": "", "temp": 0}
-
-# Shelf 01 disks:
-disk_25 = {"serial": "", "shelf": 1, "position": 1,  "node": "", "temp": 0}
-disk_26 = {"serial": "", "shelf": 1, "position": 2,  "node": "", "temp": 0}
-disk_27 = {"serial": "", "shelf": 1, "position": 3,  "node": "", "temp": 0}
-disk_28 = {"serial": "", "shelf": 1, "position": 4,  "node": "", "temp": 0}
-disk_29 = {"serial": "", "shelf": 1, "position": 5,  "node": "", "temp": 0}
-disk_30 = {"serial": "", "shelf": 1, "position": 6,  "node": "", "temp": 0}
-disk_31 = {"serial": "", "shelf": 1, "position": 7,  "node": "", "temp": 0}
-disk_32 = {"serial": "", "shelf": 1, "position": 8,  "node": "", "temp": 0}
-disk_33 = {"serial": "", "shelf": 1, "position": 9,  "node": "", "temp": 0}
-disk_34 = {"serial": "", "shelf": 1, "position": 10, "node": "", "temp": 0}
-disk_35 = {"serial": "", "shelf": 1, "position": 11, "node": "", "temp": 0}
-disk_36 = {"serial": "", "shelf": 1, "position": 12, "node": "", "temp": 0}
-disk_37 = {"serial": "", "shelf": 1, "position": 13, "node": "", "temp": 0}
-disk_38 = {"serial": "", "shelf": 1, "position": 14, "node": "", "temp": 0}
-disk_39 = {"serial": "", "shelf": 1, "position": 15, "node": "", "temp": 0}
-disk_40 = {"serial": "", "shelf": 1, "position": 16, "node": "", "temp": 0}
-disk_41 = {"serial": "", "shelf": 1, "position": 17, "node": "", "temp": 0}
-disk_42 = {"serial": "", "shelf": 1, "position": 18, "node": "", "temp": 0}
-disk_43 = {"serial": "", "shelf": 1, "position": 19, "node": "", "temp": 0}
-disk_44 = {"serial": "", "shelf": 1, "position": 20, "node": "", "temp": 0}
-disk_45 = {"serial": "", "shelf": 1, "position": 21, "node": "", "temp": 0}
-disk_46 = {"serial": "", "shelf": 1, "position": 22, "node": "", "temp": 0}
-disk_47 = {"serial": "", "shelf": 1, "position": 23, "node": "", "temp": 0}
-disk_48 = {"serial": "", "shelf": 1, "position": 24, "node": "", "temp": 0}
-
 ### System variables
-# Aggregate disks for easier iteration
-hd_list = [disk_01,disk_02,disk_03,disk_04,disk_05,disk_06,disk_07,disk_08,disk_09,disk_10,
-		   disk_11,disk_12,disk_13,disk_14,disk_15,disk_16,disk_17,disk_18,disk_19,disk_20,
-		   disk_21,disk_22,disk_23,disk_24,disk_25,disk_26,disk_27,disk_28,disk_29,disk_30,
-		   disk_31,disk_32,disk_33,disk_34,disk_35,disk_36,disk_37,disk_38,disk_39,disk_40,
-		   disk_41,disk_42,disk_43,disk_44,disk_45,disk_46,disk_47,disk_48]
-shelf_0 = [disk_01,disk_02,disk_03,disk_04,disk_05,disk_06,disk_07,disk_08,disk_09,disk_10,
-		   disk_11,disk_12,disk_13,disk_14,disk_15,disk_16,disk_17,disk_18,disk_19,disk_20,
-		   disk_21,disk_22,disk_23,disk_24]
-shelf_1 = [disk_25,disk_26,disk_27,disk_28,disk_29,disk_30,disk_31,disk_32,disk_33,disk_34,
-		   disk_35,disk_36,disk_37,disk_38,disk_39,disk_40,disk_41,disk_42,disk_43,disk_44,
-		   disk_45,disk_46,disk_47,disk_48]
-shelves = [shelf_0,shelf_1]
+# Chassis and disk layout. Disks are identified by serial number; enter them in the topology file.
+topology = load_topology(topology_file)
+num_chassis = topology.num_chassis
+num_disks = topology.num_disks
 
 # Initialize other system variables
 cpu_fan_unreadable_time = 0
 bmc_fail_count = 0
 cpu_fan_duty = 0
-last_hd_check_time = 0
+bmc_duty = None		# Last CPU duty cycle the BMC took (None = not known, e.g., after a fan mode set or BMC reset)
+cpu_fan_speed = -1
+cpu_fan_speed_time = 0
+cpu_temp = 0
+core_temps = []
+hd_fan_override = False
 override_time = 0
+last_hd_log_time = 0
 
-# Redirect stdout and stderr to log file
-log = open(log_file,'w')
-sys.stdout = log
-sys.stderr = log
+# Disk temps by slot; -1 for empty bays and disks without a reading
+hd_temps = array("h",[-1] * num_disks)
 
 # Generate per-shelf variables
 hd_fan_duty = []
@@ -150,177 +157,246 @@ shelf_tty = []
 for x in range(0,num_chassis):
 	shelf_tty.append(0)
 
+# What each shelf controller reports back: its latest ShelfTelemetry and when it arrived, whether its fan is stalled,
+# and the duty cycle we last sent it and when. Updated from the connection thread.
+shelf_telemetry = [None] * num_chassis
+shelf_telemetry_time = [0] * num_chassis
+shelf_stalled = [False] * num_chassis
+shelf_sent = [(None,0)] * num_chassis
+shelf_peers = {}
+
+# Call timings and counters for everything below
+metrics = Metrics()
+
+# Fan curves; each shelf gets its own so hysteresis and dwell are tracked per shelf
+cpu_curve = FanCurve(cpu_temp_list,cpu_duty_list,interpolate_curves,cpu_hysteresis,cpu_min_dwell)
+hd_curves = [FanCurve(hd_temp_list,hd_duty_list,interpolate_curves,hd_hysteresis,hd_min_dwell) for x in range(num_chassis)]
+shelf_ambient_curve = FanCurve(shelf_ambient_temp_list,shelf_ambient_duty_list,interpolate_curves)
+
+# All BMC commands go through one long-lived ipmitool session
+ipmi = IpmiBackend(ipmitool,ipmi_sdr_cache,metrics=metrics)
+
+# Open the CPU temp sensors once; reads after this don't fork anything
+cpu_sensor = open_cpu_temp_backend(cpu_temp_backend)
+
+# Disk temps are read by a pool of workers so one slow disk doesn't hold up the rest of the sweep. Each disk is only
+# read when the poll schedule says it's due.
+smart_poller = SmartPoller(smartctl,hd_poll_workers,hd_poll_timeout,hd_sweep_budget,metrics)
+hd_poll_schedule = PollSchedule(hd_temp_list,hd_poll_min_interval,hd_polling_interval,hd_poll_max_interval,hd_standby_interval)
+
+# Finds which device node each disk is on
+disk_inventory = DiskInventory(topology.serials,smartctl,hd_poll_workers,hd_poll_timeout,disk_cache_file,metrics)
+
+# Connections to the shelf controllers and display are kept up by a background thread; sending just queues the
+# latest value and never waits on the network. Peers are named "shelf N" and "display".
+port = topology.port
+net = ConnectionManager(max_backoff=reconnect_max_backoff,metrics=metrics)
+
+# Disk temps to the display are delta-encoded against the last snapshot it acknowledged. Acks come back on the
+# connection thread while sweeps encode on their own, so the encoder has a lock.
+hdd_encoder = HddDeltaEncoder(hd_keyframe_interval)
+hdd_encoder_lock = threading.Lock()
+
+# Runs the control tasks below, each on its own timer
+scheduler = Scheduler(metrics=metrics)
+
+# Sensor trace (see trace_file); opened at startup
+trace = None
+
+# Log calls only queue the line; it's written out in the background (see log_file)
+log = get_logger("fanctl")
+
 ### Pre-loop setup/info gathering
-# Attempt to connect to a web socket at IP and port for a given number of attempts; attempts = 0 means indefinite retries
-def connectToSocket(sock,ip,port,attempts):
-	connected = False
-	x = 0
-	while connected == False:
-		if attempts != 0: x += 1
-		try:
-			sock.connect((ip, port))
-			print(datetime.datetime.today().strftime('%m-%d-%Y %H:%M:%S') + " - ", end = "")
-			print("Connected to " + sock.getpeername()[0],flush=True)
-			connected = True
-		except:
-			print(datetime.datetime.today().strftime('%m-%d-%Y %H:%M:%S') + " - ", end = "")
-			if x < attempts:
-				print("ERROR: Could not connect to " + ip + " (attempt #" + str(x) + "). Trying again in 5 seconds.",flush=True)
-			else:
-				print("ERROR: Could not connect to " + ip + " (attempt #" + str(x) + "). Bailing.",flush=True)
-				return
-			time.sleep(5)
-			pass
+# Queue records for the display under key; anything still waiting under the same key is replaced
+def send_to_display(key,records):
+	net.send("display",key,records)
+
+# Queue records for the controller in a shelf under key
+def send_to_shelf(shelf,key,records):
+	net.send("shelf " + str(shelf),key,records)
+
+# Pick up the disk temp acks the display sends back
+def display_frames(peer,frames):
+	with hdd_encoder_lock:
+		for seq, records in frames:
+			for record in records:
+				if record.type == HDD_ACK: hdd_encoder.ack(record.value)
+
+# Take in what a shelf controller reports back. A stalled fan gets the shelf sent 100% right away rather than at the
+# next HDD sweep, and a shelf that still isn't running the duty cycle it was sent shelf_confirm_time ago is sent it
+# again.
+def shelf_frames(peer,frames):
+	shelf = shelf_peers[peer.name]
+	status = None
+	for seq, records in frames:
+		for record in records:
+			if record.type == SHELF_TELEMETRY: status = record.value
+	if status is None: return
+	now = time.monotonic()
+	shelf_telemetry[shelf] = status
+	shelf_telemetry_time[shelf] = now
+	metrics.set("fanctl_shelf_rpm",status.rpm,shelf=shelf)
+	if not status.flags & SHELF_NO_AMBIENT: metrics.set("fanctl_shelf_ambient_celsius",status.ambient,shelf=shelf)
+
+	stalled = bool(status.flags & SHELF_STALLED)
+	if stalled != shelf_stalled[shelf]:
+		shelf_stalled[shelf] = stalled
+		if stalled:
+			log.error("Shelf fan stalled, setting shelf fans to 100%",shelf=shelf,duty=status.duty)
+			metrics.inc("fanctl_shelf_fan_stalls_total",shelf=shelf)
+			hd_fan_duty[shelf] = 100
+			shelf_sent[shelf] = (100,now)
+			send_to_shelf(shelf,"duty",[Record(DUTY,100)])
+		else:
+			log.info("Shelf fan running again",shelf=shelf,rpm=status.rpm)
+		return
+
+	sent, sent_time = shelf_sent[shelf]
+	if sent is not None and now - sent_time >= shelf_confirm_time and (status.target != sent or (not status.ramping and status.duty != sent)):
+		log.warning("Shelf isn't running the duty cycle it was sent, sending it again",shelf=shelf,sent=sent,running=status.duty)
+		metrics.inc("fanctl_shelf_duty_mismatches_total",shelf=shelf)
+		shelf_sent[shelf] = (sent,now)
+		send_to_shelf(shelf,"duty",[Record(DUTY,sent)])
+
+# A new display connection has none of our disk temp snapshots, so start over with a keyframe
+def display_connected(peer):
+	with hdd_encoder_lock:
+		hdd_encoder.reset()
+
+# Note a BMC event in the trace, if we're recording one
+def trace_event(code):
+	if trace is not None: trace.event(code)
 
 # Set BMC fan mode to full allowing for manual control
 def set_fan_mode_full():
-	subprocess.check_output("/usr/local/bin/ipmitool raw 0x30 0x45 0x01 1",shell=True)
+	global bmc_duty
+	# Full mode runs the fans at 100% until a duty cycle is set again
+	bmc_duty = None
+	metrics.inc("fanctl_bmc_fan_mode_sets_total")
+	trace_event(FAN_MODE_SET)
+	try: ipmi.set_fan_mode_full()
+	except IpmiError as e:
+		trace_event(IPMI_ERROR)
+		log.error("Could not set BMC fan mode: " + str(e))
 	time.sleep(5)
 
 # BMC reset function called in case of CPU fan errors
 def reset_bmc():
-	subprocess.check_output("/usr/local/bin/ipmitool bmc reset cold",shell=True)
+	global bmc_duty
+	bmc_duty = None
+	metrics.inc("fanctl_bmc_resets_total")
+	trace_event(BMC_RESET)
+	try: ipmi.bmc_reset_cold()
+	except IpmiError as e:
+		trace_event(IPMI_ERROR)
+		log.error("Could not cold reset BMC: " + str(e))
 	time.sleep(5)
 
+# Set CPU fan duty cycle through IPMI
+def set_cpu_fan_duty(duty):
+	global bmc_duty
+	try:
+		ipmi.set_fan_duty(0,duty)
+		bmc_duty = duty
+	except IpmiError as e:
+		trace_event(IPMI_ERROR)
+		log.error("Could not set CPU fan duty cycle: " + str(e))
+
 # Close log file on SIGTERM
 def close_log(signum, frame):
-	sys.stdout.close()
-	sys.stderr.close()
-	for shelf in range(num_chassis):
-		shelf_sock[shelf].close()
-	disp_sock.close()
-	print(datetime.datetime.today().strftime('%m-%d-%Y %H:%M:%S') + " - Script terminating.",flush=True)
-
-signal.signal(signal.SIGTERM,close_log)
-
-# Print script start time to log file
-print("Starting fan control script at " + datetime.datetime.today().strftime('%m-%d-%Y %H:%M:%S'),flush=True)
-
-# Set IPMI fan mode to full
-print(datetime.datetime.today().strftime('%m-%d-%Y %H:%M:%S') + " - ", end = "")
-print("Setting CPU fan mode to full.",flush=True)
-set_fan_mode_full()
-
-# Connect via sockets to the controllers in each shelf
-shelf_sock = [""] * num_chassis
-port = 10000
-for shelf in range(0,num_chassis):
-	shelf_sock[shelf] = socket.socket()
-	connectToSocket(shelf_sock[shelf],"10.0.10." + str(shelf),port,0)
-
-# Connect via sockets to the display device
-disp_sock = socket.socket()
-connectToSocket(disp_sock,"10.0.10.100",port,0)
-
-# Populate HD List, get all disks from sysctl -n kern.disks command and split output into list
-nodes = subprocess.check_output("/sbin/sysctl -n kern.disks",shell=True).decode("utf-8").replace("\n","")
-node_list = nodes.split(" ")
-for node in node_list:
-	# Attempt to run smartctl -i on each disk, remove the disks that don't support smartctl
-	try:
-		smart = subprocess.check_output("/usr/local/sbin/smartctl -i /dev/" + node,shell=True).decode("utf-8")
-	except:
-		node_list.remove(node)
-		break
-	# Remove SSDs from the list
-	node_type = re.search(r'(.*?Rotation.*?)\n',smart)[0]
-	if "Solid State Device" in node_type:
-		node_list.remove(node)
-	else:
-		# Get the serial number via regex search from the smartctl output
-		node_serial = re.search(r'(.*?Serial.*?)\n',smart)[0]
-		# Search for that serial in the hd_list
-		for hd in hd_list:
-			if hd["serial"] in node_serial:
-				# When it finds a match, put the device node into the dictionary
-				hd["node"] = node
-				print(datetime.datetime.today().strftime('%m-%d-%Y %H:%M:%S') + " - ", end = "")
-				print("Found disk /dev/" + hd["node"] + " with serial " + hd["serial"] + " in shelf " + str(hd["shelf"]) + " position " + str(hd["position"]),flush=True)
-				break
-
-### Main loop
-# 1) Check CPU temps with sysctl, map max temp to duty cycle, set duty cycle with ipmitool. If fan speed goes unchanged
-# 	for a certain amount of time, verify that the fan speed reading is sane. If not, reset BMC.
-# 2) Check HD temps every so often via smartctl, record all temps, determine max temp in each shelf, map max temp to
-# 	duty cycle, set duty cycle via socket connection to controller in each shelf and send temp data to display unit.
-while True:
-	### CPU temp check and duty cycle management
+	scheduler.stop()
+	net.stop()
+	metrics.stop()
+	if trace is not None: trace.close()
+	log.info("Script terminating.")
+	stop_logging()
+	sys.exit(0)
+
+# Log disks that were found, moved, or went away during a disk scan
+def log_disk_changes(changes):
+	for slot, old_node, new_node in changes:
+		shelf, position = topology.locate(slot)
+		if new_node:
+			log.info("Found disk /dev/" + new_node,serial=topology.serials[slot],shelf=shelf,position=position)
+		else:
+			log.info("Disk is gone (was /dev/" + old_node + ")",serial=topology.serials[slot],shelf=shelf,position=position)
+
+### Control tasks
+# These run on their own timers from the scheduler (see the bottom of the file):
+# 1) cpu_control: check CPU temps, map max temp to duty cycle, set duty cycle with ipmitool.
+# 2) verify_cpu_fan: verify that the fan speed reading is sane. If not, reset BMC.
+# 3) hdd_sweep: check temps of the disks that are due via smartctl, record all temps, determine max temp in each
+# 	shelf, map max temp to duty cycle, set duty cycle via socket connection to controller in each shelf and send temp
+# 	data to display unit.
+# 4) disk_rescan: look for hot-plugged or replaced disks.
+# 5) publish_telemetry: send CPU temps and fan speed to the display unit.
+# The CPU tasks share the "bmc" lane so they never talk to the BMC at the same time; everything else runs on its
+# own thread, so a slow HDD sweep or a stuck display socket can't hold up CPU fan control.
+
+### CPU temp check and duty cycle management
+def cpu_control():
+	global core_temps, cpu_temp, cpu_fan_duty, hd_fan_override, override_time
+	global cpu_fan_speed, cpu_fan_speed_time, bmc_duty
+
 	# Check all CPU core temps, determine max temp, map temp to duty cycle
-	core_temps = subprocess.check_output("/sbin/sysctl -a dev.cpu | egrep -E \"dev.cpu.[0-9]+.temperature\" | awk \'{print $2}\' | sed \'s/.$//\'",shell=True)
-	core_temps = core_temps.decode("utf-8").split()
-	
-	# Prefix cpu temp data with "cpu;" so display knows which data type it is
-	cpu_temp_list_str = "cpu;"
-	for temp in core_temps:
-		cpu_temp_list_str += str(int(float(temp))) + " "
-	cpu_temp_list_str = cpu_temp_list_str.strip()
-
-	# Attempt to send CPU temp data to display; if unsuccessful, attempt to reconnect.
-	try:
-		disp_sock.send(cpu_temp_list_str.encode("utf-8"))
-	except:
-		print("ERROR: Could not send to display web socket! Attempting to reconnect now...",flush=True)
-		disp_sock.close()
-		disp_sock = socket.socket()
-		connectToSocket(disp_sock,"10.0.10.100",port,5)
+	with metrics.time("fanctl_sensor_read_seconds",backend=cpu_sensor.name):
+		temps = cpu_sensor.read()
+	core_temps = [int(temp) for temp in temps]
+	if trace is not None: trace.core_temps(core_temps)
 
 	# Determine max core temp; look up this temp in duty cycle mapping
-	cpu_temp = int(float(max(core_temps)))
-	for temp in cpu_temp_list:
-		if cpu_temp <= temp:
-			last_cpu_fan_duty = cpu_fan_duty
-			cpu_fan_duty = cpu_duty_list[cpu_temp_list.index(temp)]
-			break
-
-	# If CPU temp is too high, set HD fans to 100% (enter fan check by resetting HD check time)
+	cpu_temp = int(max(temps))
+	last_cpu_fan_duty = cpu_fan_duty
+	cpu_fan_duty = cpu_curve.update(cpu_temp,time.monotonic())
+	metrics.set("fanctl_cpu_temp_celsius",cpu_temp)
+	if trace is not None: trace.cpu_duty(cpu_fan_duty)
+
+	# If CPU temp is too high, set HD fans to 100% (run an HDD sweep right away so it takes effect)
 	if cpu_temp >= cpu_override_temp:
 		hd_fan_override = True
 		if int(time.time()) - override_time > hd_polling_interval:
-			print(datetime.datetime.today().strftime('%m-%d-%Y %H:%M:%S') + " - ", end = "")
-			print("CPU above HDD fan override threshold of " + str(cpu_override_temp) + "*C, overriding head unit HDD fans to 100%",flush=True)
+			log.info("CPU above HDD fan override threshold of " + str(cpu_override_temp) + "*C, overriding head unit HDD fans to 100%")
 			override_time = int(time.time())
-			last_hd_check_time = 0
+			scheduler.trigger("hdd_sweep")
 	else:
 		hd_fan_override = False
-	
-	# Set CPU fan duty cycle through IPMI if new duty cycle selected
-	if cpu_fan_duty != last_cpu_fan_duty:
-		if cpu_debug:
-			print(datetime.datetime.today().strftime('%m-%d-%Y %H:%M:%S') + " - ", end = "")
-			print("CPU at " + str(cpu_temp) + "*C, setting CPU fans " + str(cpu_fan_duty) + "%",flush=True)
-		subprocess.check_output("/usr/local/bin/ipmitool raw 0x30 0x70 0x66 0x01 0 " + str(cpu_fan_duty),shell=True)
-		last_cpu_fan_change_time = int(time.time())
-
-	### CPU fan speed verification
-	# Check that fan speed is being reported by ipmitool and that the reading is non-zero and not above max fan speed
-	cpu_fan_speed = subprocess.check_output("/usr/local/bin/ipmitool sdr | grep " + cpu_fan_header,shell=True).decode("utf-8").split()[2]
-	
-	# Use this data to send fan speed data to display. Attempt to send data to display; attempt to reconnect on failure
-	cpu_fan_disp = "cpu_fans;Fans " + str(cpu_fan_duty) + "% @ " + str(cpu_fan_speed) + " RPM;" + str(psutil.cpu_percent())
-	try:
-		disp_sock.send(cpu_fan_disp.encode("utf-8"))
-	except:
-		print(datetime.datetime.today().strftime('%m-%d-%Y %H:%M:%S') + " - ", end = "")
-		print("ERROR: Could not send to display web socket! Attempting to reconnect now...",flush=True)
-		disp_sock.close()
-		disp_sock = socket.socket()
-		connectToSocket(disp_sock,"10.0.10.100",port,5)
-
-	# Detect errors with output of cpu fan check command
-	if cpu_fan_speed == "no" or cpu_fan_speed == "disabled":
-		cpu_fan_speed = -1
-	try: cpu_fan_speed = int(cpu_fan_speed)
-	except: cpu_fan_speed = -1
+
+	# Set CPU fan duty cycle through IPMI if the BMC isn't already running it (a new duty cycle, a write that failed
+	# last time, or a fan mode set/BMC reset since), reading the fan speed back in the same round trip so
+	# verify_cpu_fan doesn't have to ask again. Unreadable fans come back as -1.
+	if cpu_fan_duty != bmc_duty:
+		if cpu_debug and cpu_fan_duty != last_cpu_fan_duty:
+			log.info("CPU at " + str(cpu_temp) + "*C, setting CPU fans " + str(cpu_fan_duty) + "%")
+		metrics.set("fanctl_cpu_fan_duty_percent",cpu_fan_duty)
+		try:
+			cpu_fan_speed = ipmi.set_fan_duty_and_read(0,cpu_fan_duty,cpu_fan_header)
+			cpu_fan_speed_time = time.monotonic()
+			bmc_duty = cpu_fan_duty
+		except IpmiError as e:
+			trace_event(IPMI_ERROR)
+			log.error("Could not set CPU fan duty cycle: " + str(e))
+
+### CPU fan speed verification
+def verify_cpu_fan():
+	global cpu_fan_speed, cpu_fan_speed_time, cpu_fan_unreadable_time, bmc_fail_count
+
+	# Check that fan speed is being reported by ipmitool and that the reading is non-zero and not above max fan speed.
+	# Skip the read if cpu_control just got one along with a duty cycle change.
+	if time.monotonic() - cpu_fan_speed_time > fan_check_period / 2:
+		cpu_fan_speed = ipmi.sensor_reading(cpu_fan_header)
+		cpu_fan_speed_time = time.monotonic()
+	metrics.set("fanctl_cpu_fan_rpm",cpu_fan_speed)
+	if trace is not None: trace.fan_rpm(cpu_fan_speed)
 
 	# If fan reading reported an error/no reading, fan speed will be -1. Could be because of BMC reset, so give it some time
 	if cpu_fan_speed < 0:
+		metrics.inc("fanctl_bmc_unreadable_fan_total")
+		trace_event(FAN_UNREADABLE)
 		if cpu_fan_unreadable_time == 0:
 			cpu_fan_unreadable_time = int(time.time())
-			print(datetime.datetime.today().strftime('%m-%d-%Y %H:%M:%S') + " - ", end = "")
-			print("ERROR: Fan currently unreadable, waiting for BMC reboot grace period",flush=True)
+			log.error("Fan currently unreadable, waiting for BMC reboot grace period")
 		if int(time.time()) - cpu_fan_unreadable_time > bmc_reboot_grace_time:
-			print(datetime.datetime.today().strftime('%m-%d-%Y %H:%M:%S') + " - ", end = "")
-			print("ERROR: Fan currently unreadable, BMC reboot grace period elapsed, cold resetting BMC",flush=True)
+			log.error("Fan currently unreadable, BMC reboot grace period elapsed, cold resetting BMC")
 			set_fan_mode_full()
 			reset_bmc()
 			cpu_fan_unreadable_time = 0
@@ -332,92 +408,198 @@ while True:
 		# If fan reading is not sane, reset BMC after enough consecutive nonsense readings
 		if cpu_fan_speed == 0 or cpu_fan_speed > cpu_max_fan_speed * 1.2:
 			bmc_fail_count += 1
+			metrics.inc("fanctl_bmc_bad_fan_readings_total")
+			trace_event(BAD_FAN_READING)
 		else:
 			bmc_fail_count = 0
 
 		# If we get a single bad reading, just try to reset BMC fan mode and CPU fan duty cycle
 		if bmc_fail_count > 0 and bmc_fail_count <= bmc_fail_threshold:
-			print(datetime.datetime.today().strftime('%m-%d-%Y %H:%M:%S') + " - ", end = "")
-			print("ERROR: CPU fan reading is " + str(cpu_fan_speed) + " RPM. BMC fail count at " + str(bmc_fail_count) + "/" + str(bmc_fail_threshold) + ".", end = "")
-			print(" Attempting to set fan mode and apply " + str(cpu_fan_duty) + "% duty cycle again.",flush=True)
+			log.error("CPU fan reading is " + str(cpu_fan_speed) + " RPM. BMC fail count at " + str(bmc_fail_count) + "/" + str(bmc_fail_threshold) + "." +
+				" Attempting to set fan mode and apply " + str(cpu_fan_duty) + "% duty cycle again.")
 			set_fan_mode_full()
-			subprocess.check_output("/usr/local/bin/ipmitool raw 0x30 0x70 0x66 0x01 0 " + str(cpu_fan_duty),shell=True)
+			set_cpu_fan_duty(cpu_fan_duty)
 		# If we get enough bad readings, reset BMC fan mode and cold reset BMC
 		elif bmc_fail_count > bmc_fail_threshold:
-			print(datetime.datetime.today().strftime('%m-%d-%Y %H:%M:%S') + " - ", end = "")
-			print("ERROR: CPU fan reading is " + str(cpu_fan_speed) + " RPM. BMC fail count at " + str(bmc_fail_count) + "/" + str(bmc_fail_threshold) + ". Cold resetting BMC.",flush=True)
+			log.error("CPU fan reading is " + str(cpu_fan_speed) + " RPM. BMC fail count at " + str(bmc_fail_count) + "/" + str(bmc_fail_threshold) + ". Cold resetting BMC.")
 			set_fan_mode_full()
 			reset_bmc()
 			bmc_fail_count = 0
 
-	### HD temp check and duty cycle management
-	# Only check drive temps every so often
-	if int(time.time()) - last_hd_check_time > hd_polling_interval:
-		last_hd_check_time = int(time.time())
-
-		# Zero HD max temps for each shelf
-		for x in range(0,len(max_hd_temp)): max_hd_temp[x] = 0
-		
-		# Get all disk temps by running smartctl on each disk
-		hd_temps = "hdd;"
-		for hd in hd_list:
-			try:
-				disk_temp = subprocess.check_output("/usr/local/sbin/smartctl -A /dev/" + hd["node"] + " | grep Temperature_Celsius",shell=True)
-				disk_temp = disk_temp.decode("utf-8").replace("\n","")
-				hd["temp"] = int(disk_temp.split()[9])
-				hd_temps += str(hd["temp"]) + " "
-			except:
-				hd["temp"] = 0
-				pass
-			for shelf in range(0,num_chassis):
-				if hd["shelf"] == shelf and hd["temp"] > max_hd_temp[shelf]:
-					max_hd_temp[shelf] = hd["temp"]
-		hd_temps = hd_temps.strip()
-
-		# Correct for empty HDD bays
-		for hd in hd_list:
-			if hd["temp"] == 0:
-				hd["temp"] = "--"
-
-		# Map disk temps to duty cycle for each shelf
+### Disk hot-plug detection
+def disk_rescan():
+	log_disk_changes(disk_inventory.scan())
+
+### HD temp check and duty cycle management
+def hdd_sweep():
+	global last_hd_log_time
+
+	# Read the disks that are due; the rest (and any in standby) keep their last temp. Results come back all at once.
+	sweep = smart_poller.sweep(disk_inventory.slot_nodes,hd_poll_schedule)
+	if sweep.missed > 0:
+		log.error("Disks did not report a temp, using last known temps",missed=sweep.missed,sweep_sec=round(sweep.duration,1))
+	if debug and sweep.polled > 0:
+		log.info("Polled " + str(sweep.polled) + " disk(s), " + str(sweep.standby) + " in standby.")
+
+	last_max_hd_temp = list(max_hd_temp)
+	last_hd_fan_duty = list(hd_fan_duty)
+
+	# Record all disk temps from the sweep (empty HDD bays become -1) and find the max temp in each shelf. Each shelf's
+	# disks are one slice of the slot list, so this is a single pass over the disks however many shelves there are.
+	hd_temps[:] = array("h",[temp if temp > 0 else -1 for temp in sweep.temps])
+	max_hd_temp[:] = topology.chassis_max(hd_temps)
+
+	# Map disk temps to duty cycle for each shelf
+	now = time.monotonic()
+	for shelf in range(0,num_chassis):
+		hd_fan_duty[shelf] = hd_curves[shelf].update(max_hd_temp[shelf],now)
+		metrics.set("fanctl_shelf_max_temp_celsius",max_hd_temp[shelf],shelf=shelf)
+
+		# Don't let the shelf's fans go below what the air inside it calls for, and keep them at 100% while one is stalled
+		status = shelf_telemetry[shelf]
+		if status is not None and not status.flags & SHELF_NO_AMBIENT and now - shelf_telemetry_time[shelf] < shelf_telemetry_timeout:
+			hd_fan_duty[shelf] = max(hd_fan_duty[shelf],shelf_ambient_curve.lookup(status.ambient))
+		if shelf_stalled[shelf]: hd_fan_duty[shelf] = 100
+
+	# If hd_fan_override triggered, set fan duty cycle for shelf 0 (head) to 100
+	if hd_fan_override: hd_fan_duty[0] = 100
+
+	# Print drive temps and fan duty cycles to log when they change, and every hd_polling_interval otherwise
+	log_now = max_hd_temp != last_max_hd_temp or hd_fan_duty != last_hd_fan_duty or int(time.time()) - last_hd_log_time >= hd_polling_interval
+	if log_now:
+		last_hd_log_time = int(time.time())
+		hot = [topology.locate(slot) for slot in topology.hot_slots(hd_temps,max_hd_temp)]
 		for shelf in range(0,num_chassis):
-			for temp in hd_temp_list:
-				if max_hd_temp[shelf] <= temp:
-					hd_fan_duty[shelf] = hd_duty_list[hd_temp_list.index(temp)]
-					break
-
-		# If hd_fan_override triggered, set fan duty cycle for shelf 0 (head) to 100
-		if hd_fan_override: hd_fan_duty[0] = 100
-
-		# Print drive temps and fan duty cycles to log
-		for shelf in range(0,num_chassis):
-			print(datetime.datetime.today().strftime('%m-%d-%Y %H:%M:%S') + " - ", end = "")
-			print("Shelf " + str(shelf) + " max temp: " + str(max_hd_temp[shelf]) + "*C, setting HDD fans to " + str(hd_fan_duty[shelf]) + "%",flush=True)
-
-		# Send HDD fan speed values to display. Attempt to reconnect on error.
-		if debug:
-			print(datetime.datetime.today().strftime('%m-%d-%Y %H:%M:%S') + " - ", end = "")
-			print("Sending to display: " + hd_temps,flush=True)
+			positions = [str(position) for hot_shelf, position in hot if hot_shelf == shelf]
+			log.info("Shelf " + str(shelf) + " max temp: " + str(max_hd_temp[shelf]) + "*C" +
+				(" (position " + ", ".join(positions) + ")" if positions else "") +
+				", setting HDD fans to " + str(hd_fan_duty[shelf]) + "%")
+
+	# Send HDD fan speed values to display
+	if debug and log_now:
+		log.info("Sending to display: " + " ".join([str(temp) if temp > 0 else "--" for temp in hd_temps]))
+	if hd_delta_telemetry:
+		with hdd_encoder_lock:
+			record = hdd_encoder.encode(hd_temps,time.monotonic())
+		if record is not None: send_to_display("hdd",[record])
+	else:
+		send_to_display("hdd",[Record(HDD_TEMPS,list(hd_temps))])
+
+	# Send HDD fan speed commands to controllers
+	for x in range(0,num_chassis):
+		if debug and log_now:
+			log.info("Sending to shelf " + str(x) +": " + str(hd_fan_duty[x]))
+		send_to_shelf(x,"duty",[Record(DUTY,hd_fan_duty[x])])
+		if hd_fan_duty[x] != shelf_sent[x][0]: shelf_sent[x] = (hd_fan_duty[x],time.monotonic())
+		metrics.set("fanctl_shelf_duty_percent",hd_fan_duty[x],shelf=x)
+
+	if trace is not None:
+		trace.disk_temps(hd_temps,sweep.polled)
+		trace.shelf_duties(hd_fan_duty)
+
+### Display updates
+def publish_telemetry():
+	# Send CPU temps, fan speed and load to display together in one frame
+	records = [Record(CPU_FANS,CpuFans(cpu_fan_duty,cpu_fan_speed,psutil.cpu_percent()))]
+	if core_temps: records.insert(0,Record(CPU_TEMPS,core_temps))
+	send_to_display("cpu",records)
+
+### Periodic stats
+# Print task timing and BMC call latencies so slow tasks or a slow BMC show up in the log
+def log_stats():
+	for line in scheduler.summary():
+		log.info("Task " + line)
+	log.info("IPMI latency: " + ipmi.latency_summary())
+	for line in net.summary():
+		log.info("Connection " + line)
+	log.info("Fan changes avoided by hysteresis: CPU " + str(cpu_curve.avoided) + ", " +
+		", ".join(["shelf " + str(shelf) + " " + str(curve.avoided) for shelf, curve in enumerate(hd_curves)]))
+	for line in metrics.summary():
+		log.info("Metric " + line)
+
+### Startup
+# Start connecting to the controllers in each shelf and the display. This doesn't wait for them: anything sent before
+# a peer is up is queued and delivered when it connects.
+def connect_peers():
+	for shelf in range(0,num_chassis):
+		shelf_peers["shelf " + str(shelf)] = shelf
+		net.add("shelf " + str(shelf),(topology.chassis[shelf].controller,port),on_frames=shelf_frames)
+	net.add("display",(topology.display,port),on_frames=display_frames,on_connect=display_connected)
+	net.start()
+
+# Add all control tasks to the scheduler; they start running when the scheduler does
+def add_tasks():
+	scheduler.add("cpu_control",cpu_control_period,cpu_control,lane="bmc")
+	scheduler.add("verify_cpu_fan",fan_check_period,verify_cpu_fan,lane="bmc",delay=fan_check_period / 2)
+	scheduler.add("hdd_sweep",hd_poll_min_interval,hdd_sweep)
+	scheduler.add("disk_rescan",disk_rescan_interval,disk_rescan,delay=disk_rescan_interval)
+	scheduler.add("publish_telemetry",telemetry_period,publish_telemetry,delay=telemetry_period / 2)
+	scheduler.add("log_stats",stats_interval,log_stats,delay=stats_interval)
+
+### Trace replay
+# Run recorded traces through fan curves and a poll schedule built from the settings above and print how they compare
+# with what happened when the trace was recorded. Used as: fanctl.py --replay <trace file> [<trace file> ...]
+def replay_traces(paths):
+	def records():
+		for path in paths:
+			for record in read_trace(path): yield record
+
+	def describe(stats):
+		return (str(stats.changes) + " changes, mean " + str(round(stats.mean,1)) + "%, max " + str(stats.max) + "%, " +
+			str(round(stats.full / 3600,1)) + " h at 100%")
+
+	start = time.monotonic()
+	result = replay(records(),
+		FanCurve(cpu_temp_list,cpu_duty_list,interpolate_curves,cpu_hysteresis,cpu_min_dwell),
+		[FanCurve(hd_temp_list,hd_duty_list,interpolate_curves,hd_hysteresis,hd_min_dwell) for x in range(num_chassis)],
+		PollSchedule(hd_temp_list,hd_poll_min_interval,hd_polling_interval,hd_poll_max_interval,hd_standby_interval),
+		cpu_override_temp)
+	print("Replayed " + str(round(result.duration / 86400,2)) + " days of trace in " + str(round(time.monotonic() - start,1)) + " sec")
+	print("CPU fans: recorded " + describe(result.cpu[0]) + "; replayed " + describe(result.cpu[1]))
+	for shelf, (recorded, replayed) in enumerate(result.shelves):
+		print("Shelf " + str(shelf) + " fans: recorded " + describe(recorded) + "; replayed " + describe(replayed))
+	print("Disk reads: recorded " + str(result.disk_reads) + ", replayed " + str(result.replay_disk_reads) +
+		"; replayed temps were up to " + str(result.max_lag) + "*C behind (" + str(round(result.mean_lag,2)) + "*C per sweep on average)")
+	print("BMC events: " + (", ".join([str(count) + " " + EVENT_NAMES.get(code,"event " + str(code)) for code, count in sorted(result.events.items())]) or "none"))
+	return 0
+
+if __name__ == '__main__':
+	if sys.argv[1:2] == ["--replay"]:
+		sys.exit(replay_traces(sys.argv[2:]))
+
+	# Send logging, and anything printed to stdout and stderr, to the log file
+	setup_logging(log_file,max_bytes=log_max_size,max_age=log_max_age,backups=log_backups,repeat_window=log_repeat_window)
+
+	signal.signal(signal.SIGTERM,close_log)
+
+	# Print script start time to log file
+	log.info("Starting fan control script.")
+	log.info("Reading CPU temps with the " + cpu_sensor.name + " backend.")
+
+	# Start recording the sensor trace
+	if trace_file:
 		try:
-			disp_sock.send(hd_temps.encode("utf-8"))
-		except:
-			print("ERROR: Could not send to display web socket! Attempting to reconnect now...",flush=True)
-			disp_sock.close()
-			disp_sock = socket.socket()
-			connectToSocket(disp_sock,"10.0.10.100",port,5)
-
-		# Send HDD fan speed commands to controllers. Attempt to reconnect on error.
-		for x in range(0,num_chassis):
-			if debug:
-				print(datetime.datetime.today().strftime('%m-%d-%Y %H:%M:%S') + " - ", end = "")
-				print("Sending to shelf " + str(x) +": " + str(hd_fan_duty[x]),flush=True)
-			try:
-				shelf_sock[x].send(str(hd_fan_duty[x]).encode("utf-8"))
-			except:
-				print("ERROR: Could not send to shelf " + str(x) + " web socket! Attempting to reconnect now...",flush=True)
-				shelf_sock[x].close()
-				shelf_sock[x] = socket.socket()
-				connectToSocket(shelf_sock[x],"10.0.10." + str(x),port,5)
-
-	# Provide a small grace period between iterations; temps don't change much in a one-second span
-	time.sleep(1)
+			trace = TraceWriter(trace_file)
+			trace.layout([chassis.end for chassis in topology.chassis])
+		except OSError as e:
+			log.error("Could not open trace file " + trace_file + ": " + str(e))
+
+	# Set IPMI fan mode to full
+	log.info("Setting CPU fan mode to full.")
+	set_fan_mode_full()
+
+	# Serve metrics for Prometheus
+	if metrics_port:
+		try: metrics.serve(metrics_port)
+		except OSError as e:
+			log.error("Could not serve metrics on port " + str(metrics_port) + ": " + str(e))
+
+	connect_peers()
+
+	# Populate HD List. Every node in kern.disks is identified by serial with smartctl -i (in parallel); SSDs and nodes
+	# without SMART are skipped. Nodes that are unchanged since the last run come straight from the inventory file.
+	log_disk_changes(disk_inventory.scan(retry_failed=True))
+
+	### Main loop
+	add_tasks()
+	scheduler.run()
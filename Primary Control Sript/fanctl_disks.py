@@ -0,0 +1,127 @@
+###
+# Disk discovery for fanctl
+###
+
+# Works out which device node the disk in each slot is on. smartctl -i is run on every candidate node in parallel and
+# the serial it reports is looked up in a serial -> disk dict. Probe results are saved to an inventory file together
+# with each node's GEOM identity (ident + media size, from a single "geom disk list"), so on a warm restart only nodes
+# whose identity changed are probed again; a node geom has no identity for is probed on every scan, since a disk
+# swapped in on the same node would otherwise keep the old disk's serial. Calling scan() again later picks up
+# hot-plugged or replaced disks while the daemon is running. slot_nodes is replaced as a whole, never changed in place,
+# so another thread can go through it while a scan runs. With a fanctl_metrics.Metrics, each smartctl -i probe is timed
+# per node.
+
+### Libraries:
+# subprocess to run smartctl and geom
+# re for regex processing of smartctl output
+# json and os to persist the inventory
+# time to time probes
+# concurrent.futures for the probe worker pool
+# fanctl_sensors for in-process sysctl reads
+import subprocess, re, json, os, time
+from concurrent.futures import ThreadPoolExecutor
+from fanctl_sensors import sysctl_string
+
+# List of disk device nodes from kern.disks
+def list_disk_nodes():
+	try: nodes = sysctl_string("kern.disks")
+	except (OSError, AttributeError):
+		nodes = subprocess.check_output("/sbin/sysctl -n kern.disks",shell=True).decode("utf-8")
+	return nodes.split()
+
+# Cheap identity for every disk from one geom call: node -> "ident:mediasize". Empty if geom isn't available.
+def disk_identities():
+	try: output = subprocess.run(["/sbin/geom", "disk", "list"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+		timeout=30).stdout.decode("utf-8", "replace")
+	except (OSError, subprocess.SubprocessError): return {}
+	identities = {}
+	node = None
+	size = ""
+	for line in output.splitlines():
+		line = line.strip()
+		if line.startswith("Geom name:"):
+			node = line.split(":",1)[1].strip()
+			size = ""
+		elif line.startswith("Mediasize:"):
+			size = line.split(":",1)[1].split()[0]
+		elif line.startswith("ident:") and node:
+			identities[node] = line.split(":",1)[1].strip() + ":" + size
+	return identities
+
+# Parse smartctl -i output into {"serial": ..., "ssd": ...}
+def parse_smart_info(output):
+	serial = re.search(r'Serial [Nn]umber:\s*(\S+)',output)
+	rotation = re.search(r'Rotation Rate:\s*(.*)',output)
+	return {"serial": serial.group(1) if serial else "", "ssd": bool(rotation) and "Solid State Device" in rotation.group(1)}
+
+class DiskInventory:
+	def __init__(self, serials, smartctl, workers, probe_timeout, cache_file, metrics=None):
+		self.metrics = metrics
+		self.smartctl = smartctl
+		self.workers = workers
+		self.probe_timeout = probe_timeout
+		self.cache_file = cache_file
+		# serial -> slot, so matching a probed node to its slot is a dict lookup
+		self.index = {serial: slot for slot, serial in enumerate(serials) if serial}
+		# slot -> device node ("" if the disk hasn't been found)
+		self.slot_nodes = [""] * len(serials)
+		# node -> {"key": identity, "serial": serial, "ssd": bool}; serial is None if the node doesn't do SMART
+		self.nodes = self._load()
+
+	def _load(self):
+		try:
+			with open(self.cache_file) as f: return json.load(f)
+		except (OSError, ValueError): return {}
+
+	def _save(self):
+		tmp = self.cache_file + ".tmp"
+		try:
+			with open(tmp, "w") as f: json.dump(self.nodes, f)
+			os.replace(tmp, self.cache_file)
+		except OSError: pass
+
+	# Run smartctl -i on a node; None if smartctl can't talk to it
+	def probe(self, node):
+		start = time.monotonic()
+		try:
+			proc = subprocess.run([self.smartctl, "-i", "/dev/" + node], stdout=subprocess.PIPE,
+				stderr=subprocess.DEVNULL, timeout=self.probe_timeout)
+		except (OSError, subprocess.SubprocessError): return None
+		finally:
+			if self.metrics is not None: self.metrics.observe("fanctl_smartctl_probe_seconds", time.monotonic() - start, disk=node)
+		# Bits 0 and 1 of smartctl's exit status mean it couldn't parse the command line or open the device
+		if proc.returncode & 3: return None
+		return parse_smart_info(proc.stdout.decode("utf-8", "replace"))
+
+	# Bring the inventory up to date with kern.disks, probing only new or changed nodes. Returns a list of
+	# (slot, old node, new node) for every slot whose node changed; new node is "" if the disk went away.
+	# retry_failed also re-probes nodes smartctl couldn't talk to last time (done once at startup).
+	def scan(self, retry_failed=False):
+		nodes = list_disk_nodes()
+		identities = disk_identities()
+		# Nodes geom has no identity for can't be checked for a swapped disk without probing them
+		to_probe = [node for node in nodes if node not in self.nodes or
+			(retry_failed and self.nodes[node]["serial"] is None) or
+			identities.get(node) is None or identities[node] != self.nodes[node]["key"]]
+
+		if to_probe:
+			with ThreadPoolExecutor(max_workers=self.workers) as pool:
+				for node, info in zip(to_probe, pool.map(self.probe, to_probe)):
+					if info is None: info = {"serial": None, "ssd": False}
+					info["key"] = identities.get(node)
+					self.nodes[node] = info
+		for node in list(self.nodes):
+			if node not in nodes: del self.nodes[node]
+		if to_probe or len(self.nodes) != len(nodes): self._save()
+
+		# Map nodes back onto disk slots through the serial index. SSDs and nodes without SMART are skipped.
+		found = {}
+		for node, info in self.nodes.items():
+			if info["serial"] and not info["ssd"] and info["serial"] in self.index:
+				found[self.index[info["serial"]]] = node
+		# Build the new list and swap it in whole; a sweep going through the old one sees it all old or all new
+		slot_nodes = [found.get(slot, "") for slot in range(len(self.slot_nodes))]
+		changes = [(slot, old_node, node) for slot, (old_node, node) in enumerate(zip(self.slot_nodes, slot_nodes))
+			if node != old_node]
+		self.slot_nodes = slot_nodes
+		return changes
@@ -0,0 +1,206 @@
+###
+# IPMI backend for fanctl
+###
+
+# Keeps a single long-lived "ipmitool shell" session open to the BMC instead of forking ipmitool for every command.
+# Sensor reads go through "sensor reading <name>" against a local SDR cache (ipmitool -S), so reading one fan doesn't
+# dump the whole sensor repository. Several commands can be written to the session at once and read back in one
+# round trip. If the session hangs or dies (e.g., during a BMC cold reset), the command falls back to a one-shot
+# ipmitool call and the session is restarted on a later call. Every call is timed so slow BMCs show up in the log
+# (and in metrics, if given a fanctl_metrics.Metrics).
+
+### Libraries:
+# subprocess to run ipmitool
+# os and select for non-blocking reads from the session
+# time to measure call latency
+# threading so only one thread uses the session at a time
+import subprocess, os, select, time, threading
+
+# Prompt printed by ipmitool in shell mode; every command's output ends with it
+PROMPT = b"ipmitool> "
+
+# How long to wait after a session failure before trying to open a new one
+SESSION_RETRY_TIME = 30
+
+class IpmiError(Exception):
+	pass
+
+# Pull a sensor's value out of "sensor reading" output ("FAN1             | 1500"); -1 if it has no reading
+def parse_sensor_reading(output, name):
+	for line in output.splitlines():
+		if "|" in line and line.split("|")[0].strip() == name:
+			try: return int(float(line.split("|")[1]))
+			except ValueError: return -1
+	return -1
+
+class IpmiBackend:
+	def __init__(self, ipmitool, sdr_cache=None, timeout=10, metrics=None):
+		self.metrics = metrics
+		self.ipmitool = ipmitool
+		self.sdr_cache = sdr_cache
+		self.timeout = timeout
+		self._proc = None
+		self._buf = b""
+		self._retry_time = 0
+		self._lock = threading.RLock()
+		# Per-label latency stats: label -> [calls, total sec, max sec, last sec]
+		self.stats = {}
+
+	### Session handling
+	# Base command line, with the SDR cache if we have one
+	def _base_args(self):
+		args = [self.ipmitool]
+		if self.sdr_cache:
+			if not os.path.exists(self.sdr_cache):
+				# Dump the SDR once; later sensor reads look sensors up in this file instead of walking the BMC
+				try: subprocess.run([self.ipmitool, "sdr", "dump", self.sdr_cache], stdout=subprocess.DEVNULL,
+					stderr=subprocess.DEVNULL, timeout=self.timeout * 6)
+				except (OSError, subprocess.SubprocessError): pass
+			if os.path.exists(self.sdr_cache):
+				args += ["-S", self.sdr_cache]
+		return args
+
+	# Open the shell session if it isn't open and we aren't backing off from a recent failure
+	def _open(self):
+		if self._proc is not None: return True
+		if time.monotonic() < self._retry_time: return False
+		try:
+			self._proc = subprocess.Popen(self._base_args() + ["shell"], stdin=subprocess.PIPE,
+				stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=0)
+			self._buf = b""
+			# Wait for the first prompt so we know the session is up
+			self._read_outputs(1)
+			return True
+		except (OSError, IpmiError):
+			self.close()
+			self._retry_time = time.monotonic() + SESSION_RETRY_TIME
+			return False
+
+	def close(self):
+		if self._proc is not None:
+			try:
+				self._proc.kill()
+				self._proc.wait(1)
+			except (OSError, subprocess.SubprocessError): pass
+		self._proc = None
+		self._buf = b""
+
+	# Read from the session until we've seen count prompts, returning the text in front of each one
+	def _read_outputs(self, count):
+		fd = self._proc.stdout.fileno()
+		deadline = time.monotonic() + self.timeout
+		while self._buf.count(PROMPT) < count:
+			remaining = deadline - time.monotonic()
+			if remaining <= 0:
+				raise IpmiError("ipmitool session timed out")
+			ready, _, _ = select.select([fd], [], [], remaining)
+			if ready:
+				data = os.read(fd, 65536)
+				if not data: raise IpmiError("ipmitool session closed")
+				self._buf += data
+		parts = self._buf.split(PROMPT)
+		self._buf = PROMPT.join(parts[count:])
+		return [part.decode("utf-8", "replace") for part in parts[:count]]
+
+	### Running commands
+	# Run a list of commands (each a list of ipmitool arguments) and return their outputs in order. All commands are
+	# written to the session in one go, so a batch costs a single round trip.
+	def run_batch(self, cmds, label="batch"):
+		with self._lock:
+			return self._run_batch(cmds, label)
+
+	def _run_batch(self, cmds, label):
+		start = time.monotonic()
+		try:
+			if self._open():
+				try:
+					self._proc.stdin.write(("\n".join(" ".join(cmd) for cmd in cmds) + "\n").encode("utf-8"))
+					outputs = self._read_outputs(len(cmds))
+					# readline builds of ipmitool echo the command back; strip it off
+					return [self._strip_echo(out, cmd) for out, cmd in zip(outputs, cmds)]
+				except (OSError, IpmiError):
+					self.close()
+					self._retry_time = time.monotonic() + SESSION_RETRY_TIME
+					if self.metrics is not None: self.metrics.inc("fanctl_ipmi_session_failures_total")
+			return [self._run_once(cmd) for cmd in cmds]
+		finally:
+			self._record(label, time.monotonic() - start)
+
+	def run(self, cmd, label=None):
+		return self.run_batch([cmd], label or cmd[0])[0]
+
+	# Fallback path: run one command as its own ipmitool process
+	def _run_once(self, cmd):
+		try:
+			proc = subprocess.run(self._base_args() + list(cmd), stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+				timeout=self.timeout)
+		except (OSError, subprocess.SubprocessError) as e:
+			if self.metrics is not None: self.metrics.inc("fanctl_ipmi_errors_total", command=cmd[0])
+			raise IpmiError("ipmitool " + " ".join(cmd) + " failed: " + str(e))
+		output = proc.stdout.decode("utf-8", "replace")
+		if proc.returncode != 0:
+			if self.metrics is not None: self.metrics.inc("fanctl_ipmi_errors_total", command=cmd[0])
+			raise IpmiError("ipmitool " + " ".join(cmd) + " failed: " + output.strip())
+		return output
+
+	@staticmethod
+	def _strip_echo(output, cmd):
+		lines = output.split("\n")
+		if lines and lines[0].strip() == " ".join(cmd):
+			lines = lines[1:]
+		return "\n".join(lines)
+
+	def _record(self, label, elapsed):
+		stat = self.stats.get(label)
+		if stat is None:
+			stat = self.stats[label] = [0, 0.0, 0.0, 0.0]
+		stat[0] += 1
+		stat[1] += elapsed
+		if elapsed > stat[2]: stat[2] = elapsed
+		stat[3] = elapsed
+		if self.metrics is not None: self.metrics.observe("fanctl_ipmi_seconds", elapsed, command=label)
+
+	# One-line summary of call latencies for the log, e.g. "sensor: 120 calls avg 4.1ms max 35.0ms"
+	def latency_summary(self):
+		parts = []
+		for label, (calls, total, worst, last) in sorted(self.stats.items()):
+			parts.append(label + ": " + str(calls) + " calls avg " + str(round(total / calls * 1000, 1)) + "ms max " + str(round(worst * 1000, 1)) + "ms")
+		return ", ".join(parts)
+
+	### Fan control commands
+	# Read a single sensor (e.g., "FAN1"). Returns the reading as an int, or -1 if the BMC has no reading for it.
+	def sensor_reading(self, name):
+		try: return parse_sensor_reading(self.run(["sensor", "reading", name], "sensor"), name)
+		except IpmiError: return -1
+
+	# Raw command output is checked for ipmitool's error text, since the shell doesn't give us an exit status
+	def raw(self, *data):
+		output = self.run(["raw"] + [str(d) for d in data], "raw")
+		if "Unable to send RAW command" in output:
+			if self.metrics is not None: self.metrics.inc("fanctl_ipmi_errors_total", command="raw")
+			raise IpmiError(output.strip())
+		return output
+
+	# Set BMC fan mode to full allowing for manual control
+	def set_fan_mode_full(self):
+		self.raw("0x30", "0x45", "0x01", "1")
+
+	# Set the duty cycle (0-100) of a fan zone (0 = CPU, 1 = peripheral)
+	def set_fan_duty(self, zone, duty):
+		self.raw("0x30", "0x70", "0x66", "0x01", zone, duty)
+
+	# Set a zone's duty cycle and read a fan sensor back in one round trip
+	def set_fan_duty_and_read(self, zone, duty, sensor):
+		outputs = self.run_batch([["raw", "0x30", "0x70", "0x66", "0x01", str(zone), str(duty)], ["sensor", "reading", sensor]], "raw+sensor")
+		if "Unable to send RAW command" in outputs[0]:
+			if self.metrics is not None: self.metrics.inc("fanctl_ipmi_errors_total", command="raw")
+			raise IpmiError(outputs[0].strip())
+		return parse_sensor_reading(outputs[1], sensor)
+
+	# Cold reset the BMC. The session won't survive this, so drop it and let the next call open a new one.
+	def bmc_reset_cold(self):
+		with self._lock:
+			try: self.run(["bmc", "reset", "cold"], "bmc_reset")
+			finally:
+				self.close()
+				self._retry_time = time.monotonic() + SESSION_RETRY_TIME
@@ -0,0 +1,149 @@
+###
+# CPU temperature sensor backends for fanctl
+###
+
+# Reads per-core CPU temps without spawning a shell pipeline. Each backend has a read() method that returns the
+# current core temps (in C) as a compact array of floats:
+#	SysctlTempBackend	FreeBSD; reads dev.cpu.N.temperature in-process through sysctl(3), MIBs looked up once
+#	HwmonTempBackend	Linux; reads coretemp/k10temp tempN_input files from sysfs, keeping them open between reads
+#	PipelineTempBackend	the original sysctl | egrep | awk | sed pipeline, used if neither of the above works
+# open_cpu_temp_backend() picks the best one available on this system. The in-process backends reuse the same array
+# on every read, so copy it if you need to keep old values around.
+
+### Libraries:
+# ctypes to call sysctl(3) directly
+# os and glob to find and read hwmon files
+# subprocess for the fallback pipeline
+# sys to check which OS we're on
+# array for the returned temps
+import ctypes, ctypes.util, os, glob, subprocess, sys
+from array import array
+
+### FreeBSD sysctl access
+_libc = None
+
+def _get_libc():
+	global _libc
+	if _libc is None:
+		_libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+	return _libc
+
+# Translate a sysctl name to its MIB so later reads skip the name lookup. Raises OSError if the sysctl doesn't exist.
+def sysctl_mib(name):
+	libc = _get_libc()
+	mib = (ctypes.c_int * 24)()
+	size = ctypes.c_size_t(len(mib))
+	if libc.sysctlnametomib(name.encode("ascii"), mib, ctypes.byref(size)) != 0:
+		raise OSError(ctypes.get_errno(), "sysctlnametomib " + name)
+	return (ctypes.c_int * size.value)(*mib[:size.value])
+
+# Read a sysctl into the given ctypes buffer
+def sysctl_read(mib, buf):
+	size = ctypes.c_size_t(ctypes.sizeof(buf))
+	if _get_libc().sysctl(mib, len(mib), ctypes.byref(buf), ctypes.byref(size), None, 0) != 0:
+		raise OSError(ctypes.get_errno(), "sysctl")
+	return size.value
+
+def sysctl_int(name):
+	value = ctypes.c_int()
+	sysctl_read(sysctl_mib(name), value)
+	return value.value
+
+# Read a string sysctl (e.g., kern.disks)
+def sysctl_string(name):
+	libc = _get_libc()
+	size = ctypes.c_size_t(0)
+	if libc.sysctlbyname(name.encode("ascii"), None, ctypes.byref(size), None, 0) != 0:
+		raise OSError(ctypes.get_errno(), "sysctlbyname " + name)
+	buf = ctypes.create_string_buffer(size.value + 1)
+	size = ctypes.c_size_t(len(buf))
+	if libc.sysctlbyname(name.encode("ascii"), buf, ctypes.byref(size), None, 0) != 0:
+		raise OSError(ctypes.get_errno(), "sysctlbyname " + name)
+	return buf.value.decode("utf-8")
+
+### Backends
+class SysctlTempBackend:
+	name = "sysctl"
+
+	def __init__(self):
+		if not sys.platform.startswith("freebsd"):
+			raise OSError("sysctl temperature backend needs FreeBSD")
+		# dev.cpu.N.temperature only exists with coretemp/amdtemp loaded; only keep the cores that have it
+		self._mibs = []
+		for cpu in range(sysctl_int("hw.ncpu")):
+			try: self._mibs.append(sysctl_mib("dev.cpu." + str(cpu) + ".temperature"))
+			except OSError: pass
+		if not self._mibs:
+			raise OSError("no dev.cpu.N.temperature sysctls (is coretemp loaded?)")
+		self._value = ctypes.c_int()
+		self._temps = array("f", [0.0] * len(self._mibs))
+
+	# Temps come back in tenths of a degree Kelvin
+	def read(self):
+		value = self._value
+		temps = self._temps
+		for i, mib in enumerate(self._mibs):
+			sysctl_read(mib, value)
+			temps[i] = (value.value - 2731) / 10.0
+		return temps
+
+	def close(self):
+		pass
+
+class HwmonTempBackend:
+	name = "hwmon"
+	DRIVERS = ("coretemp", "k10temp", "zenpower")
+
+	def __init__(self, hwmon_root="/sys/class/hwmon"):
+		paths = []
+		for hwmon in sorted(glob.glob(os.path.join(hwmon_root, "hwmon*"))):
+			try:
+				with open(os.path.join(hwmon, "name")) as f: driver = f.read().strip()
+			except OSError: continue
+			if driver not in self.DRIVERS: continue
+			inputs = sorted(glob.glob(os.path.join(hwmon, "temp*_input")), key=lambda p: int(os.path.basename(p)[4:-6]))
+			# Prefer per-core sensors ("Core N") over package/die sensors when the driver labels them
+			cores = [p for p in inputs if self._label(p).startswith("Core")]
+			paths += cores or inputs
+		if not paths:
+			raise OSError("no CPU hwmon sensors found under " + hwmon_root)
+		self._fds = [os.open(p, os.O_RDONLY) for p in paths]
+		self._temps = array("f", [0.0] * len(self._fds))
+
+	@staticmethod
+	def _label(path):
+		try:
+			with open(path[:-len("input")] + "label") as f: return f.read().strip()
+		except OSError: return ""
+
+	# sysfs regenerates the value on every read from offset 0, so the files can stay open; values are in millidegrees
+	def read(self):
+		temps = self._temps
+		for i, fd in enumerate(self._fds):
+			temps[i] = int(os.pread(fd, 32, 0)) / 1000.0
+		return temps
+
+	def close(self):
+		for fd in self._fds: os.close(fd)
+		self._fds = []
+
+class PipelineTempBackend:
+	name = "pipeline"
+
+	def read(self):
+		core_temps = subprocess.check_output("/sbin/sysctl -a dev.cpu | egrep -E \"dev.cpu.[0-9]+.temperature\" | awk \'{print $2}\' | sed \'s/.$//\'",shell=True)
+		return array("f", [float(temp) for temp in core_temps.decode("utf-8").split()])
+
+	def close(self):
+		pass
+
+BACKENDS = {"sysctl": SysctlTempBackend, "hwmon": HwmonTempBackend, "pipeline": PipelineTempBackend}
+
+# Open the named backend, or with "auto" the first one that works on this system
+def open_cpu_temp_backend(kind="auto"):
+	if kind != "auto":
+		return BACKENDS[kind]()
+	for backend in (SysctlTempBackend, HwmonTempBackend):
+		try: return backend()
+		except (OSError, AttributeError): pass
+	return PipelineTempBackend()
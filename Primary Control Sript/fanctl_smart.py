@@ -0,0 +1,160 @@
+###
+# SMART temperature polling for fanctl
+###
+
+# Runs smartctl against every disk using a small pool of worker threads so one slow or resetting disk can't hold
+# up the rest of the sweep. Each disk gets its own timeout and the whole sweep gets a time budget; disks that
+# don't answer in time keep their last known temperature. A sweep's temps are handed back as a single result
+# object so nothing ever sees a half-updated set of temps.
+#
+# With a PollSchedule, a sweep only reads the disks that are due. Disks close to the next duty cycle step or heating
+# up quickly are due often; cool, stable disks rarely. smartctl is run with "-n standby" so it never spins up a
+# sleeping disk; disks in standby keep their last known temperature and are checked again later.
+#
+# With a fanctl_metrics.Metrics, every smartctl call is timed per disk and timeouts/standby results are counted.
+
+### Libraries:
+# subprocess to run smartctl
+# time to measure sweep duration
+# collections for the sweep result tuple
+# concurrent.futures for the smartctl worker pool
+import subprocess, time, collections
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# Result of a finished sweep. temps lines up with the node list the sweep was started with (0 = no reading),
+# polled is the number of disks smartctl was run on, standby the number found spun down, and missed the number
+# that didn't answer within the timeout or sweep budget or gave no readable temperature.
+SweepResult = collections.namedtuple("SweepResult", "temps polled standby missed duration")
+
+# read_temp() result for a disk that is spun down
+STANDBY = -1
+
+class PollSchedule:
+	def __init__(self, temp_list, min_interval, base_interval, max_interval, standby_interval):
+		self.temp_list = sorted(temp_list)
+		self.min_interval = min_interval
+		self.base_interval = base_interval
+		self.max_interval = max_interval
+		self.standby_interval = standby_interval
+		# node -> [next due time, last temp, last reading time, rate in C/sec]
+		self._disks = {}
+		# temp -> margin(temp), filled in as temps are seen
+		self._margins = {}
+
+	# Nodes in the list that are due for a reading at time now
+	def due(self, nodes, now):
+		disks = self._disks
+		return [node for node in nodes if node and (node not in disks or disks[node][0] <= now)]
+
+	# Degrees the temp has to climb before it lands in a higher duty cycle step (0 if already in the top step)
+	def margin(self, temp):
+		for step in self.temp_list:
+			if temp <= step: return step - temp + 1
+		return 0
+
+	# Record a reading and work out when this disk is next due
+	# (called for every disk read, and a lot more than that by trace replay, so it avoids extra work)
+	def update(self, node, temp, now):
+		disk = self._disks.get(node)
+		rate = 0.0
+		if disk is not None and disk[1] > 0 and now > disk[2]:
+			# Smooth the rate a little so one noisy reading doesn't swing the interval around
+			rate = 0.5 * disk[3] + 0.5 * (temp - disk[1]) / (now - disk[2])
+		margin = self._margins.get(temp)
+		if margin is None: margin = self._margins[temp] = self.margin(temp)
+		if margin <= 1: interval = self.min_interval
+		elif margin <= 3: interval = self.base_interval
+		else: interval = self.max_interval
+		# If it's heating up, make sure we read it again well before it can reach the next step
+		if rate > 0 and margin / rate / 2 < interval: interval = margin / rate / 2
+		if interval < self.min_interval: interval = self.min_interval
+		elif interval > self.max_interval: interval = self.max_interval
+		if disk is None: self._disks[node] = [now + interval, temp, now, rate]
+		else: disk[0], disk[1], disk[2], disk[3] = now + interval, temp, now, rate
+
+	# Disk is spun down: keep its last temp and check again in standby_interval
+	def standby(self, node, now):
+		disk = self._disks.setdefault(node, [0, 0, now, 0.0])
+		disk[0] = now + self.standby_interval
+		disk[3] = 0.0
+
+	# Disk didn't answer; try again soon
+	def missed(self, node, now):
+		disk = self._disks.setdefault(node, [0, 0, now, 0.0])
+		disk[0] = now + self.min_interval
+
+# Pull the raw Temperature_Celsius value out of smartctl -A output; returns 0 if it isn't there
+def parse_smart_temp(output):
+	for line in output.splitlines():
+		if "Temperature_Celsius" in line:
+			try: return int(line.split()[9])
+			except: return 0
+	return 0
+
+class SmartPoller:
+	def __init__(self, smartctl, workers, disk_timeout, sweep_budget, metrics=None):
+		self.metrics = metrics
+		self.smartctl = smartctl
+		self.disk_timeout = disk_timeout
+		self.sweep_budget = sweep_budget
+		self._pool = ThreadPoolExecutor(max_workers=workers)
+		# Last good reading per node, used for disks that miss the sweep budget
+		self._last_temp = {}
+
+	# Read the temperature of a single disk. Returns STANDBY if the disk is spun down (smartctl leaves it alone),
+	# or None if smartctl hung past the per-disk timeout, couldn't be run, or gave no temperature.
+	def read_temp(self, node):
+		start = time.monotonic()
+		try:
+			output = subprocess.run([self.smartctl, "-n", "standby", "-A", "/dev/" + node], stdout=subprocess.PIPE,
+				stderr=subprocess.DEVNULL, timeout=self.disk_timeout).stdout.decode("utf-8", "replace")
+		except subprocess.TimeoutExpired:
+			self._count("timeout", node)
+			return None
+		except OSError:
+			self._count("error", node)
+			return None
+		finally:
+			if self.metrics is not None: self.metrics.observe("fanctl_smartctl_seconds", time.monotonic() - start, disk=node)
+		if "STANDBY mode" in output or "SLEEP mode" in output:
+			self._count("standby", node)
+			return STANDBY
+		temp = parse_smart_temp(output)
+		if temp == 0:
+			self._count("unparsed", node)
+			return None
+		return temp
+
+	def _count(self, result, node):
+		if self.metrics is not None: self.metrics.inc("fanctl_smartctl_results_total", disk=node, result=result)
+
+	# Read the nodes in the list (in parallel) and return a SweepResult. Takes at most about sweep_budget seconds.
+	# With a schedule, only nodes that are due get read; the rest keep their last known temp.
+	def sweep(self, nodes, schedule=None):
+		start = time.monotonic()
+		# Empty bays / unidentified disks have no node, don't bother forking for them
+		due = schedule.due(nodes, start) if schedule else [node for node in nodes if node]
+		futures = {self._pool.submit(self.read_temp, node): node for node in due}
+
+		done, not_done = wait(futures, timeout=self.sweep_budget)
+		missed = 0
+		standby = 0
+		for future in not_done:
+			# Drop anything that hasn't started yet; running smartctl calls die on their own timeout
+			future.cancel()
+		now = time.monotonic()
+		for future, node in futures.items():
+			temp = future.result() if future in done else None
+			# No reading: keep the last good temp and try again soon
+			if temp is None:
+				missed += 1
+				if schedule: schedule.missed(node, now)
+			elif temp == STANDBY:
+				standby += 1
+				if schedule: schedule.standby(node, now)
+			else:
+				self._last_temp[node] = temp
+				if schedule: schedule.update(node, temp, now)
+
+		temps = [self._last_temp.get(node, 0) if node else 0 for node in nodes]
+		return SweepResult(temps, len(futures), standby, missed, time.monotonic() - start)
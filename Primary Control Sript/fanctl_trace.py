@@ -0,0 +1,286 @@
+###
+# Sensor trace recording and replay for fanctl
+###
+
+# TraceWriter appends every sensor reading and control decision fanctl makes (core temps, disk temps, CPU fan RPM,
+# CPU and shelf duty cycles, BMC events) to a compact binary file. replay() feeds a trace back through fan curves and a
+# poll schedule built from the current settings, on the trace's own clock, so a month of production data can be used
+# to try out curve, hysteresis and polling changes in seconds without touching any hardware.
+#
+# File layout: magic "FTR1", then records of
+#
+#	type (1) | milliseconds since the segment start (4) | body length (2) | body
+#
+# little endian. Each time the file is opened for writing (and every 40 days or so) a SEGMENT record sets a new start
+# time, so traces from several runs can share one file. Offsets are counted on the monotonic clock, so a wall clock
+# step doesn't move or reorder records within a segment. Readings are only written when they change. Core temps and
+# disk temps are whole degrees in signed bytes (-1 = no reading); after the first full DISK_TEMPS record of a segment,
+# disk temps are written as (slot, temp) changes. A partly written record at the end of the file is ignored.
+
+### Libraries:
+# struct to pack records
+# threading since the control tasks record from their own threads
+# time to timestamp records
+# os to check for an existing file
+# collections for the replay result tuples
+# operator for the replay lag calculation
+# array for packed temp lists
+import struct, threading, time, os, collections, operator
+from array import array
+
+MAGIC = b"FTR1"
+HEADER = struct.Struct("<BIH")
+
+### Record types
+SEGMENT = 0			# float64 unix time the following offsets count from
+LAYOUT = 1			# uint16 end slot of each chassis
+CORE_TEMPS = 2		# int8 per core
+FAN_RPM = 3			# int32 CPU fan RPM (-1 = unreadable)
+CPU_DUTY = 4		# uint8
+SHELF_DUTIES = 5	# uint8 per shelf
+DISK_TEMPS = 6		# uint16 disks polled this sweep, then int8 per slot
+DISK_CHANGES = 7	# uint16 disks polled this sweep, then (uint16 slot, int8 temp) pairs
+BMC_EVENT = 8		# uint8 event code
+
+### BMC event codes
+FAN_MODE_SET = 1
+BMC_RESET = 2
+BAD_FAN_READING = 3
+FAN_UNREADABLE = 4
+IPMI_ERROR = 5
+EVENT_NAMES = {FAN_MODE_SET: "fan mode sets", BMC_RESET: "BMC resets", BAD_FAN_READING: "bad fan readings",
+	FAN_UNREADABLE: "unreadable fan readings", IPMI_ERROR: "IPMI errors"}
+
+_u16 = struct.Struct("<H")
+_i32 = struct.Struct("<i")
+_f64 = struct.Struct("<d")
+_change = struct.Struct("<Hb")
+MAX_OFFSET = 0xf0000000
+
+def _temps(temps):
+	return array("b", [max(-1, min(127, int(t))) if t > 0 else -1 for t in temps])
+
+class TraceWriter:
+	def __init__(self, path, flush_interval=60):
+		self.path = path
+		self.flush_interval = flush_interval
+		self._lock = threading.Lock()
+		new = not os.path.exists(path) or os.path.getsize(path) == 0
+		# Buffered; records reach the disk every flush_interval seconds (and on close)
+		self._file = open(path, "ab", buffering=65536)
+		if new: self._file.write(MAGIC)
+		self._last_flush = time.monotonic()
+		self._last = {}
+		self._disks = None
+		self._new_segment()
+
+	# Start a new segment; disk temps start over with a full DISK_TEMPS record
+	def _new_segment(self):
+		self._base = time.monotonic()
+		self._disks = None
+		self._file.write(HEADER.pack(SEGMENT, 0, _f64.size) + _f64.pack(time.time()))
+
+	# Milliseconds since the segment start, starting a new segment if that no longer fits in an offset
+	def _offset(self):
+		offset = int((time.monotonic() - self._base) * 1000)
+		if offset >= MAX_OFFSET:
+			self._new_segment()
+			offset = 0
+		return offset
+
+	def _write(self, rtype, body, offset=None):
+		if offset is None: offset = self._offset()
+		self._file.write(HEADER.pack(rtype, offset, len(body)) + body)
+		if time.monotonic() - self._last_flush >= self.flush_interval:
+			self._file.flush()
+			self._last_flush = time.monotonic()
+
+	# Write a record unless it's the same as the last one of its type
+	def _changed(self, rtype, body):
+		with self._lock:
+			if self._last.get(rtype) == body: return
+			self._last[rtype] = body
+			self._write(rtype, body)
+
+	### Recording
+	# End slot of each chassis, so replay knows which disks each shelf's fans cool
+	def layout(self, chassis_ends):
+		with self._lock:
+			self._write(LAYOUT, array("H", chassis_ends).tobytes())
+
+	def core_temps(self, temps):
+		self._changed(CORE_TEMPS, _temps(temps).tobytes())
+
+	def fan_rpm(self, rpm):
+		self._changed(FAN_RPM, _i32.pack(int(rpm)))
+
+	def cpu_duty(self, duty):
+		self._changed(CPU_DUTY, bytes([duty]))
+
+	def shelf_duties(self, duties):
+		self._changed(SHELF_DUTIES, bytes(duties))
+
+	# Disk temps by slot after a sweep that read polled disks
+	def disk_temps(self, temps, polled):
+		temps = _temps(temps)
+		with self._lock:
+			# Roll over first, so a new segment always starts with a full list
+			offset = self._offset()
+			last = self._disks
+			if last is None or len(last) != len(temps):
+				self._write(DISK_TEMPS, _u16.pack(polled) + temps.tobytes(), offset)
+			else:
+				changes = [_change.pack(slot, temp) for slot, (old, temp) in enumerate(zip(last, temps)) if old != temp]
+				self._write(DISK_CHANGES, _u16.pack(polled) + b"".join(changes), offset)
+			self._disks = temps
+
+	def event(self, code):
+		with self._lock:
+			self._write(BMC_EVENT, bytes([code]))
+
+	def flush(self):
+		with self._lock:
+			self._file.flush()
+			self._last_flush = time.monotonic()
+
+	def close(self):
+		with self._lock:
+			self._file.close()
+
+### Reading
+# Yields (unix time, type, value) for every record in a trace. DISK_CHANGES records come back as DISK_TEMPS with the
+# full slot list, value (polled, temps); core and disk temps are lists of ints.
+def read_trace(path):
+	with open(path, "rb") as f: data = f.read()
+	if data[:4] != MAGIC: raise ValueError(path + " is not a fanctl trace")
+	offset = 4
+	base = 0.0
+	disks = None
+	while offset + HEADER.size <= len(data):
+		rtype, ms, length = HEADER.unpack_from(data, offset)
+		offset += HEADER.size
+		if offset + length > len(data): return
+		body = data[offset:offset + length]
+		offset += length
+		if rtype == SEGMENT:
+			base = _f64.unpack(body)[0]
+			disks = None
+			continue
+		t = base + ms / 1000.0
+		if rtype == LAYOUT: yield t, rtype, array("H", body).tolist()
+		elif rtype == CORE_TEMPS: yield t, rtype, array("b", body).tolist()
+		elif rtype == FAN_RPM: yield t, rtype, _i32.unpack(body)[0]
+		elif rtype == CPU_DUTY: yield t, rtype, body[0]
+		elif rtype == SHELF_DUTIES: yield t, rtype, list(body)
+		elif rtype == DISK_TEMPS:
+			disks = array("b", body[_u16.size:]).tolist()
+			yield t, DISK_TEMPS, (_u16.unpack_from(body)[0], list(disks))
+		elif rtype == DISK_CHANGES:
+			if disks is None: continue
+			for pos in range(_u16.size, len(body), _change.size):
+				slot, temp = _change.unpack_from(body, pos)
+				if slot < len(disks): disks[slot] = temp
+			yield t, DISK_TEMPS, (_u16.unpack_from(body)[0], list(disks))
+		elif rtype == BMC_EVENT: yield t, rtype, body[0]
+
+### Replay
+# Duty cycle history for one set of fans: number of changes, time-weighted mean duty, max duty and seconds at 100%
+DutyStats = collections.namedtuple("DutyStats", "changes mean max full")
+# Whole replay: seconds of trace covered, recorded vs. replayed DutyStats for the CPU and each shelf, disk reads
+# recorded vs. replayed, how far behind the replayed schedule's view of the disks got (the worst over all sweeps, and
+# the average of each sweep's worst, in C), and BMC event counts by code
+ReplayResult = collections.namedtuple("ReplayResult", "duration cpu shelves disk_reads replay_disk_reads max_lag mean_lag events")
+
+class _DutyTrack:
+	def __init__(self):
+		self.duty = None
+		self.since = None
+		self.changes = 0
+		self.total = 0.0
+		self.time = 0.0
+		self.max = 0
+		self.full = 0.0
+
+	def set(self, t, duty):
+		if duty == self.duty: return
+		self._close(t)
+		if self.duty is not None: self.changes += 1
+		self.duty = duty
+		self.since = t
+		if duty > self.max: self.max = duty
+
+	def _close(self, t):
+		if self.duty is None: return
+		span = t - self.since
+		self.total += self.duty * span
+		self.time += span
+		if self.duty >= 100: self.full += span
+		self.since = t
+
+	def stats(self, end):
+		self._close(end)
+		return DutyStats(self.changes, self.total / self.time if self.time else float(self.duty or 0), self.max, self.full)
+
+# Run a trace through cpu_curve, hd_curves (one per chassis) and schedule (a PollSchedule, or None to read every disk
+# on every sweep) and compare what they'd have done with what was recorded. Between readings a disk's temp is taken
+# to be its last recorded value.
+def replay(records, cpu_curve, hd_curves, schedule=None, cpu_override_temp=None):
+	cpu, cpu_replay = _DutyTrack(), _DutyTrack()
+	shelves = [_DutyTrack() for x in hd_curves]
+	shelves_replay = [_DutyTrack() for x in hd_curves]
+	ends = None
+	known = None
+	override = False
+	disk_reads = replay_reads = 0
+	max_lag = lag_total = 0
+	sweeps = 0
+	events = {}
+	start = end = None
+	for t, rtype, value in records:
+		if start is None: start = t
+		end = t
+		if rtype == LAYOUT:
+			ends = value
+		elif rtype == CORE_TEMPS:
+			if not value: continue
+			cpu_temp = max(value)
+			cpu_replay.set(t, cpu_curve.update(cpu_temp, t))
+			override = cpu_override_temp is not None and cpu_temp >= cpu_override_temp
+		elif rtype == CPU_DUTY:
+			cpu.set(t, value)
+		elif rtype == SHELF_DUTIES:
+			for shelf, duty in enumerate(value[:len(shelves)]): shelves[shelf].set(t, duty)
+		elif rtype == DISK_TEMPS:
+			polled, temps = value
+			disk_reads += polled
+			if known is None or len(known) != len(temps):
+				known = [-1] * len(temps)
+				names = [str(slot) for slot in range(len(temps))]
+			# Slot numbers as node names; PollSchedule skips empty names
+			empty = -1 in temps
+			nodes = [name if temp >= 0 else "" for name, temp in zip(names, temps)] if empty else names
+			due = schedule.due(nodes, t) if schedule else [node for node in nodes if node]
+			for node in due:
+				slot = int(node)
+				known[slot] = temps[slot]
+				if schedule: schedule.update(node, temps[slot], t)
+			replay_reads += len(due)
+			# Bays that went empty have nothing to be behind on
+			if empty: known = [k if temp >= 0 else -1 for k, temp in zip(known, temps)]
+			lag = max(map(abs, map(operator.sub, known, temps)), default=0)
+			max_lag = max(max_lag, lag)
+			lag_total += lag
+			sweeps += 1
+			bounds = ends or [len(temps)]
+			first = 0
+			for shelf, last in enumerate(bounds[:len(hd_curves)]):
+				duty = hd_curves[shelf].update(max([0] + known[first:last]), t)
+				if shelf == 0 and override: duty = 100
+				shelves_replay[shelf].set(t, duty)
+				first = last
+		elif rtype == BMC_EVENT:
+			events[value] = events.get(value, 0) + 1
+	if start is None: start = end = 0.0
+	return ReplayResult(end - start, (cpu.stats(end), cpu_replay.stats(end)),
+		[(recorded.stats(end), replayed.stats(end)) for recorded, replayed in zip(shelves, shelves_replay)],
+		disk_reads, replay_reads, max_lag, lag_total / sweeps if sweeps else 0.0, events)
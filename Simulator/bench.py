@@ -0,0 +1,627 @@
+#!/usr/bin/env python3
+
+###
+# Benchmark harness for fanctl
+###
+
+# Runs the real fanctl control tasks against simulated hardware and reports how the control loop behaves:
+#	- fake_ipmitool.py stands in for the BMC and fake_smartctl.py for the disks (both real executables, so fanctl's
+#	  subprocess and session handling is exercised as-is); kern.disks and geom are stubbed in-process
+#	- thermal.py closes the loop: CPU temps follow load and the CPU fan duty set over IPMI, disk and shelf ambient temps
+#	  follow the duty cycle each shelf controller is running
+#	- each shelf controller is a small TCP server that takes DUTY frames from fanctl, ramps its fan like
+#	  fanctl_client and reports its duty, RPM and ambient temp back; the display is a TCP server that acks disk temp
+#	  deltas
+#	- with --real-shelves, each shelf controller is the real fanctl_client.py instead, in its own process with
+#	  fakes/pigpio.py for its PWM output and fan tach and fake 1-Wire probes that read the model's shelf ambient temp
+#
+# After a warm-up, each scenario applies one disturbance, watches fanctl respond, then takes it away again:
+#	load		CPU load steps from 10% to 90%
+#	disk-heat	the first disk in every chassis starts running hot
+#	bmc-fault	the BMC starts reporting 0 RPM for the CPU fans until it's cold reset
+#	bmc-flaky	a share of IPMI commands fail (--ipmi-fail-rate)
+#	shelf-stall	the fan in the last shelf stops turning and its controller reports a stall
+#
+# For every disk count given, the report shows task run time and jitter (p50/p99/max), time from each disturbance to
+# the first duty cycle change and to the fans settling on their final duty, IPMI and smartctl call counts, and BMC
+# error/reset counters. Each disk count runs in its own process, since fanctl keeps its state in module globals.
+#
+# Usage:
+#	bench.py --disks 48,240,500 --scenarios load,disk-heat,bmc-fault --time-scale 10
+#	bench.py --disks 48 --real-shelves --scenarios shelf-stall
+#
+# fanctl's own log goes to fanctl.log in a scratch directory (kept with --keep), and with --real-shelves each shelf
+# client's log goes to shelfN/fanctl_client.log there. With --trace, each run also records a sensor trace that can be
+# fed to "fanctl.py --replay".
+
+### Libraries:
+# argparse for the command line
+# json for the fake hardware state files and the child process report
+# os, sys, tempfile, shutil and subprocess to set up the scratch directory and run each disk count
+# time, threading and socket for the fake shelf controllers and display
+# math to size the chassis list
+# array for the fake CPU sensor readings
+import argparse, json, os, sys, tempfile, shutil, subprocess, time, threading, socket, math
+from array import array
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+sys.path.append(os.path.join(ROOT, "Primary Control Sript"))
+sys.path.append(os.path.join(ROOT, "Common"))
+# Fakes for anything fanctl imports that isn't installed (a real psutil still wins)
+sys.path.append(os.path.join(HERE, "fakes"))
+
+from thermal import ThermalModel
+from fanctl_log import setup_logging, stop_logging
+from fanctl_proto import FrameReader, FrameWriter, HddDeltaDecoder, Record, ShelfTelemetry, DUTY, HDD_KEYFRAME, HDD_DELTA, HDD_ACK, SHELF_TELEMETRY, SHELF_STALLED
+
+CLIENT = os.path.join(ROOT, "Client Script", "fanctl_client.py")
+FAKE_IPMITOOL = os.path.join(HERE, "fake_ipmitool.py")
+FAKE_SMARTCTL = os.path.join(HERE, "fake_smartctl.py")
+BAYS_PER_CHASSIS = 24
+SAMPLE_PERIOD = 0.1
+
+### Fake network peers
+# Accepts connections on one address, each on its own thread, and passes the records in every frame to handle(); any
+# records it returns are sent back. push() sends records to every connection.
+class _Server:
+	def __init__(self, address):
+		self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		self.sock.bind(address)
+		self.sock.listen(4)
+		self.running = True
+		# conn -> FrameWriter
+		self.conns = {}
+		self.conns_lock = threading.Lock()
+		threading.Thread(target=self._accept, daemon=True).start()
+
+	def _accept(self):
+		while self.running:
+			try: conn, address = self.sock.accept()
+			except OSError: return
+			threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+	def _serve(self, conn):
+		reader = FrameReader()
+		with self.conns_lock:
+			self.conns[conn] = FrameWriter()
+		try:
+			while self.running:
+				try: data = conn.recv(65536)
+				except OSError: return
+				if not data: return
+				for seq, records in reader.feed(data):
+					reply = self.handle(records)
+					if reply:
+						try: self._send(conn, reply)
+						except OSError: return
+		finally:
+			with self.conns_lock:
+				del self.conns[conn]
+			conn.close()
+
+	def _send(self, conn, records):
+		with self.conns_lock:
+			writer = self.conns.get(conn)
+			if writer is not None: conn.sendall(writer.frame(records))
+
+	def push(self, records):
+		for conn in list(self.conns):
+			try: self._send(conn, records)
+			except OSError: pass
+
+	def stop(self):
+		self.running = False
+		self.sock.close()
+
+# Shelf controller: ramps toward the commanded duty at ramp_rate %/s, like fanctl_client, and reports back its duty,
+# RPM, ambient temp and stall flag whenever they change (and at least once a second)
+class FakeShelf(_Server):
+	def __init__(self, address, ramp_rate):
+		self.ramp_rate = ramp_rate
+		self.target = 100
+		self.duty = 100.0
+		self.frames = 0
+		self.ambient = 25.0
+		self.stalled = False
+		self._reported = None
+		self._report_time = 0
+		_Server.__init__(self, address)
+
+	def handle(self, records):
+		self.frames += 1
+		for record in records:
+			if record.type == DUTY: self.target = record.value
+
+	def tick(self, dt):
+		step = self.ramp_rate * dt
+		if self.duty < self.target: self.duty = min(self.target, self.duty + step)
+		elif self.duty > self.target: self.duty = max(self.target, self.duty - step)
+		duty = int(self.duty)
+		report = ShelfTelemetry(duty, self.target, 1 if duty != self.target else 0, 0 if self.stalled else duty * 15,
+			round(self.ambient, 1), SHELF_STALLED if self.stalled else 0)
+		now = time.monotonic()
+		if report != self._reported or now - self._report_time >= 1:
+			self._reported = report
+			self._report_time = now
+			self.push([Record(SHELF_TELEMETRY, report)])
+
+# The real shelf client in its own process. Its PWM duty comes back through the state file the fake pigpio module
+# writes, and the fan stalls while the stall file exists. The model's ambient temp is written to a fake DS18B20 probe
+# for it to read. target() is the duty fanctl last sent the shelf and frames() how many frames it sent, as fanctl sees
+# them (the client doesn't tell anyone what it got). Otherwise it looks like a FakeShelf to the rest of the bench.
+class ClientShelf:
+	def __init__(self, address, display, directory, target, frames):
+		self.dir = directory
+		self._target = target
+		self._frames = frames
+		self.ambient = 25.0
+		self.duty = 100.0
+		self.state_file = os.path.join(directory, "pwm")
+		self.stall_file = os.path.join(directory, "stall")
+		self.probe = os.path.join(directory, "w1", "28-0000000000" + address[0].split(".")[-1].zfill(2))
+		os.makedirs(self.probe)
+		self._write_probe()
+		env = dict(os.environ)
+		env["PYTHONPATH"] = os.pathsep.join([os.path.join(HERE, "fakes")] + ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else []))
+		env["FAKE_PIGPIO_STATE"] = self.state_file
+		env["FAKE_PIGPIO_STALL_FILE"] = self.stall_file
+		env["FANCTL_CLIENT_LOG"] = os.path.join(directory, "fanctl_client.log")
+		env["FANCTL_CLIENT_LISTEN"] = address[0] + ":" + str(address[1])
+		env["FANCTL_CLIENT_DISPLAY"] = display[0] + ":" + str(display[1])
+		env["FANCTL_W1_DEVICES"] = os.path.join(directory, "w1")
+		with open(os.path.join(directory, "stderr"), "w") as err:
+			self.proc = subprocess.Popen([sys.executable, CLIENT], env=env, stdin=subprocess.DEVNULL, stdout=err, stderr=err)
+
+	@property
+	def target(self):
+		return self._target()
+
+	@property
+	def frames(self):
+		return self._frames()
+
+	@property
+	def stalled(self):
+		return os.path.exists(self.stall_file)
+
+	@stalled.setter
+	def stalled(self, on):
+		if on: open(self.stall_file, "w").close()
+		elif os.path.exists(self.stall_file): os.remove(self.stall_file)
+
+	def _write_probe(self):
+		tmp = self.probe + ".tmp"
+		with open(tmp, "w") as f:
+			f.write("50 05 4b 46 7f ff 0c 10 1c : crc=1c YES\n50 05 4b 46 7f ff 0c 10 1c t=" + str(int(self.ambient * 1000)) + "\n")
+		os.replace(tmp, os.path.join(self.probe, "w1_slave"))
+
+	def tick(self, dt):
+		try:
+			with open(self.state_file) as f: self.duty = float(f.read())
+		except (OSError, ValueError): pass
+		self._write_probe()
+
+	def stop(self):
+		if self.proc.poll() is None:
+			self.proc.terminate()
+			try: self.proc.wait(5)
+			except subprocess.TimeoutExpired: self.proc.kill()
+
+# Display: decodes disk temps and acks every snapshot
+class FakeDisplay(_Server):
+	def __init__(self, address):
+		self.decoder = HddDeltaDecoder()
+		self.frames = 0
+		self.keyframes = 0
+		self.deltas = 0
+		_Server.__init__(self, address)
+
+	def handle(self, records):
+		self.frames += 1
+		acks = []
+		for record in records:
+			if record.type in (HDD_KEYFRAME, HDD_DELTA):
+				if record.type == HDD_KEYFRAME: self.keyframes += 1
+				else: self.deltas += 1
+				temps, ack = self.decoder.apply(record)
+				acks.append(Record(HDD_ACK, ack))
+		return acks
+
+### Measurements
+# Times at which a value changed
+class Trace:
+	def __init__(self):
+		self.changes = []
+		self.value = None
+
+	def record(self, t, value):
+		if value != self.value:
+			self.value = value
+			self.changes.append((t, value))
+
+	def since(self, t0):
+		return [(t - t0, value) for t, value in self.changes if t > t0]
+
+	# Seconds from t0 to the first change, and to the last change (after which it held its final value)
+	def response(self, t0):
+		changes = self.since(t0)
+		if not changes: return None, None, 0
+		return changes[0][0], changes[-1][0], len(changes)
+
+class ModelSensor:
+	name = "model"
+
+	def __init__(self, model):
+		self.model = model
+
+	# A few cores spread around the model's CPU temp
+	def read(self):
+		temp = self.model.cpu_temp
+		return array("f", [temp, temp - 1.5, temp + 0.5, temp - 0.5])
+
+	def close(self):
+		pass
+
+def _counter_totals(counters):
+	totals = {}
+	for (name, labels), value in counters.items():
+		totals[name] = totals.get(name, 0) + value
+	return totals
+
+### Simulation (child process, one disk count)
+class Simulation:
+	def __init__(self, args, tmp):
+		self.args = args
+		self.tmp = tmp
+		self.num_disks = args.disks
+		sizes = []
+		remaining = args.disks
+		for x in range(max(1, int(math.ceil(args.disks / float(BAYS_PER_CHASSIS))))):
+			sizes.append(min(BAYS_PER_CHASSIS, remaining))
+			remaining -= sizes[-1]
+		self.sizes = sizes
+		self.ipmi_state = os.path.join(tmp, "ipmi.json")
+		self.fault_file = os.path.join(tmp, "ipmi.fault")
+		self.smart_state = os.path.join(tmp, "smart.json")
+		self.model = ThermalModel(sizes, time_scale=args.time_scale, seed=1)
+		self.cpu_trace = Trace()
+		self.shelf_targets = [Trace() for x in sizes]
+		self.shelf_duties = [Trace() for x in sizes]
+		self._lock = threading.Lock()
+		self._running = False
+
+	def _write_topology(self):
+		chassis = []
+		slot = 0
+		for shelf, size in enumerate(self.sizes):
+			chassis.append({"name": "HEAD " + str(shelf).zfill(2) if shelf == 0 else "SHELF " + str(shelf).zfill(2),
+				"controller": "127.0.1." + str(shelf + 1), "rows": 6, "cols": 4,
+				"serials": ["SIM" + str(slot + i).zfill(5) for i in range(size)]})
+			slot += size
+		path = os.path.join(self.tmp, "topology.json")
+		with open(path, "w") as f:
+			json.dump({"head": "127.0.0.1", "display": "127.0.2.1", "port": self.args.port, "chassis": chassis}, f)
+		return path
+
+	def _write_smart_state(self):
+		disks = {"da" + str(i): {"serial": "SIM" + str(i).zfill(5), "temp": int(round(temp))}
+			for i, temp in enumerate(self.model.disk_temps)}
+		# A boot SSD that isn't in the topology; fanctl should skip it
+		disks["ada0"] = {"serial": "SIMBOOT", "temp": 35, "ssd": True}
+		tmp = self.smart_state + ".tmp"
+		with open(tmp, "w") as f: json.dump(disks, f)
+		os.replace(tmp, self.smart_state)
+
+	def _read_bmc(self):
+		try:
+			with open(self.ipmi_state) as f: return json.load(f)
+		except (OSError, ValueError): return None
+
+	### Setup
+	def setup(self):
+		args = self.args
+		os.environ["FANCTL_TOPOLOGY"] = self._write_topology()
+		os.environ["FAKE_IPMI_STATE"] = self.ipmi_state
+		os.environ["FAKE_IPMI_FAULT_FILE"] = self.fault_file
+		os.environ["FAKE_IPMI_LATENCY"] = str(args.ipmi_latency)
+		os.environ["FAKE_IPMI_REBOOT_TIME"] = str(args.bmc_reboot_time)
+		os.environ["FAKE_SMART_STATE"] = self.smart_state
+		os.environ["FAKE_SMART_LATENCY"] = str(args.smart_latency)
+		os.environ["FAKE_SMART_FAIL_RATE"] = str(args.smart_fail_rate)
+		os.environ.pop("FAKE_IPMI_FAIL_RATE", None)
+		self._write_smart_state()
+
+		import fanctl, fanctl_disks
+		from fanctl_ipmi import IpmiBackend
+		from fanctl_smart import SmartPoller, PollSchedule
+		from fanctl_disks import DiskInventory
+		self.fanctl = fanctl
+		scale = args.time_scale
+
+		# Point fanctl at the fake hardware
+		fanctl.ipmi = IpmiBackend(FAKE_IPMITOOL, os.path.join(self.tmp, "sdr"), metrics=fanctl.metrics)
+		fanctl.cpu_sensor = ModelSensor(self.model)
+		nodes = ["da" + str(i) for i in range(self.num_disks)] + ["ada0"]
+		fanctl_disks.list_disk_nodes = lambda: list(nodes)
+		fanctl_disks.disk_identities = lambda: {node: node + "-ident:4000787030016" for node in nodes}
+		fanctl.smart_poller = SmartPoller(FAKE_SMARTCTL, fanctl.hd_poll_workers, fanctl.hd_poll_timeout, fanctl.hd_sweep_budget, fanctl.metrics)
+		fanctl.disk_inventory = DiskInventory(fanctl.topology.serials, FAKE_SMARTCTL, fanctl.hd_poll_workers, fanctl.hd_poll_timeout,
+			os.path.join(self.tmp, "disks.json"), fanctl.metrics)
+
+		# Disk timings follow the model clock; BMC and network timings stay in real time
+		fanctl.hd_poll_min_interval = max(1, fanctl.hd_poll_min_interval / scale)
+		fanctl.hd_poll_schedule = PollSchedule(fanctl.hd_temp_list, fanctl.hd_poll_min_interval,
+			max(1, fanctl.hd_polling_interval / scale), max(1, fanctl.hd_poll_max_interval / scale), max(1, fanctl.hd_standby_interval / scale))
+		for curve in fanctl.hd_curves: curve.min_dwell = fanctl.hd_min_dwell / scale
+		fanctl.cpu_curve.min_dwell = fanctl.cpu_min_dwell / scale
+		fanctl.bmc_reboot_grace_time = args.bmc_grace_time
+		fanctl.stats_interval = 3600
+
+		self.display = FakeDisplay((fanctl.topology.display, args.port))
+		if args.real_shelves:
+			self.shelves = [ClientShelf((chassis.controller, args.port), (fanctl.topology.display, args.port),
+				os.path.join(self.tmp, "shelf" + str(shelf)), lambda shelf=shelf: fanctl.hd_fan_duty[shelf],
+				lambda shelf=shelf: fanctl.net.peers["shelf " + str(shelf)].frames_sent)
+				for shelf, chassis in enumerate(fanctl.topology.chassis)]
+		else:
+			self.shelves = [FakeShelf((chassis.controller, args.port), args.ramp_rate) for chassis in fanctl.topology.chassis]
+
+		if args.trace:
+			from fanctl_trace import TraceWriter
+			fanctl.trace = TraceWriter(args.trace.replace("{disks}", str(self.num_disks)))
+			fanctl.trace.layout([chassis.end for chassis in fanctl.topology.chassis])
+
+	def start(self):
+		fanctl = self.fanctl
+		fanctl.set_fan_mode_full()
+		fanctl.connect_peers()
+		start = time.monotonic()
+		fanctl.log_disk_changes(fanctl.disk_inventory.scan(retry_failed=True))
+		self.scan_time = time.monotonic() - start
+		self.found = sum(1 for node in fanctl.disk_inventory.slot_nodes if node)
+		self._running = True
+		self._sampler = threading.Thread(target=self._sample, daemon=True)
+		self._sampler.start()
+		fanctl.add_tasks()
+		fanctl.scheduler.start()
+
+	def stop(self):
+		self._running = False
+		self._sampler.join(2)
+		self.fanctl.scheduler.stop()
+		self.fanctl.net.stop()
+		self.fanctl.ipmi.close()
+		if self.fanctl.trace is not None: self.fanctl.trace.close()
+		for server in self.shelves + [self.display]: server.stop()
+
+	# Feed fan duties into the model, step it, and publish its temps to the fake smartctl
+	def _sample(self):
+		last = time.monotonic()
+		last_write = last
+		fake_psutil = getattr(self.fanctl.psutil, "__file__", "").startswith(os.path.join(HERE, "fakes"))
+		while self._running:
+			time.sleep(SAMPLE_PERIOD)
+			now = time.monotonic()
+			bmc = self._read_bmc()
+			with self._lock:
+				if bmc is not None:
+					self.model.cpu_duty = bmc["duty"][0]
+					self.cpu_trace.record(now, bmc["duty"][0])
+				for shelf, server in enumerate(self.shelves):
+					server.ambient = self.model.ambient[shelf]
+					server.tick(now - last)
+					self.model.shelf_duty[shelf] = 0 if server.stalled else server.duty
+					self.shelf_targets[shelf].record(now, server.target)
+					self.shelf_duties[shelf].record(now, int(server.duty))
+				self.model.step(now - last)
+			if fake_psutil: self.fanctl.psutil.load = self.model.cpu_load * 100
+			if now - last_write >= 0.5:
+				self._write_smart_state()
+				last_write = now
+			last = now
+
+	### Scenarios
+	def _apply(self, name, on):
+		if name == "load":
+			self.model.cpu_load = 0.9 if on else 0.1
+		elif name == "disk-heat":
+			for shelf in range(len(self.sizes)):
+				self.model.disk_extra[sum(self.sizes[:shelf])] = 8.0 if on else 0.0
+		elif name == "bmc-fault":
+			if on: open(self.fault_file, "w").close()
+			elif os.path.exists(self.fault_file): os.remove(self.fault_file)
+		elif name == "bmc-flaky":
+			if on: os.environ["FAKE_IPMI_FAIL_RATE"] = str(self.args.ipmi_fail_rate)
+			else: os.environ.pop("FAKE_IPMI_FAIL_RATE", None)
+			# The fail rate is read when ipmitool starts; drop the session so the next command starts a new one
+			self.fanctl.ipmi.close()
+		elif name == "shelf-stall":
+			self.shelves[-1].stalled = on
+		else:
+			raise ValueError("unknown scenario " + name)
+
+	def _ipmi_calls(self):
+		return sum(stat[0] for stat in list(self.fanctl.ipmi.stats.values()))
+
+	def _smart_calls(self, histograms):
+		return sum(h[0] for (name, labels), h in histograms.items() if name == "fanctl_smartctl_seconds")
+
+	def run_scenario(self, name):
+		fanctl = self.fanctl
+		counters_before, histograms_before = fanctl.metrics.snapshot()
+		ipmi_before = self._ipmi_calls()
+		t0 = time.monotonic()
+		self._apply(name, True)
+		resets = _counter_totals(counters_before).get("fanctl_bmc_resets_total", 0)
+		reset_after = None
+		recovered_after = None
+		while time.monotonic() - t0 < self.args.observe:
+			time.sleep(SAMPLE_PERIOD)
+			now = time.monotonic() - t0
+			if reset_after is None and _counter_totals(fanctl.metrics.snapshot()[0]).get("fanctl_bmc_resets_total", 0) > resets:
+				reset_after = now
+			elif reset_after is not None and recovered_after is None and fanctl.cpu_fan_speed > 0 and fanctl.bmc_fail_count == 0:
+				recovered_after = now
+		counters_after, histograms_after = fanctl.metrics.snapshot()
+		bmc = self._read_bmc() or {"duty": [None, None]}
+		with self._lock:
+			cpu = self.cpu_trace.response(t0)
+			targets = [trace.response(t0) for trace in self.shelf_targets]
+			duties = [trace.response(t0) for trace in self.shelf_duties]
+		reactions = [target[0] for target in targets if target[0] is not None]
+		settled = [duty[1] for duty in duties if duty[1] is not None]
+		before = _counter_totals(counters_before)
+		delta = {name: value - before.get(name, 0) for name, value in _counter_totals(counters_after).items() if value != before.get(name, 0)}
+		result = {
+			"cpu_reaction": cpu[0], "cpu_settled": cpu[1], "cpu_changes": cpu[2],
+			# The duty fanctl thinks the CPU fans are at vs. what the BMC is actually running
+			"cpu_duty": fanctl.cpu_fan_duty, "bmc_duty": bmc["duty"][0],
+			"shelf_reaction": min(reactions) if reactions else None,
+			"shelf_settled": max(settled) if settled else None,
+			"shelf_changes": sum(target[2] for target in targets),
+			"bmc_reset_after": reset_after, "bmc_recovered_after": recovered_after,
+			"ipmi_calls": self._ipmi_calls() - ipmi_before,
+			"smart_calls": self._smart_calls(histograms_after) - self._smart_calls(histograms_before),
+			"counters": delta,
+		}
+		self._apply(name, False)
+		time.sleep(self.args.settle)
+		return result
+
+	def report(self, scenarios):
+		fanctl = self.fanctl
+		counters, histograms = fanctl.metrics.snapshot()
+		tasks = {}
+		for (name, labels), (count, p50, p99, worst) in histograms.items():
+			if name in ("fanctl_task_duration_seconds", "fanctl_task_jitter_seconds"):
+				task = tasks.setdefault(dict(labels)["task"], {})
+				kind = "run" if name == "fanctl_task_duration_seconds" else "jitter"
+				task[kind] = [count, p50, p99, worst]
+		smart = [h for (name, labels), h in histograms.items() if name == "fanctl_smartctl_seconds"]
+		probes = [h for (name, labels), h in histograms.items() if name == "fanctl_smartctl_probe_seconds"]
+		bmc = self._read_bmc() or {}
+		return {
+			"disks": self.num_disks, "chassis": len(self.sizes), "found": self.found, "scan_time": self.scan_time,
+			"tasks": tasks,
+			"ipmi": {label: [calls, total / calls, worst] for label, (calls, total, worst, last) in fanctl.ipmi.stats.items()},
+			"bmc_commands": bmc.get("calls", 0),
+			"smart_calls": sum(h[0] for h in smart), "smart_max": max([h[3] for h in smart] or [0]),
+			"smart_probes": sum(h[0] for h in probes),
+			"display_frames": self.display.frames, "display_keyframes": self.display.keyframes, "display_deltas": self.display.deltas,
+			"shelf_frames": sum(shelf.frames for shelf in self.shelves),
+			"counters": _counter_totals(counters),
+			"scenarios": scenarios,
+		}
+
+def run_child(args):
+	tmp = tempfile.mkdtemp(prefix="fanctl_bench_")
+	out = sys.stdout
+	err = sys.stderr
+	setup_logging(os.path.join(tmp, "fanctl.log"))
+	try:
+		sim = Simulation(args, tmp)
+		sim.setup()
+		sim.start()
+		err.write("  " + str(args.disks) + " disks: warming up for " + str(args.warmup) + " sec\n")
+		err.flush()
+		time.sleep(args.warmup)
+		scenarios = {}
+		for name in args.scenarios.split(","):
+			err.write("  " + str(args.disks) + " disks: " + name + "\n")
+			err.flush()
+			scenarios[name] = sim.run_scenario(name)
+		report = sim.report(scenarios)
+		sim.stop()
+	finally:
+		stop_logging()
+		sys.stdout = out
+		sys.stderr = err
+		if args.keep: err.write("  fanctl log and state kept in " + tmp + "\n")
+		else: shutil.rmtree(tmp, ignore_errors=True)
+	out.write(json.dumps(report) + "\n")
+
+### Report
+def _ms(seconds):
+	return str(round(seconds * 1000, 1)) + "ms"
+
+def _sec(seconds):
+	return "-" if seconds is None else str(round(seconds, 1)) + "s"
+
+def print_report(report):
+	print("=== " + str(report["disks"]) + " disks in " + str(report["chassis"]) + " chassis (" + str(report["found"]) +
+		" found, inventory scan " + _sec(report["scan_time"]) + ")")
+	print("Tasks (runs, run p50/p99/max, jitter p50/p99/max):")
+	for name, task in sorted(report["tasks"].items()):
+		run = task.get("run", [0, 0, 0, 0])
+		jitter = task.get("jitter", [0, 0, 0, 0])
+		print("  " + name.ljust(18) + str(run[0]).rjust(6) + "  " + " / ".join(_ms(x) for x in run[1:]) + "   " +
+			" / ".join(_ms(x) for x in jitter[1:]))
+	print("IPMI: " + str(report["bmc_commands"]) + " commands reached the BMC; " + ", ".join(label + " " + str(calls) +
+		" calls avg " + _ms(avg) + " max " + _ms(worst) for label, (calls, avg, worst) in sorted(report["ipmi"].items())))
+	print("SMART: " + str(report["smart_calls"]) + " temp reads (max " + _ms(report["smart_max"]) + "), " +
+		str(report["smart_probes"]) + " identity probes")
+	print("Network: " + str(report["shelf_frames"]) + " frames to shelves, " + str(report["display_frames"]) + " to the display (" +
+		str(report["display_keyframes"]) + " keyframes, " + str(report["display_deltas"]) + " deltas)")
+	for name, result in report["scenarios"].items():
+		print("Scenario " + name + ":")
+		print("  CPU fans: first change " + _sec(result["cpu_reaction"]) + ", settled " + _sec(result["cpu_settled"]) + " (" +
+			str(result["cpu_changes"]) + " changes); fanctl has " + str(result["cpu_duty"]) + "%, BMC runs " + str(result["bmc_duty"]) + "%")
+		print("  Shelf fans: first change " + _sec(result["shelf_reaction"]) + ", settled " + _sec(result["shelf_settled"]) + " (" +
+			str(result["shelf_changes"]) + " duty changes)")
+		if result["bmc_reset_after"] is not None:
+			print("  BMC reset after " + _sec(result["bmc_reset_after"]) + ", fan readings good again after " + _sec(result["bmc_recovered_after"]))
+		print("  " + str(result["ipmi_calls"]) + " IPMI calls, " + str(result["smart_calls"]) + " smartctl calls" +
+			"".join(", " + name + " +" + str(value) for name, value in sorted(result["counters"].items())
+				if not name.startswith("fanctl_net_sent_bytes")))
+	print("", flush=True)
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark fanctl against simulated hardware")
+	parser.add_argument("--disks", default="48,240,500", help="comma-separated disk counts to run (default 48,240,500)")
+	parser.add_argument("--scenarios", default="load,disk-heat,bmc-fault,bmc-flaky,shelf-stall", help="comma-separated scenarios to run")
+	parser.add_argument("--time-scale", type=float, default=10, help="how much faster than real time the thermal model runs")
+	parser.add_argument("--warmup", type=float, default=30, help="seconds to let temps settle before the first scenario")
+	parser.add_argument("--observe", type=float, default=60, help="seconds to watch each scenario")
+	parser.add_argument("--settle", type=float, default=20, help="seconds to recover between scenarios")
+	parser.add_argument("--port", type=int, default=10100, help="port for the fake shelf controllers and display")
+	parser.add_argument("--ramp-rate", type=float, default=1, help="shelf fan ramp rate in %%/sec (not used with --real-shelves)")
+	parser.add_argument("--real-shelves", action="store_true", help="run the real fanctl_client.py for each shelf, with the fake pigpio module")
+	parser.add_argument("--ipmi-latency", type=float, default=0.02, help="seconds the fake BMC takes per command")
+	parser.add_argument("--ipmi-fail-rate", type=float, default=0.2, help="share of IPMI commands that fail in bmc-flaky")
+	parser.add_argument("--bmc-reboot-time", type=float, default=5, help="seconds the fake BMC has no fan readings after a reset")
+	parser.add_argument("--bmc-grace-time", type=float, default=30, help="fanctl's bmc_reboot_grace_time for the run")
+	parser.add_argument("--smart-latency", type=float, default=0, help="seconds the fake smartctl takes per call")
+	parser.add_argument("--smart-fail-rate", type=float, default=0, help="share of smartctl calls that can't open the disk")
+	parser.add_argument("--trace", help="record a sensor trace of each run to this file ({disks} is replaced by the disk count)")
+	parser.add_argument("--keep", action="store_true", help="keep the scratch directory with fanctl's log")
+	parser.add_argument("--json", action="store_true", help="print the raw reports as JSON")
+	parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if args.child:
+		args.disks = int(args.disks)
+		run_child(args)
+		return 0
+
+	# One process per disk count
+	reports = []
+	for disks in [int(n) for n in args.disks.split(",")]:
+		argv = [sys.executable, os.path.abspath(__file__), "--child", "--disks", str(disks)]
+		for name, value in sorted(vars(args).items()):
+			if name in ("disks", "child", "json") or value is False or value is None: continue
+			argv.append("--" + name.replace("_", "-"))
+			if value is not True: argv.append(str(value))
+		proc = subprocess.run(argv, stdout=subprocess.PIPE)
+		if proc.returncode != 0:
+			sys.stderr.write("Run with " + str(disks) + " disks failed\n")
+			continue
+		report = json.loads(proc.stdout.decode("utf-8").strip().splitlines()[-1])
+		reports.append(report)
+		if not args.json: print_report(report)
+	if args.json: print(json.dumps(reports, indent=1))
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+###
+# Fake ipmitool for testing fanctl without a Supermicro BMC
+###
+
+# Understands the handful of ipmitool commands fanctl uses, both as one-shot calls and inside "ipmitool shell":
+#	raw 0x30 0x45 0x01 <mode>				set fan mode
+#	raw 0x30 0x70 0x66 0x01 <zone> <duty>	set zone duty cycle
+#	sensor reading <name>					read one sensor
+#	sdr / sdr list							dump all sensors
+#	sdr dump <file>							write an SDR cache file
+#	bmc reset cold							simulate a BMC reboot
+#
+# Fan state is kept in a JSON file so separate one-shot calls and shell sessions all see the same BMC. Environment:
+#	FAKE_IPMI_STATE			state file (default /tmp/fake_ipmi.json)
+#	FAKE_IPMI_LATENCY		seconds to sleep before answering each command (default 0)
+#	FAKE_IPMI_FAIL_RATE		probability (0-1) that a command fails like an unresponsive BMC (default 0)
+#	FAKE_IPMI_MAX_RPM		fan RPM at 100% duty (default 1800)
+#	FAKE_IPMI_REBOOT_TIME	seconds the BMC reports no fan readings after a cold reset (default 5)
+#	FAKE_IPMI_FAULT_FILE	while this file exists the fans read 0 RPM, like a BMC that has lost track of them; a cold
+#							reset deletes it (default /tmp/fake_ipmi.fault)
+#
+# Use it by pointing fanctl's ipmitool path at this file.
+
+import sys, os, json, time, random
+
+state_file = os.environ.get("FAKE_IPMI_STATE", "/tmp/fake_ipmi.json")
+latency = float(os.environ.get("FAKE_IPMI_LATENCY", "0"))
+fail_rate = float(os.environ.get("FAKE_IPMI_FAIL_RATE", "0"))
+max_rpm = int(os.environ.get("FAKE_IPMI_MAX_RPM", "1800"))
+reboot_time = float(os.environ.get("FAKE_IPMI_REBOOT_TIME", "5"))
+fault_file = os.environ.get("FAKE_IPMI_FAULT_FILE", "/tmp/fake_ipmi.fault")
+
+SENSORS = ["CPU Temp", "FAN1", "FAN2", "FAN3", "FAN4", "FANA"]
+
+def load_state():
+	try:
+		with open(state_file) as f: return json.load(f)
+	except (OSError, ValueError):
+		return {"mode": 0, "duty": [100, 100], "reset_time": 0, "calls": 0}
+
+def save_state(state):
+	tmp = state_file + ".tmp"
+	with open(tmp, "w") as f: json.dump(state, f)
+	os.replace(tmp, state_file)
+
+# Value of a sensor given the current BMC state; None means no reading
+def sensor_value(state, name):
+	if time.time() - state["reset_time"] < reboot_time: return None
+	if name == "CPU Temp": return 40
+	if os.path.exists(fault_file): return 0
+	zone = 1 if name == "FANA" else 0
+	return int(max_rpm * state["duty"][zone] / 100)
+
+def sensor_line(state, name, full=False):
+	value = sensor_value(state, name)
+	if full:
+		unit = "degrees C" if name == "CPU Temp" else "RPM"
+		return name.ljust(16) + " | " + ("no reading" if value is None else str(value) + " " + unit) + " | " + ("ns" if value is None else "ok")
+	return name.ljust(16) + " | " + ("" if value is None else str(value))
+
+# Run one command; returns (output, exit status)
+def run(args):
+	state = load_state()
+	state["calls"] += 1
+	if latency: time.sleep(latency)
+	try:
+		if fail_rate and random.random() < fail_rate:
+			return "Error: Unable to establish IPMI v2 / RMCP+ session", 1
+		if args[:1] == ["raw"]:
+			if time.time() - state["reset_time"] < reboot_time:
+				return "Unable to send RAW command (channel=0x0 netfn=0x30 lun=0x0 cmd=0x70 rsp=0xc3): Timeout", 1
+			data = [int(x, 0) for x in args[1:]]
+			if data[:3] == [0x30, 0x45, 0x01]:
+				state["mode"] = data[3]
+				state["duty"] = [100, 100]
+				return "", 0
+			if data[:4] == [0x30, 0x70, 0x66, 0x01]:
+				state["duty"][data[4]] = max(0, min(100, data[5]))
+				return "", 0
+			return "Unable to send RAW command (channel=0x0 netfn=0x30 lun=0x0 cmd=0x00 rsp=0xc1): Invalid command", 1
+		if args[:2] == ["sensor", "reading"]:
+			name = " ".join(args[2:])
+			if name not in SENSORS: return "Unable to find sensor id '" + name + "'", 1
+			return sensor_line(state, name) + "\n", 0
+		if args[:2] == ["sdr", "dump"]:
+			with open(args[2], "w") as f: f.write("\n".join(SENSORS) + "\n")
+			return "Dumping Sensor Data Repository to '" + args[2] + "'\n", 0
+		if args[:1] == ["sdr"]:
+			return "".join(sensor_line(state, name, True) + "\n" for name in SENSORS), 0
+		if args[:3] == ["bmc", "reset", "cold"]:
+			state["reset_time"] = time.time()
+			state["duty"] = [100, 100]
+			try: os.remove(fault_file)
+			except OSError: pass
+			return "Sent cold reset command to MC\n", 0
+		return "Invalid command: " + " ".join(args) + "\n", 1
+	finally:
+		save_state(state)
+
+def shell():
+	while True:
+		sys.stdout.write("ipmitool> ")
+		sys.stdout.flush()
+		line = sys.stdin.readline()
+		if not line: return
+		args = line.split()
+		if not args: continue
+		if args[0] in ("exit", "quit"): return
+		output, status = run(args)
+		sys.stdout.write(output)
+
+def main(argv):
+	# Skip global options we don't care about (-S <cache>, -I <iface>, -H <host>, etc.)
+	args = []
+	i = 0
+	while i < len(argv):
+		if argv[i] in ("-S", "-I", "-H", "-U", "-P", "-p"): i += 2
+		else:
+			args.append(argv[i])
+			i += 1
+	if args == ["shell"]:
+		shell()
+		return 0
+	output, status = run(args)
+	sys.stdout.write(output)
+	return status
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv[1:]))
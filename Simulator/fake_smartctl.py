@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+###
+# Fake smartctl for testing fanctl without real disks
+###
+
+# Understands the two smartctl calls fanctl makes:
+#	-n standby -A /dev/<node>	SMART attributes, including Temperature_Celsius (or the standby message if spun down)
+#	-i /dev/<node>				identity: serial number and rotation rate
+#
+# Disks come from a JSON state file mapping node -> {"serial": ..., "temp": ..., "standby": bool, "ssd": bool}, so a
+# thermal model (see thermal.py) can move temps around underneath it. Environment:
+#	FAKE_SMART_STATE		state file (default /tmp/fake_smart.json)
+#	FAKE_SMART_LATENCY		seconds to sleep before answering each call (default 0)
+#	FAKE_SMART_FAIL_RATE	probability (0-1) that the device can't be opened (default 0)
+#	FAKE_SMART_HANG_RATE	probability (0-1) that a call hangs like a disk stuck in error recovery (default 0)
+#	FAKE_SMART_HANG_TIME	how long a hang lasts in seconds (default 60)
+#
+# Use it by pointing fanctl's smartctl path at this file.
+
+import sys, os, json, time, random
+
+state_file = os.environ.get("FAKE_SMART_STATE", "/tmp/fake_smart.json")
+latency = float(os.environ.get("FAKE_SMART_LATENCY", "0"))
+fail_rate = float(os.environ.get("FAKE_SMART_FAIL_RATE", "0"))
+hang_rate = float(os.environ.get("FAKE_SMART_HANG_RATE", "0"))
+hang_time = float(os.environ.get("FAKE_SMART_HANG_TIME", "60"))
+
+BANNER = "smartctl 7.2 2020-12-30 r5155 [FreeBSD 12.2-RELEASE-p3 amd64] (local build)\n\n"
+
+def load_state():
+	try:
+		with open(state_file) as f: return json.load(f)
+	except (OSError, ValueError):
+		return {}
+
+def attributes(disk):
+	if disk.get("standby"):
+		return "Device is in STANDBY mode, exit(2)\n", 2
+	temp = int(disk.get("temp", 0))
+	return (BANNER + "=== START OF READ SMART DATA SECTION ===\n" +
+		"ID# ATTRIBUTE_NAME          FLAG     VALUE WORST THRESH TYPE      UPDATED  WHEN_FAILED RAW_VALUE\n" +
+		"  9 Power_On_Hours          0x0032   090   090   000    Old_age   Always       -       7823\n" +
+		"194 Temperature_Celsius     0x0022   " + str(100 - temp).zfill(3) + "   045   000    Old_age   Always       -       " +
+		str(temp) + " (Min/Max 20/45)\n"), 0
+
+def identity(node, disk):
+	rotation = "Solid State Device" if disk.get("ssd") else "7200 rpm"
+	return (BANNER + "=== START OF INFORMATION SECTION ===\n" +
+		"Device Model:     SIM DISK\n" +
+		"Serial Number:    " + disk.get("serial", "") + "\n" +
+		"Rotation Rate:    " + rotation + "\n"), 0
+
+# Run one call; returns (output, exit status)
+def run(args):
+	if latency: time.sleep(latency)
+	if hang_rate and random.random() < hang_rate: time.sleep(hang_time)
+	devices = [arg for arg in args if arg.startswith("/dev/")]
+	if not devices: return BANNER + "ERROR: smartctl requires a device name as the final command-line argument.\n", 1
+	node = devices[-1][5:]
+	disk = load_state().get(node)
+	if disk is None or (fail_rate and random.random() < fail_rate):
+		return BANNER + "Smartctl open device: " + devices[-1] + " failed: No such file or directory\n", 2
+	if "-A" in args: return attributes(disk)
+	if "-i" in args: return identity(node, disk)
+	return BANNER, 0
+
+def main(argv):
+	output, status = run(argv)
+	sys.stdout.write(output)
+	return status
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,137 @@
+###
+# Fake pigpio for running fanctl_client without a Raspberry Pi
+###
+
+# Covers the parts of the pigpio API fanctl_client uses. The PWM duty cycle set on a pin drives a simulated fan, and a
+# callback on any input pin counts that fan's tach pulses (two per revolution), so RPM readings follow the duty cycle.
+# A callback with a function gets called for each pulse with a microsecond tick, from its own thread like pigpio's,
+# and with TIMEOUT when a watchdog set on its pin runs out.
+# Put this directory on PYTHONPATH to use it. Environment:
+#	FAKE_PIGPIO_MAX_RPM		fan RPM at 100% duty (default 1500)
+#	FAKE_PIGPIO_STATE		file the current duty cycle is written to so a thermal model can follow it (default unset)
+#	FAKE_PIGPIO_STALL_FILE	the fan is stalled while this file exists (default /tmp/fake_pigpio.stall)
+
+import os, time, threading
+
+OUTPUT = 1
+INPUT = 0
+PUD_OFF = 0
+PUD_DOWN = 1
+PUD_UP = 2
+EITHER_EDGE = 2
+RISING_EDGE = 0
+FALLING_EDGE = 1
+TIMEOUT = 2
+
+max_rpm = int(os.environ.get("FAKE_PIGPIO_MAX_RPM", "1500"))
+state_file = os.environ.get("FAKE_PIGPIO_STATE")
+stall_file = os.environ.get("FAKE_PIGPIO_STALL_FILE", "/tmp/fake_pigpio.stall")
+
+def _tick():
+	return int(time.monotonic() * 1000000) & 0xffffffff
+
+class _Fan:
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.duty = 0
+		self.range = 255
+		self.pulses = 0.0
+		self.time = time.monotonic()
+
+	# Bring the pulse count up to now at the current speed
+	def advance(self):
+		now = time.monotonic()
+		rpm = 0 if os.path.exists(stall_file) else max_rpm * self.duty / float(self.range)
+		self.pulses += rpm / 60.0 * 2 * (now - self.time)
+		self.time = now
+
+_fan = _Fan()
+# gpio -> watchdog timeout in ms
+_watchdogs = {}
+
+class _callback:
+	def __init__(self, gpio, edge, func=None):
+		self.gpio = gpio
+		self.edge = edge
+		self._base = 0.0
+		self.reset_tally()
+		self.running = func is not None
+		if func is not None: threading.Thread(target=self._edges, args=(func,), daemon=True).start()
+
+	# Call func for every whole pulse, polling the fan every few ms, and on a watchdog timeout (repeating every timeout
+	# until there's a pulse again, like pigpio)
+	def _edges(self, func):
+		last = self.tally()
+		last_time = time.monotonic()
+		while self.running:
+			time.sleep(0.002)
+			now = self.tally()
+			for x in range(now - last): func(self.gpio, 1, _tick())
+			if now != last: last_time = time.monotonic()
+			last = now
+			timeout = _watchdogs.get(self.gpio, 0)
+			if timeout and time.monotonic() - last_time >= timeout / 1000.0:
+				func(self.gpio, TIMEOUT, _tick())
+				last_time = time.monotonic()
+
+	def tally(self):
+		with _fan.lock:
+			_fan.advance()
+			return int(_fan.pulses - self._base)
+
+	def reset_tally(self):
+		with _fan.lock:
+			_fan.advance()
+			self._base = _fan.pulses
+
+	def cancel(self):
+		self.running = False
+
+class pi:
+	def __init__(self, host="localhost", port=8888):
+		self.connected = True
+
+	def set_mode(self, gpio, mode):
+		return 0
+
+	def set_pull_up_down(self, gpio, pud):
+		return 0
+
+	def set_PWM_frequency(self, user_gpio, frequency):
+		return frequency
+
+	def set_PWM_range(self, user_gpio, range_):
+		with _fan.lock:
+			_fan.advance()
+			_fan.range = range_
+		return 0
+
+	def set_PWM_dutycycle(self, user_gpio, dutycycle):
+		with _fan.lock:
+			_fan.advance()
+			_fan.duty = dutycycle
+			percent = 100.0 * dutycycle / _fan.range
+		if state_file:
+			tmp = state_file + ".tmp"
+			with open(tmp, "w") as f: f.write(str(percent))
+			os.replace(tmp, state_file)
+		return 0
+
+	def get_PWM_dutycycle(self, user_gpio):
+		return _fan.duty
+
+	def callback(self, user_gpio, edge=RISING_EDGE, func=None):
+		return _callback(user_gpio, edge, func)
+
+	def set_glitch_filter(self, user_gpio, steady):
+		return 0
+
+	def set_watchdog(self, user_gpio, wdog_timeout):
+		_watchdogs[user_gpio] = wdog_timeout
+		return 0
+
+	def get_current_tick(self):
+		return _tick()
+
+	def stop(self):
+		self.connected = False
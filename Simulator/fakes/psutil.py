@@ -0,0 +1,14 @@
+###
+# Fake psutil for running fanctl where psutil isn't installed
+###
+
+# fanctl only asks psutil for the CPU load. The simulator sets load (0-100) to whatever its thermal model is running
+# at; otherwise FAKE_CPU_PERCENT is reported (default 0). Put this directory at the end of the module path so a real
+# psutil still wins.
+
+import os
+
+load = float(os.environ.get("FAKE_CPU_PERCENT", "0"))
+
+def cpu_percent(interval=None, percpu=False):
+	return load
@@ -0,0 +1,69 @@
+###
+# Thermal model for the fanctl simulator
+###
+
+# A rough first-order model of the head unit and shelves; good enough to close the loop around fanctl, not to predict
+# real temps. Every temp moves exponentially toward a steady-state value set by the heat going in and the airflow the
+# fans give it:
+#	CPU				room + (idle heat + load heat) / CPU fan airflow
+#	shelf ambient	room + heat from the shelf's disks / shelf fan airflow
+#	disk			shelf ambient + the disk's own heat / shelf fan airflow
+# Airflow goes from 0.15 with the fans stopped to 1.0 at 100% duty. time_scale runs the model faster than the wall
+# clock so several minutes of disk warm-up fit into a short benchmark.
+
+### Libraries:
+# math for the exponential approach
+# random for per-disk variation
+import math, random
+
+# Time constants in (model) seconds
+CPU_TAU = 20.0
+AMBIENT_TAU = 60.0
+DISK_TAU = 240.0
+
+# Temperature rise in C at full airflow
+CPU_IDLE_RISE = 5.0
+CPU_LOAD_RISE = 25.0
+AMBIENT_RISE_PER_DISK = 0.08
+
+def airflow(duty):
+	return 0.15 + 0.85 * max(0, min(100, duty)) / 100.0
+
+class ThermalModel:
+	# chassis_sizes is the number of disks in each chassis, head unit first
+	def __init__(self, chassis_sizes, room=25.0, time_scale=1.0, seed=None):
+		rng = random.Random(seed)
+		self.room = room
+		self.time_scale = time_scale
+		self.cpu_load = 0.1
+		self.cpu_duty = 100
+		self.shelf_duty = [100] * len(chassis_sizes)
+		self.disk_shelf = []
+		for shelf, size in enumerate(chassis_sizes):
+			self.disk_shelf += [shelf] * size
+		# Each disk's own heat, plus extra heat a scenario can add (e.g., a disk that's scrubbing)
+		self.disk_rise = [rng.uniform(3.5, 5.5) for x in self.disk_shelf]
+		self.disk_extra = [0.0] * len(self.disk_shelf)
+		self.shelf_disks = list(chassis_sizes)
+		self.cpu_temp = room + CPU_IDLE_RISE
+		self.ambient = [room + 2.0] * len(chassis_sizes)
+		self.disk_temps = [room + 6.0] * len(self.disk_shelf)
+
+	@staticmethod
+	def _approach(value, target, dt, tau):
+		return target + (value - target) * math.exp(-dt / tau)
+
+	# Advance the model by dt wall-clock seconds
+	def step(self, dt):
+		dt *= self.time_scale
+		cpu_target = self.room + (CPU_IDLE_RISE + CPU_LOAD_RISE * self.cpu_load) / airflow(self.cpu_duty)
+		self.cpu_temp = self._approach(self.cpu_temp, cpu_target, dt, CPU_TAU)
+		flows = [airflow(duty) for duty in self.shelf_duty]
+		for shelf, flow in enumerate(flows):
+			target = self.room + AMBIENT_RISE_PER_DISK * self.shelf_disks[shelf] / flow
+			self.ambient[shelf] = self._approach(self.ambient[shelf], target, dt, AMBIENT_TAU)
+		decay = math.exp(-dt / DISK_TAU)
+		temps = self.disk_temps
+		for i, shelf in enumerate(self.disk_shelf):
+			target = self.ambient[shelf] + (self.disk_rise[i] + self.disk_extra[i]) / flows[shelf]
+			temps[i] = target + (temps[i] - target) * decay
@@ -0,0 +1,65 @@
+###
+# Tests for the fan curve lookup table, hysteresis and dwell
+###
+
+import os, sys, unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from fanctl_curve import FanCurve
+
+TEMPS = [30, 35, 40, 45]
+DUTIES = [20, 40, 60, 100]
+
+class LookupTest(unittest.TestCase):
+	def test_stepped(self):
+		curve = FanCurve(TEMPS, DUTIES)
+		self.assertEqual([curve.lookup(t) for t in (30, 31, 35, 36, 44, 45)], [20, 40, 40, 60, 100, 100])
+
+	def test_clamped_outside_the_list(self):
+		curve = FanCurve(TEMPS, DUTIES)
+		self.assertEqual(curve.lookup(-5), 20)
+		self.assertEqual(curve.lookup(90), 100)
+
+	def test_fractional_temps_round_down(self):
+		curve = FanCurve(TEMPS, DUTIES)
+		self.assertEqual(curve.lookup(35.9), 40)
+
+	def test_interpolated(self):
+		curve = FanCurve(TEMPS, DUTIES, interpolate=True)
+		self.assertEqual([curve.lookup(t) for t in (30, 32, 35, 41, 43, 45)], [20, 28, 40, 68, 84, 100])
+
+class HysteresisTest(unittest.TestCase):
+	def test_speeds_up_right_away(self):
+		curve = FanCurve(TEMPS, DUTIES, hysteresis=2, min_dwell=60)
+		self.assertEqual(curve.update(33, 0), 40)
+		self.assertEqual(curve.update(36, 1), 60)
+		self.assertEqual(curve.update(41, 2), 100)
+
+	def test_slows_down_only_past_the_margin(self):
+		curve = FanCurve(TEMPS, DUTIES, hysteresis=2)
+		self.assertEqual(curve.update(36, 0), 60)
+		# 34 is on the 40% step, but 34 + 2 is still on the 60% one
+		self.assertEqual(curve.update(34, 1), 60)
+		self.assertEqual(curve.update(33, 2), 40)
+
+	def test_bouncing_temp_is_absorbed(self):
+		curve = FanCurve(TEMPS, DUTIES, hysteresis=2)
+		for i, temp in enumerate([36, 35, 36, 35, 36, 35]): curve.update(temp, i)
+		self.assertEqual(curve.duty, 60)
+		self.assertEqual((curve.changes, curve.raw_changes, curve.avoided), (0, 5, 5))
+
+	def test_min_dwell_holds_the_duty(self):
+		curve = FanCurve(TEMPS, DUTIES, min_dwell=30)
+		curve.update(36, 0)
+		self.assertEqual(curve.update(30, 10), 60)
+		self.assertEqual(curve.update(30, 29), 60)
+		self.assertEqual(curve.update(30, 30), 20)
+		self.assertEqual(curve.last_change, 30)
+
+	def test_dwell_does_not_delay_speeding_up(self):
+		curve = FanCurve(TEMPS, DUTIES, min_dwell=30)
+		curve.update(31, 0)
+		self.assertEqual(curve.update(42, 1), 100)
+		self.assertEqual(curve.changes, 1)
+
+if __name__ == "__main__":
+	unittest.main()
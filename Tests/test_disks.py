@@ -0,0 +1,112 @@
+###
+# Tests for disk discovery and the disk inventory
+###
+
+import os, sys, shutil, tempfile, unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Primary Control Sript"))
+import fanctl_disks
+from fanctl_disks import DiskInventory, parse_smart_info
+
+SMART_INFO = """=== START OF INFORMATION SECTION ===
+Device Model:     WDC WD40EFRX-68N32N0
+Serial Number:    WD-WCC7K1234567
+User Capacity:    4,000,787,030,016 bytes [4.00 TB]
+Rotation Rate:    5400 rpm
+"""
+
+# DiskInventory with smartctl -i answered from a dict instead of the disks
+class FakeInventory(DiskInventory):
+	def __init__(self, serials, cache_file, disks):
+		self.disks = disks
+		self.probed = []
+		DiskInventory.__init__(self, serials, "smartctl", workers=4, probe_timeout=1, cache_file=cache_file)
+
+	def probe(self, node):
+		self.probed.append(node)
+		return self.disks.get(node)
+
+def hdd(serial):
+	return {"serial": serial, "ssd": False}
+
+class DiskInventoryTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.cache = os.path.join(self.dir, "disks.json")
+		self.disks = {"da0": hdd("A"), "da1": hdd("B"), "ada0": {"serial": "SSD", "ssd": True}}
+		self.identities = {"da0": "A:4000", "da1": "B:4000", "ada0": "SSD:250"}
+		# kern.disks and geom come from the dicts above
+		self.saved = fanctl_disks.list_disk_nodes, fanctl_disks.disk_identities
+		fanctl_disks.list_disk_nodes = lambda: list(self.disks)
+		fanctl_disks.disk_identities = lambda: dict(self.identities)
+
+	def tearDown(self):
+		fanctl_disks.list_disk_nodes, fanctl_disks.disk_identities = self.saved
+		shutil.rmtree(self.dir)
+
+	def inventory(self):
+		return FakeInventory(["B", "", "A"], self.cache, self.disks)
+
+	def test_parse_smart_info(self):
+		self.assertEqual(parse_smart_info(SMART_INFO), {"serial": "WD-WCC7K1234567", "ssd": False})
+		self.assertEqual(parse_smart_info("Serial Number: X\nRotation Rate:    Solid State Device\n"), {"serial": "X", "ssd": True})
+		self.assertEqual(parse_smart_info(""), {"serial": "", "ssd": False})
+
+	def test_first_scan_maps_serials_to_slots(self):
+		inventory = self.inventory()
+		self.assertEqual(sorted(inventory.scan()), [(0, "", "da1"), (2, "", "da0")])
+		self.assertEqual(inventory.slot_nodes, ["da1", "", "da0"])
+		self.assertEqual(sorted(inventory.probed), ["ada0", "da0", "da1"])
+
+	def test_warm_restart_only_probes_changed_nodes(self):
+		self.inventory().scan()
+		self.identities["da1"] = "C:4000"
+		self.disks["da1"] = hdd("C")
+		inventory = self.inventory()
+		inventory.scan()
+		self.assertEqual(inventory.probed, ["da1"])
+		self.assertEqual(inventory.slot_nodes, ["", "", "da0"])
+
+	def test_rescan_reports_only_changes(self):
+		inventory = self.inventory()
+		inventory.scan()
+		self.assertEqual(inventory.scan(), [])
+		del self.disks["da0"]
+		del self.identities["da0"]
+		self.assertEqual(inventory.scan(), [(2, "da0", "")])
+		# Moved to another node
+		self.disks["da5"] = hdd("A")
+		self.identities["da5"] = "A:4000"
+		self.assertEqual(inventory.scan(), [(2, "", "da5")])
+
+	def test_slot_nodes_is_replaced_not_changed_in_place(self):
+		inventory = self.inventory()
+		inventory.scan()
+		before = inventory.slot_nodes
+		del self.disks["da0"]
+		del self.identities["da0"]
+		inventory.scan()
+		self.assertEqual(before, ["da1", "", "da0"])
+		self.assertEqual(inventory.slot_nodes, ["da1", "", ""])
+
+	def test_swapped_disk_is_found_without_geom(self):
+		self.identities = {}
+		inventory = self.inventory()
+		inventory.scan()
+		# Disk B pulled and disk A put in its place on the same node
+		self.disks["da1"] = hdd("A")
+		del self.disks["da0"]
+		self.assertEqual(sorted(inventory.scan()), [(0, "da1", ""), (2, "da0", "da1")])
+
+	def test_failed_probes_are_retried_at_startup(self):
+		self.disks["da0"] = None
+		self.inventory().scan()
+		self.disks["da0"] = hdd("A")
+		inventory = self.inventory()
+		inventory.scan()
+		self.assertEqual(inventory.slot_nodes, ["da1", "", ""])
+		inventory.scan(retry_failed=True)
+		self.assertEqual(inventory.slot_nodes, ["da1", "", "da0"])
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,88 @@
+###
+# Tests for the display's time-series history
+###
+
+import os, sys, math, tempfile, shutil, unittest
+from array import array
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Display Scripts"))
+from fanctl_history import HistoryStore, QUERY_HEADER, RAW, MINUTE, HOUR
+
+# Unpack a query result into (tier, step, times, avg, min, max), values as lists per sample
+def unpack(data):
+	magic, version, tier, step, count, width = QUERY_HEADER.unpack_from(data)
+	offset = QUERY_HEADER.size
+	times = array("d", data[offset:offset + 8 * count]).tolist()
+	offset += 8 * count
+	values = []
+	for x in range(3):
+		flat = array("f", data[offset:offset + 4 * count * width]).tolist()
+		values.append([flat[i * width:(i + 1) * width] for i in range(count)])
+		offset += 4 * count * width
+	return (tier, step, times) + tuple(values)
+
+class HistoryTest(unittest.TestCase):
+	def test_minute_rollups_skip_empty_slots(self):
+		store = HistoryStore()
+		for t, values in ((0, [30, -1]), (20, [34, -1]), (40, [32, -1]), (60, [40, 41])):
+			store.add("hdd", t, values)
+		tier, step, times, avg, mn, mx = unpack(store.query("hdd", 0, 120, "minute"))
+		self.assertEqual((tier, step, times), (MINUTE, 60, [0.0]))
+		self.assertEqual(avg[0][0], 32)
+		self.assertEqual((mn[0][0], mx[0][0]), (30, 34))
+		self.assertTrue(math.isnan(avg[0][1]) and math.isnan(mx[0][1]))
+
+	def test_hour_rollups_weight_by_sample_count(self):
+		store = HistoryStore()
+		# Six samples in the first minute, one in the second
+		for t in range(0, 60, 10): store.add("cpu", t, [30])
+		store.add("cpu", 60, [44])
+		# The hour closes once the first minute after it does
+		store.add("cpu", 3600, [50])
+		store.add("cpu", 3660, [50])
+		tier, step, times, avg, mn, mx = unpack(store.query("cpu", 0, 7200, "hour"))
+		self.assertEqual(times, [0.0])
+		self.assertEqual((avg[0][0], mn[0][0], mx[0][0]), (32, 30, 44))
+
+	def test_ring_wraps(self):
+		store = HistoryStore(raw_samples=5)
+		for t in range(8): store.add("duty", t, [t * 10])
+		tier, step, times, avg, mn, mx = unpack(store.query("duty", 0, 100, "raw"))
+		self.assertEqual(times, [3.0, 4.0, 5.0, 6.0, 7.0])
+		self.assertEqual([v[0] for v in avg], [30, 40, 50, 60, 70])
+		self.assertEqual(unpack(store.query("duty", 4, 6, "raw"))[2], [4.0, 5.0])
+
+	def test_tier_is_picked_by_range(self):
+		store = HistoryStore(raw_samples=100, max_points=50)
+		for t in range(0, 7300, 30): store.add("duty", t, [50])
+		self.assertEqual(unpack(store.query("duty", 7000, 7300))[0], RAW)
+		self.assertEqual(unpack(store.query("duty", 3600, 5000))[0], MINUTE)
+		self.assertEqual(unpack(store.query("duty", 0, 7300))[0], HOUR)
+		self.assertIsNone(store.query("nope", 0, 10))
+
+	def test_width_change_starts_over(self):
+		store = HistoryStore()
+		store.add("hdd", 0, [30, 31])
+		store.add("hdd", 10, [30, 31, 32])
+		self.assertEqual(store.names(), {"hdd": 3})
+		self.assertEqual(unpack(store.query("hdd", 0, 100, "raw"))[2], [10.0])
+
+	def test_save_and_load(self):
+		path = os.path.join(tempfile.mkdtemp(), "history.bin")
+		self.addCleanup(shutil.rmtree, os.path.dirname(path))
+		store = HistoryStore(raw_samples=10)
+		for t in range(0, 300, 10): store.add("hdd", t, [30 + t // 60, -1])
+		store.add("cpu", 0, [40])
+		store.save(path)
+		loaded = HistoryStore(raw_samples=10)
+		self.assertEqual(loaded.load(path), 2)
+		for tier in ("raw", "minute"):
+			self.assertEqual(loaded.query("hdd", 0, 300, tier), store.query("hdd", 0, 300, tier))
+		# A raw ring of a different size starts out empty, the rollups still load
+		resized = HistoryStore(raw_samples=20)
+		resized.load(path)
+		self.assertEqual(unpack(resized.query("hdd", 0, 300, "raw"))[2], [])
+		self.assertEqual(resized.query("hdd", 0, 300, "minute"), store.query("hdd", 0, 300, "minute"))
+		self.assertEqual(HistoryStore().load(path + ".missing"), 0)
+
+if __name__ == "__main__":
+	unittest.main()
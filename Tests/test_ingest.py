@@ -0,0 +1,93 @@
+###
+# Tests for the display's ingest server
+###
+
+import os, sys, socket, time, unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Display Scripts"))
+from fanctl_ingest import IngestServer
+from fanctl_proto import FrameWriter, Record, DUTY, HDD_TEMPS
+
+def wait_for(test, timeout=5):
+	deadline = time.monotonic() + timeout
+	while not test():
+		if time.monotonic() > deadline: return False
+		time.sleep(0.01)
+	return True
+
+class IngestServerTest(unittest.TestCase):
+	def start(self, sources={"127.0.0.1": "shelf1"}, **options):
+		self.frames = []
+		self.closed = []
+		self.server = IngestServer("127.0.0.1", 0, sources, self.on_frames, on_close=self.closed.append, **options)
+		self.server.start()
+		self.addCleanup(self.server.join, 5)
+		self.addCleanup(self.server.stop)
+		self.assertTrue(wait_for(lambda: self.server._server is not None))
+		self.reply = None
+
+	def on_frames(self, conn, frames):
+		self.frames += [records for seq, records in frames]
+		if self.reply is not None: conn.send(self.reply)
+
+	def connect(self, rcvbuf=None):
+		sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		if rcvbuf: sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+		sock.settimeout(5)
+		sock.connect(self.server._server.getsockname())
+		self.addCleanup(sock.close)
+		return sock
+
+	def test_frames_reach_the_callback(self):
+		self.start()
+		sock = self.connect()
+		writer = FrameWriter()
+		sock.sendall(writer.frame([Record(DUTY, 40)]) + writer.frame([Record(DUTY, 50)]))
+		self.assertTrue(wait_for(lambda: len(self.frames) == 2))
+		self.assertEqual(self.frames, [[Record(DUTY, 40)], [Record(DUTY, 50)]])
+		self.assertEqual([conn.source for conn in self.server.conns], ["shelf1"])
+
+	def test_unknown_address_is_rejected(self):
+		self.start(sources={})
+		sock = self.connect()
+		self.assertEqual(sock.recv(100), b"")
+		self.assertEqual(self.server.rejected, 1)
+		self.assertEqual(self.server.conns, set())
+
+	def test_idle_connection_is_closed(self):
+		self.start(idle_timeout=0.2)
+		sock = self.connect()
+		sock.sendall(FrameWriter().frame([Record(DUTY, 40)]))
+		# Idle connections are only looked for once a second
+		self.assertTrue(wait_for(lambda: self.closed, 3))
+		self.assertEqual(sock.recv(100), b"")
+		self.assertEqual(self.server.timeouts, 1)
+
+	def test_peer_that_does_not_read_is_paused(self):
+		self.start(max_outbuf=65536)
+		# About 1MB of replies to every frame
+		self.reply = [Record(HDD_TEMPS, [30] * 60000)] * 16
+		sock = self.connect(rcvbuf=4096)
+		writer = FrameWriter()
+		self.assertTrue(wait_for(lambda: self.server.conns))
+		conn = next(iter(self.server.conns))
+		for i in range(100):
+			sock.sendall(writer.frame([Record(DUTY, i)]))
+			if wait_for(lambda: conn.paused, 0.05): break
+		self.assertTrue(conn.paused)
+		# Nothing more is read from it while it's paused
+		frames = len(self.frames)
+		sock.sendall(writer.frame([Record(DUTY, 100)]))
+		time.sleep(0.2)
+		self.assertEqual(len(self.frames), frames)
+		# Reading the replies lets it go again
+		deadline = time.monotonic() + 10
+		sock.settimeout(0.1)
+		while conn.paused and time.monotonic() < deadline:
+			try: sock.recv(1 << 20)
+			except socket.timeout: pass
+		self.assertFalse(conn.paused)
+		self.assertTrue(wait_for(lambda: len(self.frames) > frames))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,88 @@
+###
+# Tests for the persistent ipmitool session and its output parsing
+###
+
+import os, sys, json, shutil, tempfile, unittest
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, "..", "Primary Control Sript"))
+from fanctl_ipmi import IpmiBackend, IpmiError, parse_sensor_reading
+
+FAKE_IPMITOOL = os.path.join(HERE, "..", "Simulator", "fake_ipmitool.py")
+
+class ParseTest(unittest.TestCase):
+	def test_sensor_reading(self):
+		self.assertEqual(parse_sensor_reading("FAN1             | 1500\n", "FAN1"), 1500)
+		self.assertEqual(parse_sensor_reading("CPU Temp         | 41.000\n", "CPU Temp"), 41)
+
+	def test_sensor_with_no_reading(self):
+		self.assertEqual(parse_sensor_reading("FAN1             | \n", "FAN1"), -1)
+		self.assertEqual(parse_sensor_reading("FAN1             | na\n", "FAN1"), -1)
+
+	def test_other_sensors_and_noise_are_ignored(self):
+		output = "sensor reading FAN1\nFAN10            | 900\nFAN1             | 1200\n"
+		self.assertEqual(parse_sensor_reading(output, "FAN1"), 1200)
+		self.assertEqual(parse_sensor_reading("Unable to find sensor id 'FAN9'\n", "FAN9"), -1)
+
+	def test_echoed_command_is_stripped(self):
+		self.assertEqual(IpmiBackend._strip_echo("sensor reading FAN1\nFAN1 | 1500\n", ["sensor", "reading", "FAN1"]), "FAN1 | 1500\n")
+		self.assertEqual(IpmiBackend._strip_echo("FAN1 | 1500\n", ["sensor", "reading", "FAN1"]), "FAN1 | 1500\n")
+
+# Runs against Simulator/fake_ipmitool.py, a real executable that speaks "ipmitool shell"
+class BackendTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.environ = dict(os.environ)
+		os.environ["FAKE_IPMI_STATE"] = os.path.join(self.dir, "ipmi.json")
+		os.environ["FAKE_IPMI_FAULT_FILE"] = os.path.join(self.dir, "fault")
+		os.environ["FAKE_IPMI_MAX_RPM"] = "1800"
+		os.environ.pop("FAKE_IPMI_FAIL_RATE", None)
+		os.environ.pop("FAKE_IPMI_LATENCY", None)
+		self.ipmi = IpmiBackend(FAKE_IPMITOOL, os.path.join(self.dir, "sdr"), timeout=5)
+
+	def tearDown(self):
+		self.ipmi.close()
+		os.environ.clear()
+		os.environ.update(self.environ)
+		shutil.rmtree(self.dir)
+
+	def bmc(self):
+		with open(os.environ["FAKE_IPMI_STATE"]) as f: return json.load(f)
+
+	def test_commands_go_through_one_session(self):
+		self.ipmi.set_fan_mode_full()
+		self.ipmi.set_fan_duty(0, 50)
+		self.assertEqual(self.ipmi.sensor_reading("FAN1"), 900)
+		self.assertEqual(self.ipmi.sensor_reading("FANA"), 1800)
+		self.assertIsNotNone(self.ipmi._proc)
+		self.assertTrue(os.path.exists(os.path.join(self.dir, "sdr")))
+		self.assertEqual(self.bmc()["duty"], [50, 100])
+
+	def test_batch_sets_duty_and_reads_back(self):
+		self.assertEqual(self.ipmi.set_fan_duty_and_read(0, 25, "FAN1"), 450)
+		self.assertEqual(self.ipmi.stats["raw+sensor"][0], 1)
+
+	def test_unknown_sensor_reads_as_no_reading(self):
+		self.assertEqual(self.ipmi.sensor_reading("FAN9"), -1)
+
+	def test_raw_error_text_raises(self):
+		# The shell gives no exit status, so a failed raw command is only seen in its output
+		with self.assertRaises(IpmiError): self.ipmi.raw("0x30", "0x99")
+
+	def test_falls_back_to_one_shot_calls_without_a_session(self):
+		# Pretend the session failed a moment ago
+		self.ipmi._retry_time = float("inf")
+		self.ipmi.set_fan_duty(0, 40)
+		self.assertIsNone(self.ipmi._proc)
+		self.assertEqual(self.bmc()["duty"][0], 40)
+		with self.assertRaises(IpmiError): self.ipmi.raw("0x30", "0x99")
+
+	def test_cold_reset_drops_the_session(self):
+		os.environ["FAKE_IPMI_REBOOT_TIME"] = "60"
+		self.ipmi.sensor_reading("FAN1")
+		self.ipmi.bmc_reset_cold()
+		self.assertIsNone(self.ipmi._proc)
+		# The rebooting BMC has no readings yet
+		self.assertEqual(self.ipmi.sensor_reading("FAN1"), -1)
+
+if __name__ == "__main__":
+	unittest.main()
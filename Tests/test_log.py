@@ -0,0 +1,114 @@
+###
+# Tests for the shared logging: repeat collapsing, rotation and the line format
+###
+
+import os, sys, time, logging, tempfile, shutil, unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from fanctl_log import _RepeatFilter, _RotatingFile, _Formatter, _LogStream, _started, DATE_FORMAT, INFO, WARNING, ERROR
+
+def record(message, created, level=ERROR, name="fanctl.test", **fields):
+	rec = logging.LogRecord(name, level, __file__, 0, message, None, None)
+	rec.created = created
+	rec.fields = fields
+	return rec
+
+class Target:
+	def __init__(self):
+		self.level = 0
+		self.records = []
+
+	def handle(self, record):
+		self.records.append(record.getMessage())
+
+class RepeatFilterTest(unittest.TestCase):
+	def setUp(self):
+		self.target = Target()
+		self.filter = _RepeatFilter(self.target, 60)
+
+	def test_repeats_are_collapsed(self):
+		for i in range(5): self.filter.handle(record("Lost connection", 100 + i, peer="shelf1"))
+		self.assertEqual(self.target.records, ["Lost connection"])
+		self.filter.expire(160)
+		self.assertEqual(self.target.records, ["Lost connection", "Lost connection (repeated 4 times in the last 4 sec)"])
+		# Forgotten after the summary, so the next one is written again
+		self.filter.handle(record("Lost connection", 170, peer="shelf1"))
+		self.assertEqual(len(self.target.records), 3)
+
+	def test_different_fields_and_info_are_not_collapsed(self):
+		self.filter.handle(record("Lost connection", 100, peer="shelf1"))
+		self.filter.handle(record("Lost connection", 101, peer="shelf2"))
+		self.filter.handle(record("Started", 102, level=INFO))
+		self.filter.handle(record("Started", 103, level=INFO))
+		self.assertEqual(len(self.target.records), 4)
+
+	def test_single_message_has_no_summary(self):
+		self.filter.handle(record("Lost connection", 100, level=WARNING))
+		self.filter.expire(float("inf"))
+		self.assertEqual(self.target.records, ["Lost connection"])
+
+	def test_final_flush(self):
+		self.filter.handle(record("Lost connection", 100))
+		self.filter.handle(record("Lost connection", 110))
+		self.filter.expire(float("inf"))
+		self.assertEqual(self.target.records[-1], "Lost connection (repeated 1 times in the last 10 sec)")
+
+class RotatingFileTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join(self.dir, "fanctl.log")
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def handler(self, max_bytes=0, max_age=0):
+		handler = _RotatingFile(self.path, max_bytes, 2, max_age)
+		handler.setFormatter(_Formatter())
+		self.addCleanup(handler.close)
+		return handler
+
+	def test_started_reads_the_first_line(self):
+		self.assertAlmostEqual(_started(self.path), time.time(), delta=5)
+		with open(self.path, "w") as f: f.write("01-02-2020 03:04:05 - Started\n")
+		if getattr(os.stat(self.path), "st_birthtime", 0): self.skipTest("filesystem keeps creation times")
+		self.assertEqual(_started(self.path), time.mktime(time.strptime("01-02-2020 03:04:05", DATE_FORMAT)))
+
+	def test_rotates_by_age(self):
+		with open(self.path, "w") as f: f.write(time.strftime(DATE_FORMAT, time.localtime(time.time() - 3600)) + " - Old\n")
+		if getattr(os.stat(self.path), "st_birthtime", 0): self.skipTest("filesystem keeps creation times")
+		handler = self.handler(max_age=600)
+		handler.handle(record("New", time.time()))
+		handler.sync()
+		with open(self.path + ".1") as f: self.assertIn("Old", f.read())
+		with open(self.path) as f: self.assertIn("New", f.read())
+		# The new file is young, so the next line stays in it
+		handler.handle(record("Newer", time.time()))
+		self.assertFalse(os.path.exists(self.path + ".2"))
+
+	def test_rotates_by_size(self):
+		handler = self.handler(max_bytes=100)
+		for i in range(10): handler.handle(record("Line " + str(i) + " " + "x" * 40, time.time()))
+		handler.sync()
+		self.assertTrue(os.path.exists(self.path + ".1"))
+		self.assertTrue(os.path.exists(self.path + ".2"))
+		self.assertFalse(os.path.exists(self.path + ".3"))
+		self.assertTrue(os.path.getsize(self.path) <= 200)
+
+class FormatTest(unittest.TestCase):
+	def test_line_format(self):
+		line = _Formatter().format(record("Lost connection", time.time(), peer="shelf 1", retry_in=4))
+		self.assertTrue(line.endswith(' - ERROR: Lost connection peer="shelf 1" retry_in=4'))
+
+	def test_log_stream_keeps_tracebacks_together(self):
+		logger = logging.getLogger("fanctl.test.stream")
+		logger.propagate = False
+		self.addCleanup(setattr, logger, "propagate", True)
+		target = Target()
+		logger.addHandler(target)
+		self.addCleanup(logger.removeHandler, target)
+		stream = _LogStream(logger, ERROR)
+		stream.write("hello\nTraceback (most recent call last):\n  File \"x\", line 1\n")
+		stream.write("ValueError: bad\nbye\n")
+		self.assertEqual(target.records, ["hello", "Traceback (most recent call last):\n  File \"x\", line 1\nValueError: bad", "bye"])
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,100 @@
+###
+# Tests for the connection manager
+###
+
+import os, sys, socket, time, unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from fanctl_net import ConnectionManager
+from fanctl_proto import FrameReader, Record, DUTY, CPU_TEMPS
+
+def listener(port=0):
+	sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+	sock.bind(("127.0.0.1", port))
+	sock.listen(1)
+	sock.settimeout(5)
+	return sock
+
+def wait_for(test, timeout=5):
+	deadline = time.monotonic() + timeout
+	while not test():
+		if time.monotonic() > deadline: return False
+		time.sleep(0.01)
+	return True
+
+class ConnectionManagerTest(unittest.TestCase):
+	def setUp(self):
+		self.net = ConnectionManager(min_backoff=0.05, max_backoff=0.2, connect_timeout=1)
+		self.socks = []
+
+	def tearDown(self):
+		self.net.stop()
+		for sock in self.socks: sock.close()
+
+	def read_frames(self, conn, count):
+		reader = FrameReader()
+		frames = []
+		conn.settimeout(5)
+		while len(frames) < count: frames += reader.feed(conn.recv(4096))
+		return frames
+
+	def test_latest_value_replaces_queued_value(self):
+		server = listener()
+		self.socks.append(server)
+		peer = self.net.add("shelf1", server.getsockname())
+		for duty in (10, 20, 30): self.net.send("shelf1", "duty", [Record(DUTY, duty)])
+		self.net.send("shelf1", "cpu", [Record(CPU_TEMPS, [40, 41])])
+		self.assertEqual(peer.replaced, 2)
+		self.assertEqual(list(peer.queue), ["duty", "cpu"])
+		self.net.start()
+		conn, address = server.accept()
+		self.socks.append(conn)
+		seq, records = self.read_frames(conn, 1)[0]
+		self.assertEqual([record.type for record in records], [DUTY, CPU_TEMPS])
+		self.assertEqual(records[0].value, 30)
+		self.assertEqual(list(records[1].value), [40, 41])
+
+	def test_values_queued_while_down_are_sent_on_connect(self):
+		server = listener()
+		port = server.getsockname()[1]
+		server.close()
+		peer = self.net.add("shelf1", ("127.0.0.1", port))
+		self.net.start()
+		self.assertTrue(wait_for(lambda: peer.attempts >= 2))
+		self.assertFalse(peer.connected)
+		for duty in (10, 20): self.net.send("shelf1", "duty", [Record(DUTY, duty)])
+		server = listener(port)
+		self.socks.append(server)
+		conn, address = server.accept()
+		self.socks.append(conn)
+		self.assertEqual(self.read_frames(conn, 1)[0][1], [Record(DUTY, 20)])
+
+	def test_backoff_doubles_up_to_max(self):
+		peer = self.net.add("shelf1", ("127.0.0.1", 9))
+		backoffs = []
+		for i in range(5):
+			self.net._fail(peer, "refused", 0)
+			backoffs.append(peer.backoff)
+		self.assertEqual(backoffs, [0.05, 0.1, 0.2, 0.2, 0.2])
+		self.assertEqual(peer.next_attempt, 0.2)
+		# A connection that was up starts over at the shortest backoff
+		peer.connected = True
+		self.net._fail(peer, "closed by peer", 10)
+		self.assertEqual((peer.backoff, peer.drops), (0.05, 1))
+
+	def test_backoff_resets_on_connect(self):
+		server = listener()
+		port = server.getsockname()[1]
+		server.close()
+		peer = self.net.add("shelf1", ("127.0.0.1", port))
+		self.net.start()
+		self.assertTrue(wait_for(lambda: peer.backoff == 0.2))
+		server = listener(port)
+		self.socks.append(server)
+		conn, address = server.accept()
+		self.socks.append(conn)
+		self.assertTrue(wait_for(lambda: peer.connected))
+		self.assertEqual((peer.backoff, peer.attempts), (0, 0))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,129 @@
+###
+# Tests for the framed wire protocol and delta-encoded disk temps
+###
+
+import os, sys, unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from fanctl_proto import (FrameWriter, FrameReader, Record, CpuFans, ShelfStatus, ShelfTelemetry, ProtocolError, HEADER,
+	RECORD_HEADER, MAGIC, VERSION, MAX_RECORDS, CPU_TEMPS, CPU_FANS, HDD_TEMPS, DUTY, SHELF_STATUS, SHELF_TELEMETRY,
+	SHELF_STALLED, HddDeltaEncoder, HddDeltaDecoder, HddDelta, HDD_KEYFRAME, HDD_DELTA)
+
+RECORDS = [
+	Record(CPU_TEMPS, [40, 41, 45, 39]),
+	Record(CPU_FANS, CpuFans(60, 1200, 12.5)),
+	Record(HDD_TEMPS, [31, -1, 35]),
+	Record(DUTY, 75),
+	Record(SHELF_STATUS, ShelfStatus(50, 60, 40, 1, 1100, 28.5)),
+	Record(SHELF_TELEMETRY, ShelfTelemetry(50, 60, 1, 1100, 28.5, SHELF_STALLED)),
+]
+
+class FramingTest(unittest.TestCase):
+	def test_round_trip(self):
+		frames = FrameReader().feed(FrameWriter().frame(RECORDS))
+		self.assertEqual(len(frames), 1)
+		seq, records = frames[0]
+		self.assertEqual(seq, 1)
+		self.assertEqual([record.type for record in records], [record.type for record in RECORDS])
+		for got, sent in zip(records, RECORDS):
+			if isinstance(sent.value, list): self.assertEqual(list(got.value), sent.value)
+			else: self.assertEqual(got.value, sent.value)
+
+	def test_split_and_merged_frames(self):
+		writer = FrameWriter()
+		data = b"".join([writer.frame([Record(DUTY, duty)]) for duty in (10, 20, 30)])
+		reader = FrameReader()
+		got = []
+		# One byte at a time, then all at once
+		for i in range(len(data)): got += reader.feed(data[i:i + 1])
+		got += FrameReader().feed(data)
+		self.assertEqual([records[0].value for seq, records in got], [10, 20, 30, 10, 20, 30])
+
+	def test_resync_after_garbage(self):
+		writer = FrameWriter()
+		reader = FrameReader()
+		data = writer.frame([Record(DUTY, 10)]) + b"junk F\x00C" + writer.frame([Record(DUTY, 20)])
+		frames = reader.feed(data)
+		self.assertEqual([records[0].value for seq, records in frames], [10, 20])
+		self.assertTrue(reader.errors > 0)
+		self.assertEqual(reader.lost, 0)
+
+	def test_lost_frames_are_counted(self):
+		writer = FrameWriter()
+		reader = FrameReader()
+		reader.feed(writer.frame([Record(DUTY, 10)]))
+		writer.frame([Record(DUTY, 20)])
+		writer.frame([Record(DUTY, 30)])
+		reader.feed(writer.frame([Record(DUTY, 40)]))
+		self.assertEqual(reader.lost, 2)
+
+	def test_unknown_record_types_are_skipped(self):
+		body = b"\x01\x02\x03"
+		known = FrameWriter().frame([Record(DUTY, 55)])[HEADER.size:]
+		payload = RECORD_HEADER.pack(200, len(body)) + body + known
+		frame = HEADER.pack(MAGIC, VERSION, 2, 1, len(payload)) + payload
+		seq, records = FrameReader().feed(frame)[0]
+		self.assertEqual(records, [Record(DUTY, 55)])
+
+	def test_too_many_records(self):
+		with self.assertRaises(ProtocolError):
+			FrameWriter().frame([Record(DUTY, 1)] * (MAX_RECORDS + 1))
+
+# Send a record through a real frame, the way it goes over the wire
+def wire(record):
+	return FrameReader().feed(FrameWriter().frame([record]))[0][1][0]
+
+class HddDeltaTest(unittest.TestCase):
+	def setUp(self):
+		self.encoder = HddDeltaEncoder(keyframe_interval=300)
+		self.decoder = HddDeltaDecoder()
+		self.temps = [30 + i % 8 for i in range(24)]
+
+	def send(self, temps, now):
+		record = self.encoder.encode(temps, now)
+		if record is None: return None, None
+		got, ack = self.decoder.apply(wire(record))
+		self.encoder.ack(ack)
+		return record.type, got
+
+	def test_keyframe_then_deltas(self):
+		self.assertEqual(self.send(self.temps, 0), (HDD_KEYFRAME, self.temps))
+		self.temps[3] = 45
+		self.temps[20] = 29
+		kind, got = self.send(self.temps, 10)
+		self.assertEqual((kind, got), (HDD_DELTA, self.temps))
+
+	def test_nothing_sent_when_unchanged(self):
+		self.send(self.temps, 0)
+		self.assertEqual(self.send(self.temps, 10), (None, None))
+
+	def test_keyframe_interval(self):
+		self.send(self.temps, 0)
+		self.assertEqual(self.send(self.temps, 300), (HDD_KEYFRAME, self.temps))
+
+	def test_large_change_is_sent_as_keyframe(self):
+		self.send(self.temps, 0)
+		self.assertEqual(self.send([t + 1 for t in self.temps], 10)[0], HDD_KEYFRAME)
+
+	def test_lost_delta_does_not_break_the_chain(self):
+		self.send(self.temps, 0)
+		# Never delivered or acked; the next delta is still against the keyframe
+		self.temps[0] = 40
+		self.encoder.encode(self.temps, 10)
+		self.temps[1] = 41
+		self.assertEqual(self.send(self.temps, 20), (HDD_DELTA, self.temps))
+
+	def test_unknown_base_asks_for_a_keyframe(self):
+		self.assertEqual(self.decoder.apply(Record(HDD_DELTA, HddDelta(5, 4, [(0, 40)]))), (None, 0))
+		self.send(self.temps, 0)
+		self.encoder.ack(0)
+		self.temps[0] = 40
+		self.assertEqual(self.send(self.temps, 10), (HDD_KEYFRAME, self.temps))
+
+	def test_reset_sends_a_keyframe(self):
+		self.send(self.temps, 0)
+		self.encoder.reset()
+		self.decoder = HddDeltaDecoder()
+		self.assertEqual(self.send(self.temps, 10), (HDD_KEYFRAME, self.temps))
+
+if __name__ == "__main__":
+	unittest.main()
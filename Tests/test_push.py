@@ -0,0 +1,92 @@
+###
+# Tests for the display's change feed and page broadcaster
+###
+
+import os, sys, time, threading, unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Display Scripts"))
+from fanctl_push import ChangeFeed, Broadcaster
+
+class ChangeFeedTest(unittest.TestCase):
+	def test_changed_since(self):
+		feed = ChangeFeed()
+		feed.mark("hdd", "cpu")
+		feed.mark("duty")
+		feed.mark("cpu")
+		self.assertEqual(feed.version, 3)
+		self.assertEqual(sorted(feed.changed(0)), ["cpu", "duty", "hdd"])
+		self.assertEqual(sorted(feed.changed(1)), ["cpu", "duty"])
+		self.assertEqual(feed.changed(3), [])
+
+	def test_wait_wakes_on_mark(self):
+		feed = ChangeFeed()
+		threading.Timer(0.05, feed.mark, ("hdd",)).start()
+		start = time.monotonic()
+		self.assertEqual(feed.wait(0, 5), 1)
+		self.assertTrue(time.monotonic() - start < 2)
+		# Already past since: no wait at all
+		self.assertEqual(feed.wait(0, 5), 1)
+
+class BroadcasterTest(unittest.TestCase):
+	def setUp(self):
+		self.feed = ChangeFeed()
+		self.values = {"hdd": "[30,31]", "cpu": "[40]", "duty": "50"}
+		self.reads = []
+		self.sent = []
+		self.push = Broadcaster(self.feed, self.read, lambda payload, sid: self.sent.append((sid, payload)), window=0)
+
+	def read(self, keys):
+		self.reads.append(keys)
+		return [self.values[key] for key in keys]
+
+	def test_new_page_gets_every_key(self):
+		self.feed.mark("hdd", "cpu", "duty")
+		self.push.add_page("a")
+		self.push.push()
+		self.assertEqual(self.sent, [("a", self.values)])
+
+	def test_only_changed_keys_in_one_read(self):
+		self.feed.mark("hdd", "cpu", "duty")
+		self.push.add_page("a")
+		self.push.add_page("b")
+		self.push.push()
+		self.sent = []
+		self.reads = []
+		self.feed.mark("duty")
+		self.push.push()
+		self.assertEqual(self.reads, [["duty"]])
+		self.assertEqual(sorted(self.sent), [("a", {"duty": "50"}), ("b", {"duty": "50"})])
+		# Nothing changed: nothing read or sent
+		self.push.push()
+		self.assertEqual(len(self.reads), 1)
+
+	def test_throttled_page_gets_changes_together(self):
+		self.feed.mark("hdd", "cpu", "duty")
+		self.push.add_page("fast")
+		self.push.add_page("slow")
+		self.push.push()
+		self.push.throttle("slow", 60)
+		self.sent = []
+		self.feed.mark("hdd")
+		self.push.push()
+		self.feed.mark("cpu")
+		self.push.push()
+		self.assertEqual(self.sent, [("fast", {"hdd": "[30,31]"}), ("fast", {"cpu": "[40]"})])
+		# Once its interval is up, the slow page gets both keys in one update
+		self.push.pages["slow"].last -= 60
+		self.sent = []
+		self.push.push()
+		self.assertEqual(self.sent, [("slow", {"hdd": "[30,31]", "cpu": "[40]"})])
+
+	def test_thread_pushes_on_change(self):
+		self.push.window = 0.01
+		self.push.add_page("a")
+		self.push.start()
+		self.addCleanup(self.push.join, 5)
+		self.addCleanup(self.push.stop)
+		self.feed.mark("duty")
+		deadline = time.monotonic() + 5
+		while ("a", {"duty": "50"}) not in self.sent and time.monotonic() < deadline: time.sleep(0.01)
+		self.assertIn(("a", {"duty": "50"}), self.sent)
+
+if __name__ == "__main__":
+	unittest.main()
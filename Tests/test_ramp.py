@@ -0,0 +1,73 @@
+###
+# Tests for the shelf client's PWM ramp
+###
+
+import os, sys, unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Client Script"))
+from fanctl_ramp import Ramp
+
+class RampTest(unittest.TestCase):
+	def test_up_and_down_rates(self):
+		ramp = Ramp(25, up_rate=5, down_rate=1)
+		self.assertTrue(ramp.set_target(35, 0))
+		self.assertEqual([ramp.value(t) for t in (0, 0.5, 1, 1.9, 2)], [25, 27, 30, 34, 35])
+		ramp.set_target(30, 10)
+		self.assertEqual([ramp.value(t) for t in (10, 11, 14.9, 15)], [35, 34, 31, 30])
+		self.assertFalse(ramp.ramping(15))
+
+	def test_same_target_is_not_a_change(self):
+		ramp = Ramp(25)
+		self.assertFalse(ramp.set_target(25, 0))
+
+	def test_long_ramp_is_capped_at_max_duration(self):
+		# 75 points down at 1%/sec would take 75 sec; it's sped up to 5%/sec to finish in 15
+		ramp = Ramp(100, up_rate=5, down_rate=1, max_duration=15, jump_at=100)
+		ramp.set_target(25, 0)
+		self.assertEqual([ramp.value(t) for t in (0, 1, 5, 14.9, 15)], [100, 95, 75, 26, 25])
+		self.assertTrue(ramp.ramping(14.9))
+
+	def test_jump_at_applies_at_once(self):
+		ramp = Ramp(25, jump_at=90)
+		ramp.set_target(95, 0)
+		self.assertEqual(ramp.value(0), 95)
+		self.assertFalse(ramp.ramping(0))
+
+	def test_new_target_starts_from_where_the_ramp_is(self):
+		ramp = Ramp(25, up_rate=5)
+		ramp.set_target(75, 0)
+		ramp.set_target(50, 2)
+		self.assertEqual(ramp.value(2), 35)
+		self.assertEqual(ramp.value(2 + 15), 50)
+
+	def test_next_change_timing(self):
+		ramp = Ramp(100, up_rate=5, down_rate=1, max_duration=15)
+		ramp.set_target(25, 0)
+		self.assertAlmostEqual(ramp.next_change(0), 0.2)
+		self.assertAlmostEqual(ramp.next_change(0.05), 0.15)
+		# Wakes up exactly when the value moves, and never after the ramp ends
+		t = 0.0
+		steps = 0
+		while ramp.next_change(t) is not None:
+			before = ramp.value(t)
+			t += ramp.next_change(t) + 1e-9
+			self.assertEqual(ramp.value(t), before - 1)
+			steps += 1
+		self.assertEqual(steps, 75)
+		self.assertAlmostEqual(t, 15, places=6)
+
+	def test_emergency(self):
+		ramp = Ramp(25, up_rate=5, jump_at=100)
+		ramp.set_target(75, 0)
+		self.assertTrue(ramp.emergency(1))
+		self.assertEqual(ramp.value(1), 100)
+		self.assertFalse(ramp.ramping(1))
+		self.assertFalse(ramp.emergency(2))
+
+	def test_emergency_while_ramping_down_from_full(self):
+		ramp = Ramp(100, jump_at=100)
+		ramp.set_target(50, 0)
+		self.assertTrue(ramp.emergency(1))
+		self.assertEqual(ramp.value(1), 100)
+
+if __name__ == "__main__":
+	unittest.main()
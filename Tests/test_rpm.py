@@ -0,0 +1,141 @@
+###
+# Tests for the shelf client's tach edge RPM meter
+###
+
+import os, sys, unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Client Script"))
+from fanctl_rpm import RpmMeter, TICK_MASK, TIMEOUT
+
+# Just enough of a pigpio.pi for RpmMeter; edges are fed to the meter by hand
+class FakePi:
+	def __init__(self):
+		self.tick = 0
+		self.cancelled = False
+		self.watchdogs = []
+
+	def set_glitch_filter(self, gpio, steady):
+		self.glitch_filter = steady
+
+	def callback(self, gpio, edge, func):
+		pi = self
+		class Callback:
+			def cancel(self): pi.cancelled = True
+		return Callback()
+
+	def set_watchdog(self, gpio, timeout):
+		self.watchdogs.append(timeout)
+
+	def get_current_tick(self):
+		return self.tick
+
+class RpmMeterTest(unittest.TestCase):
+	def setUp(self):
+		self.pi = FakePi()
+		self.stalls = []
+		self.meter = RpmMeter(self.pi, 2, 0, on_stall=lambda: self.stalls.append(1))
+
+	# count edges period microseconds apart starting after tick, then set the clock to now_after past the last one
+	def spin(self, tick, period, count, now_after=1000):
+		for i in range(count):
+			tick = (tick + period) & TICK_MASK
+			self.meter._edge(2, 1, tick)
+		self.pi.tick = (tick + now_after) & TICK_MASK
+		return tick
+
+	def test_steady_speed(self):
+		# 2 pulses per rev, 20 ms apart: 1500 RPM
+		self.spin(0, 20000, 40)
+		self.assertEqual(self.meter.median_period(), 20000)
+		self.assertEqual(self.meter.median_rpm(), 1500)
+
+	def test_tick_wraparound(self):
+		# The clock wraps halfway through the periods the median is taken over
+		tick = self.spin(TICK_MASK - 100000, 20000, 10)
+		self.assertTrue(tick < 100000)
+		self.assertEqual(self.meter.median_rpm(), 1500)
+		self.assertFalse(self.meter.stalled())
+
+	def test_median_rides_out_a_missed_pulse(self):
+		tick = self.spin(0, 20000, 20)
+		tick = self.spin(tick, 40000, 1)
+		self.spin(tick, 20000, 5)
+		self.assertEqual(self.meter.median_rpm(), 1500)
+
+	def test_glitches_are_dropped(self):
+		tick = self.spin(0, 20000, 20)
+		# Faster than a fan at max_rpm could make
+		self.meter._edge(2, 1, tick + 100)
+		self.assertEqual(self.meter.glitches, 1)
+		self.spin(tick, 20000, 5)
+		self.assertEqual(self.meter.median_rpm(), 1500)
+
+	def test_stall(self):
+		tick = self.spin(0, 20000, 40)
+		# Two median periods with no edge
+		self.pi.tick = tick + 40000
+		self.assertFalse(self.meter.stalled())
+		self.pi.tick = tick + 40001
+		self.assertTrue(self.meter.stalled())
+		self.assertEqual(self.meter.median_rpm(), 0)
+
+	def test_stall_across_the_wrap(self):
+		tick = self.spin(TICK_MASK - 100000, 20000, 5, now_after=0)
+		self.assertTrue(tick > TICK_MASK - 20000)
+		self.pi.tick = (tick + 45000) & TICK_MASK
+		self.assertTrue(self.meter.stalled())
+
+	def test_no_edges_is_stalled(self):
+		self.assertTrue(self.meter.stalled())
+		self.assertEqual(self.meter.median_rpm(), 0)
+
+	def test_slow_fan_stalls_at_min_rpm(self):
+		# A single edge has no period yet, so the min_rpm limit (300 ms at 100 RPM) applies
+		self.meter._edge(2, 1, 0)
+		self.pi.tick = 300000
+		self.assertFalse(self.meter.stalled())
+		self.pi.tick = 300001
+		self.assertTrue(self.meter.stalled())
+
+	def test_instant_rpm_follows_the_last_period(self):
+		tick = self.spin(0, 20000, 20)
+		self.spin(tick, 25000, 1)
+		self.assertEqual(self.meter.rpm(), 1200)
+		self.assertEqual(self.meter.median_rpm(), 1500)
+
+	def test_watchdog_follows_the_stall_limit(self):
+		tick = self.spin(0, 20000, 20)
+		self.meter.arm_watchdog()
+		self.assertEqual(self.pi.watchdogs, [41])
+		# Unchanged limit isn't set again
+		self.meter.arm_watchdog()
+		self.assertEqual(self.pi.watchdogs, [41])
+		# Slower fan, longer watchdog
+		self.spin(tick, 30000, 20)
+		self.meter.arm_watchdog()
+		self.assertEqual(self.pi.watchdogs, [41, 61])
+		self.meter.arm_watchdog(False)
+		self.assertEqual(self.pi.watchdogs, [41, 61, 0])
+
+	def test_watchdog_is_off_while_stalled(self):
+		tick = self.spin(0, 20000, 20)
+		self.meter.arm_watchdog()
+		self.pi.tick = tick + 50000
+		self.meter.arm_watchdog()
+		self.assertEqual(self.pi.watchdogs, [41, 0])
+
+	def test_watchdog_timeout_calls_on_stall(self):
+		tick = self.spin(0, 20000, 20)
+		self.meter._edge(2, TIMEOUT, tick + 41000)
+		self.assertEqual(self.stalls, [1])
+		# Not counted as an edge
+		self.assertEqual(self.meter.edges, 20)
+
+	def test_cancel(self):
+		self.spin(0, 20000, 20)
+		self.meter.arm_watchdog()
+		self.meter.cancel()
+		self.assertTrue(self.pi.cancelled)
+		self.assertEqual(self.pi.watchdogs[-1], 0)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,101 @@
+###
+# Tests for the shared task scheduler
+###
+
+import os, sys, time, threading, unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from fanctl_sched import Scheduler
+
+# Wait up to timeout seconds for check() to come true
+def wait_for(check, timeout=2.0):
+	deadline = time.monotonic() + timeout
+	while time.monotonic() < deadline:
+		if check(): return True
+		time.sleep(0.005)
+	return check()
+
+class SchedulerTest(unittest.TestCase):
+	def setUp(self):
+		self.errors = []
+		self.scheduler = Scheduler(on_error=lambda task, e: self.errors.append((task.name, e)))
+
+	def tearDown(self):
+		self.scheduler.stop()
+
+	def test_periodic_task_keeps_its_period(self):
+		runs = []
+		self.scheduler.add("tick", 0.05, lambda: runs.append(time.monotonic()))
+		self.scheduler.start()
+		time.sleep(0.32)
+		self.assertTrue(5 <= len(runs) <= 8, runs)
+		self.assertEqual(self.scheduler.tasks["tick"].overruns, 0)
+
+	def test_trigger_only_task_runs_when_triggered(self):
+		ran = threading.Event()
+		self.scheduler.add("ramp", None, ran.set)
+		self.scheduler.start()
+		self.assertFalse(ran.wait(0.1))
+		self.scheduler.trigger("ramp")
+		self.assertTrue(ran.wait(1))
+
+	def test_trigger_never_pushes_a_task_later(self):
+		ran = threading.Event()
+		self.scheduler.add("task", None, ran.set)
+		self.scheduler.trigger("task", 0.05)
+		self.scheduler.trigger("task", 10)
+		self.scheduler.start()
+		self.assertTrue(ran.wait(1))
+
+	def test_trigger_while_running_reruns_once(self):
+		release = threading.Event()
+		started = threading.Semaphore(0)
+		runs = []
+		def slow():
+			runs.append(1)
+			started.release()
+			if len(runs) == 1: release.wait(1)
+		self.scheduler.add("slow", None, slow)
+		self.scheduler.start()
+		self.scheduler.trigger("slow")
+		self.assertTrue(started.acquire(timeout=1))
+		self.scheduler.trigger("slow")
+		time.sleep(0.02)
+		self.scheduler.trigger("slow")
+		release.set()
+		self.assertTrue(started.acquire(timeout=1))
+		time.sleep(0.1)
+		self.assertEqual(len(runs), 2)
+
+	def test_slow_periodic_task_counts_overruns(self):
+		task = self.scheduler.add("slow", 0.02, lambda: time.sleep(0.1))
+		self.scheduler.start()
+		self.assertTrue(wait_for(lambda: task.overruns >= 3))
+		self.assertTrue(task.runs <= 3)
+
+	def test_tasks_on_a_lane_never_overlap(self):
+		active = []
+		overlaps = []
+		def work():
+			active.append(1)
+			if len(active) > 1: overlaps.append(1)
+			time.sleep(0.01)
+			active.pop()
+		self.scheduler.add("a", 0.01, work, lane="bmc")
+		self.scheduler.add("b", 0.01, work, lane="bmc")
+		self.scheduler.start()
+		time.sleep(0.2)
+		self.assertEqual(overlaps, [])
+
+	def test_exception_is_reported_and_lane_keeps_going(self):
+		runs = []
+		def flaky():
+			runs.append(1)
+			if len(runs) == 1: raise ValueError("boom")
+		self.scheduler.add("flaky", 0.02, flaky)
+		self.scheduler.start()
+		self.assertTrue(wait_for(lambda: len(runs) >= 3))
+		self.assertEqual(len(self.errors), 1)
+		self.assertEqual(self.errors[0][0], "flaky")
+
+if __name__ == "__main__":
+	unittest.main()
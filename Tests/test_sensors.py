@@ -0,0 +1,58 @@
+###
+# Tests for the CPU temperature backends
+###
+
+import os, sys, shutil, tempfile, unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Primary Control Sript"))
+from fanctl_sensors import HwmonTempBackend, SysctlTempBackend, open_cpu_temp_backend
+
+class HwmonTest(unittest.TestCase):
+	def setUp(self):
+		self.root = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.root)
+
+	# One hwmon device: driver name, then {N: (label, millidegrees)}
+	def hwmon(self, index, driver, sensors):
+		path = os.path.join(self.root, "hwmon" + str(index))
+		os.mkdir(path)
+		with open(os.path.join(path, "name"), "w") as f: f.write(driver + "\n")
+		for n, (label, value) in sensors.items():
+			self.set(index, n, value)
+			if label:
+				with open(os.path.join(path, "temp" + str(n) + "_label"), "w") as f: f.write(label + "\n")
+
+	def set(self, index, n, value):
+		with open(os.path.join(self.root, "hwmon" + str(index), "temp" + str(n) + "_input"), "w") as f: f.write(str(value) + "\n")
+
+	def test_reads_labelled_cores_in_order(self):
+		self.hwmon(0, "acpitz", {1: ("", 27800)})
+		self.hwmon(1, "coretemp", {1: ("Package id 0", 50000), 2: ("Core 0", 45000), 3: ("Core 1", 47500), 10: ("Core 8", 41000)})
+		backend = HwmonTempBackend(self.root)
+		self.assertEqual(list(backend.read()), [45.0, 47.5, 41.0])
+		# Files stay open and are re-read from the start
+		self.set(1, 2, 52000)
+		self.assertEqual(list(backend.read()), [52.0, 47.5, 41.0])
+		backend.close()
+
+	def test_unlabelled_sensors_are_all_used(self):
+		self.hwmon(0, "k10temp", {1: ("", 61250), 2: ("", 58000)})
+		backend = HwmonTempBackend(self.root)
+		self.assertEqual(list(backend.read()), [61.25, 58.0])
+		backend.close()
+
+	def test_no_cpu_sensors(self):
+		self.hwmon(0, "nvme", {1: ("Composite", 40000)})
+		with self.assertRaises(OSError): HwmonTempBackend(self.root)
+
+class BackendChoiceTest(unittest.TestCase):
+	@unittest.skipIf(sys.platform.startswith("freebsd"), "sysctl backend works on FreeBSD")
+	def test_sysctl_backend_needs_freebsd(self):
+		with self.assertRaises(OSError): SysctlTempBackend()
+
+	def test_named_backend(self):
+		self.assertEqual(open_cpu_temp_backend("pipeline").name, "pipeline")
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,86 @@
+###
+# Tests for the adaptive disk poll schedule and the SMART poller
+###
+
+import os, sys, unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Primary Control Sript"))
+from fanctl_smart import PollSchedule, SmartPoller, parse_smart_temp, STANDBY
+
+def schedule():
+	return PollSchedule([30, 35, 40], min_interval=10, base_interval=60, max_interval=300, standby_interval=600)
+
+class PollScheduleTest(unittest.TestCase):
+	def test_margin_to_next_step(self):
+		s = schedule()
+		self.assertEqual(s.margin(25), 6)
+		self.assertEqual(s.margin(30), 1)
+		self.assertEqual(s.margin(33), 3)
+		self.assertEqual(s.margin(41), 0)
+
+	def test_interval_follows_margin(self):
+		s = schedule()
+		s.update("cool", 20, 0)
+		s.update("near", 34, 0)
+		s.update("edge", 35, 0)
+		s.update("top", 45, 0)
+		self.assertEqual(s.due(["cool", "near", "edge", "top"], 10), ["edge", "top"])
+		self.assertEqual(s.due(["cool", "near", "edge", "top"], 60), ["near", "edge", "top"])
+		self.assertEqual(s.due(["cool", "near", "edge", "top"], 300), ["cool", "near", "edge", "top"])
+
+	def test_heating_disk_is_polled_sooner(self):
+		s = schedule()
+		s.update("sda", 20, 0)
+		# 20 -> 24 in 10 sec is 0.4 C/sec, smoothed to 0.2; 7 degrees of margin left, so due in 17.5 sec instead of 300
+		s.update("sda", 24, 10)
+		self.assertEqual(s.due(["sda"], 27), [])
+		self.assertEqual(s.due(["sda"], 27.5), ["sda"])
+
+	def test_new_and_empty_nodes(self):
+		s = schedule()
+		self.assertEqual(s.due(["sda", "", "sdb"], 0), ["sda", "sdb"])
+
+	def test_missed_disk_is_retried_at_the_minimum_interval(self):
+		s = schedule()
+		s.update("sda", 20, 0)
+		s.missed("sda", 100)
+		self.assertEqual(s.due(["sda"], 109), [])
+		self.assertEqual(s.due(["sda"], 110), ["sda"])
+		# The last good temp is kept for the rate calculation
+		self.assertEqual(s._disks["sda"][1], 20)
+
+	def test_standby_disk_waits_the_standby_interval(self):
+		s = schedule()
+		s.standby("sda", 0)
+		self.assertEqual(s.due(["sda"], 599), [])
+		self.assertEqual(s.due(["sda"], 600), ["sda"])
+
+class FakePoller(SmartPoller):
+	def __init__(self, results):
+		SmartPoller.__init__(self, "smartctl", workers=2, disk_timeout=1, sweep_budget=1)
+		self.results = results
+
+	def read_temp(self, node):
+		return self.results[node]
+
+class SmartPollerTest(unittest.TestCase):
+	def test_parse_smart_temp(self):
+		line = "194 Temperature_Celsius     0x0022   064   045   000    Old_age   Always       -       36 (Min/Max 20/55)"
+		self.assertEqual(parse_smart_temp("header\n" + line + "\n"), 36)
+		self.assertEqual(parse_smart_temp("no attributes here"), 0)
+
+	def test_failed_read_keeps_last_temp_and_retries_soon(self):
+		poller = FakePoller({"sda": 40, "sdb": 30})
+		s = schedule()
+		result = poller.sweep(["sda", "sdb"], s)
+		self.assertEqual(result.temps, [40, 30])
+		poller.results = {"sda": None, "sdb": STANDBY}
+		for node in ("sda", "sdb"): s._disks[node][0] = 0
+		result = poller.sweep(["sda", "sdb"], s)
+		self.assertEqual(result.temps, [40, 30])
+		self.assertEqual((result.missed, result.standby), (1, 1))
+		next_sda = s._disks["sda"][0]
+		self.assertAlmostEqual(next_sda - s._disks["sda"][2], s.min_interval, delta=s.min_interval)
+		self.assertTrue(s._disks["sdb"][0] > next_sda)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,54 @@
+###
+# Tests for the shared system topology
+###
+
+import os, sys, json, tempfile, unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from fanctl_topology import Topology, TopologyError, load_topology, DEFAULT_PATH
+
+def topology():
+	return Topology({"head": "10.0.1.2", "display": "10.0.10.100", "chassis": [
+		{"name": "HEAD 00", "controller": "10.0.10.0", "rows": 2, "cols": 2, "serials": ["A", "B", "", "C"]},
+		{"name": "SHELF 01", "controller": "10.0.10.1", "rows": 1, "cols": 4, "serials": ["D", "E"]},
+		{"name": "SHELF 02", "controller": "10.0.10.2", "rows": 1, "cols": 2},
+	]})
+
+class TopologyTest(unittest.TestCase):
+	def test_slot_ranges(self):
+		t = topology()
+		self.assertEqual(t.port, 10000)
+		self.assertEqual((t.num_chassis, t.num_disks), (3, 8))
+		self.assertEqual([(c.start, c.end) for c in t.chassis], [(0, 4), (4, 6), (6, 8)])
+		self.assertEqual(t.serials, ["A", "B", "", "C", "D", "E", "", ""])
+		self.assertEqual(t.locate(0), (0, 1))
+		self.assertEqual(t.locate(5), (1, 2))
+		self.assertEqual(t.locate(7), (2, 2))
+
+	def test_chassis_max_and_hot_slots(self):
+		t = topology()
+		temps = [30, 36, -1, 36, 41, 33, -1, -1]
+		self.assertEqual(t.chassis_max(temps), [36, 41, 0])
+		self.assertEqual(t.hot_slots(temps), [1, 3, 4])
+
+	def test_layout_has_no_addresses(self):
+		layout = topology().layout()
+		self.assertEqual(layout["chassis"][1], {"name": "SHELF 01", "rows": 1, "cols": 4, "start": 4, "end": 6})
+		self.assertNotIn("controller", json.dumps(layout))
+
+	def test_too_many_serials(self):
+		with self.assertRaises(TopologyError):
+			Topology({"head": "h", "display": "d", "chassis": [{"name": "X", "controller": "c", "rows": 1, "cols": 1, "serials": ["A", "B"]}]})
+
+	def test_missing_fields(self):
+		with self.assertRaises(TopologyError): Topology({"head": "h", "chassis": []})
+		with self.assertRaises(TopologyError): Topology({"head": "h", "display": "d", "chassis": []})
+
+	def test_load(self):
+		self.assertTrue(load_topology(DEFAULT_PATH).num_chassis >= 1)
+		with tempfile.NamedTemporaryFile("w", suffix=".json") as f:
+			f.write("{not json")
+			f.flush()
+			with self.assertRaises(TopologyError): load_topology(f.name)
+
+if __name__ == "__main__":
+	unittest.main()
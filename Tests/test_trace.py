@@ -0,0 +1,126 @@
+###
+# Tests for trace recording, reading and replay
+###
+
+import os, sys, shutil, tempfile, unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Primary Control Sript"))
+from fanctl_trace import (TraceWriter, read_trace, replay, MAX_OFFSET, LAYOUT, CORE_TEMPS, FAN_RPM, CPU_DUTY,
+	SHELF_DUTIES, DISK_TEMPS, BMC_EVENT, BMC_RESET)
+from fanctl_curve import FanCurve
+
+class TraceTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join(self.dir, "fanctl.trace")
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def read(self):
+		return [(rtype, value) for t, rtype, value in read_trace(self.path)]
+
+	def test_round_trip(self):
+		w = TraceWriter(self.path)
+		w.layout([4, 8])
+		w.core_temps([40, 45])
+		w.fan_rpm(1200)
+		w.cpu_duty(30)
+		w.shelf_duties([25, 50])
+		w.event(BMC_RESET)
+		w.close()
+		self.assertEqual(self.read(), [(LAYOUT, [4, 8]), (CORE_TEMPS, [40, 45]), (FAN_RPM, 1200), (CPU_DUTY, 30),
+			(SHELF_DUTIES, [25, 50]), (BMC_EVENT, BMC_RESET)])
+
+	def test_only_changes_are_written(self):
+		w = TraceWriter(self.path)
+		for duty in (30, 30, 40, 40, 30): w.cpu_duty(duty)
+		w.close()
+		self.assertEqual(self.read(), [(CPU_DUTY, 30), (CPU_DUTY, 40), (CPU_DUTY, 30)])
+
+	def test_disk_changes_come_back_as_full_lists(self):
+		w = TraceWriter(self.path)
+		w.disk_temps([30, 31, 0, 33], 3)
+		w.disk_temps([30, 35, 0, 33], 1)
+		w.disk_temps([30, 35, 36, 33], 4)
+		w.close()
+		self.assertEqual(self.read(), [(DISK_TEMPS, (3, [30, 31, -1, 33])), (DISK_TEMPS, (1, [30, 35, -1, 33])),
+			(DISK_TEMPS, (4, [30, 35, 36, 33]))])
+
+	def test_segment_rollover_keeps_disk_temps(self):
+		w = TraceWriter(self.path)
+		w.disk_temps([30, 31], 2)
+		w.disk_temps([30, 32], 1)
+		# Pretend the segment has run for longer than an offset can hold
+		w._base -= MAX_OFFSET / 1000.0
+		w.disk_temps([33, 32], 1)
+		w.disk_temps([33, 34], 1)
+		w.close()
+		self.assertEqual(self.read(), [(DISK_TEMPS, (2, [30, 31])), (DISK_TEMPS, (1, [30, 32])),
+			(DISK_TEMPS, (1, [33, 32])), (DISK_TEMPS, (1, [33, 34]))])
+
+	def test_reopened_file_appends_a_segment(self):
+		w = TraceWriter(self.path)
+		w.disk_temps([30, 31], 2)
+		w.close()
+		w = TraceWriter(self.path)
+		w.disk_temps([30, 32], 1)
+		w.close()
+		self.assertEqual(self.read(), [(DISK_TEMPS, (2, [30, 31])), (DISK_TEMPS, (1, [30, 32]))])
+
+	def test_torn_record_at_the_end_is_ignored(self):
+		w = TraceWriter(self.path)
+		w.cpu_duty(30)
+		w.cpu_duty(40)
+		w.close()
+		with open(self.path, "r+b") as f: f.truncate(os.path.getsize(self.path) - 1)
+		self.assertEqual(self.read(), [(CPU_DUTY, 30)])
+
+	def test_not_a_trace(self):
+		with open(self.path, "wb") as f: f.write(b"nope")
+		with self.assertRaises(ValueError): self.read()
+
+class ReplayTest(unittest.TestCase):
+	def test_replay_compares_recorded_and_replayed_duties(self):
+		records = [
+			(0, LAYOUT, [2, 4]),
+			(0, CORE_TEMPS, [40, 42]),
+			(0, CPU_DUTY, 30),
+			(0, SHELF_DUTIES, [25, 25]),
+			(0, DISK_TEMPS, (4, [30, 31, 30, 30])),
+			(10, CORE_TEMPS, [50, 52]),
+			(10, CPU_DUTY, 100),
+			(10, DISK_TEMPS, (4, [30, 38, 30, 30])),
+			(10, SHELF_DUTIES, [100, 25]),
+			(20, BMC_EVENT, BMC_RESET),
+		]
+		cpu_curve = FanCurve([45, 50], [30, 100])
+		hd_curves = [FanCurve([35, 40], [25, 100]), FanCurve([35, 40], [25, 100])]
+		result = replay(records, cpu_curve, hd_curves)
+		self.assertEqual(result.duration, 20)
+		recorded, replayed = result.cpu
+		self.assertEqual((recorded.changes, recorded.max, recorded.full), (1, 100, 10))
+		self.assertEqual((replayed.changes, replayed.max, replayed.mean), (1, 100, 65))
+		self.assertEqual(result.shelves[0][1].max, 100)
+		self.assertEqual(result.shelves[1][1].max, 25)
+		self.assertEqual((result.disk_reads, result.replay_disk_reads), (8, 8))
+		self.assertEqual((result.max_lag, result.mean_lag), (0, 0))
+		self.assertEqual(result.events, {BMC_RESET: 1})
+
+	def test_replay_from_a_file(self):
+		directory = tempfile.mkdtemp()
+		try:
+			path = os.path.join(directory, "fanctl.trace")
+			w = TraceWriter(path)
+			w.core_temps([40])
+			w.disk_temps([30, 31], 2)
+			w.disk_temps([30, 38], 1)
+			w.close()
+			result = replay(read_trace(path), FanCurve([45, 50], [30, 100]), [FanCurve([35, 40], [25, 100])])
+			self.assertEqual(result.disk_reads, 3)
+			self.assertEqual(result.shelves[0][1].max, 100)
+		finally:
+			shutil.rmtree(directory)
+
+if __name__ == "__main__":
+	unittest.main()
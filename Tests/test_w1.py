@@ -0,0 +1,73 @@
+###
+# Tests for the 1-Wire probe reader
+###
+
+import os, sys, time, tempfile, shutil, unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Client Script"))
+from fanctl_w1 import W1Reader
+
+class W1ReaderTest(unittest.TestCase):
+	def setUp(self):
+		self.base = tempfile.mkdtemp()
+		self.w1 = W1Reader(interval=10, base=self.base, conversion_time=0.01)
+
+	def tearDown(self):
+		shutil.rmtree(self.base)
+
+	# Write a probe's w1_slave the way w1_therm lays it out
+	def probe(self, probe, millidegrees, crc="YES"):
+		os.makedirs(os.path.join(self.base, probe), exist_ok=True)
+		with open(os.path.join(self.base, probe, "w1_slave"), "w") as f:
+			f.write("72 01 4b 46 7f ff 0e 10 57 : crc=57 " + crc + "\n72 01 4b 46 7f ff 0e 10 57 t=" + str(millidegrees) + "\n")
+
+	def test_reads_every_probe(self):
+		self.probe("28-000001", 23125)
+		self.probe("28-000002", 27500)
+		os.makedirs(os.path.join(self.base, "w1_bus_master1"))
+		self.w1.read_all()
+		self.assertEqual(self.w1.probes(), ["28-000001", "28-000002"])
+		self.assertEqual({probe: temp for probe, (temp, when) in self.w1.readings.items()}, {"28-000001": 23.125, "28-000002": 27.5})
+		self.assertEqual(self.w1.ambient(), 27.5)
+
+	def test_crc_error_keeps_last_good_value(self):
+		self.probe("28-000001", 23125)
+		self.w1.read_all()
+		self.probe("28-000001", 99000, crc="NO")
+		self.w1.read_all()
+		self.assertEqual(self.w1.crc_errors, {"28-000001": 1})
+		self.assertEqual(self.w1.readings["28-000001"][0], 23.125)
+
+	def test_power_on_reading_is_skipped(self):
+		self.probe("28-000001", 85000)
+		self.w1.read_all()
+		self.assertEqual(self.w1.readings, {})
+		self.assertEqual(self.w1.errors, {"28-000001": 1})
+		self.assertIsNone(self.w1.ambient())
+
+	def test_stale_readings_do_not_count(self):
+		self.probe("28-000001", 23125)
+		self.probe("28-000002", 27500)
+		self.w1.read_all()
+		self.w1.readings["28-000002"] = (27.5, time.time() - 60)
+		self.assertEqual(self.w1.ambient(max_age=30), 23.125)
+
+	def test_gone_probe_is_dropped(self):
+		self.probe("28-000001", 23125)
+		self.probe("28-000002", 27500)
+		self.w1.read_all()
+		shutil.rmtree(os.path.join(self.base, "28-000002"))
+		self.w1.read_all()
+		self.assertEqual(list(self.w1.readings), ["28-000001"])
+
+	def test_bulk_conversion(self):
+		os.makedirs(os.path.join(self.base, "w1_bus_master1"))
+		bulk = os.path.join(self.base, "w1_bus_master1", "therm_bulk_read")
+		with open(bulk, "w") as f: f.write("1\n")
+		self.assertTrue(self.w1._bulk_convert())
+		with open(bulk) as f: self.assertEqual(f.read(), "trigger\n")
+		os.remove(bulk)
+		self.assertFalse(self.w1._bulk_convert())
+
+if __name__ == "__main__":
+	unittest.main()